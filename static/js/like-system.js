@@ -1,4 +1,4 @@
-// like-system.js (using localstorage)
+// like-system.js - Product likes, stored on the server (/api/products/<id>/like/)
 document.addEventListener('DOMContentLoaded', function() {
     initializeLikeSystem();
 });
@@ -15,6 +15,22 @@ function getProductIdFromElement() {
     return urlParams.get('id') || window.location.pathname.split('/').filter(Boolean).pop();
 }
 
+function showLikeState(button, liked, likes) {
+    button.innerHTML = liked ? '<i class="fa-solid fa-heart"></i>' : '<i class="fa-regular fa-heart"></i>';
+    button.classList.toggle('liked', liked);
+    
+    const likeCount = button.parentNode.querySelector('.like-count');
+    if (likeCount) {
+        likeCount.dataset.likes = likes;
+        likeCount.textContent = likes === 1 ? '1 like' : `${likes} likes`;
+    }
+}
+
+function getShownLikes(button) {
+    const likeCount = button.parentNode.querySelector('.like-count');
+    return likeCount ? parseInt(likeCount.dataset.likes) || 0 : 0;
+}
+
 function toggleLike(event) {
     event.preventDefault();
     
@@ -26,39 +42,30 @@ function toggleLike(event) {
         return;
     }
     
-    if (isProductLiked(productId)) {
-        // Unlike
-        unlikeProduct(productId);
-        button.innerHTML = '<i class="fa-regular fa-heart"></i>';
-        button.classList.remove('liked');
-    } else {
-        // Like
-        likeProduct(productId);
-        button.innerHTML = '<i class="fa-solid fa-heart"></i>';
-        button.classList.add('liked');
-    }
-}
-
-function likeProduct(productId) {
-    const likedProducts = getLikedProducts();
-    likedProducts.push(productId);
-    localStorage.setItem('likedProducts', JSON.stringify(likedProducts));
-}
-
-function unlikeProduct(productId) {
-    let likedProducts = getLikedProducts();
-    likedProducts = likedProducts.filter(id => id !== productId);
-    localStorage.setItem('likedProducts', JSON.stringify(likedProducts));
-}
-
-function isProductLiked(productId) {
-    const likedProducts = getLikedProducts();
-    return likedProducts.includes(productId);
-}
-
-function getLikedProducts() {
-    const likedProducts = localStorage.getItem('likedProducts');
-    return likedProducts ? JSON.parse(likedProducts) : [];
+    const liked = !button.classList.contains('liked');
+    const likes = getShownLikes(button);
+    
+    // Show the change right away, the server writes it in the background
+    showLikeState(button, liked, Math.max(likes + (liked ? 1 : -1), 0));
+    
+    fetch(`/api/products/${productId}/like/`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ liked: liked })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (!data.success) {
+            console.error('Error saving like:', data.error);
+            showLikeState(button, !liked, likes);
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        showLikeState(button, !liked, likes);
+    });
 }
 
 function initializeLikeSystem() {
@@ -73,17 +80,16 @@ function initializeLikeSystem() {
             return;
         }
         
-        // Show the button
-        button.classList.remove('d-none');
-        
-        // Check if product is already liked
-        if (isProductLiked(productId)) {
-            button.innerHTML = '<i class="fa-solid fa-heart"></i>';
-            button.classList.add('liked');
-        } else {
-            button.innerHTML = '<i class="fa-regular fa-heart"></i>';
-            button.classList.remove('liked');
-        }
+        // Check if product is already liked, then show the button
+        fetch(`/api/products/${productId}/like/`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                showLikeState(button, data.liked, data.likes);
+                button.classList.remove('d-none');
+            }
+        })
+        .catch(error => console.error('Error loading likes:', error));
         
         // Remove existing event listeners (important!)
         button.removeEventListener('click', toggleLike);
@@ -25,6 +25,9 @@ class ReviewSystem {
                 this.setupCancelButton();
             }
             
+            // Load older reviews from the reviews API
+            this.initLoadMoreButton();
+            
             console.log('ReviewSystem initialized');
         });
     }
@@ -66,6 +69,45 @@ class ReviewSystem {
         }
     }
 
+    initLoadMoreButton() {
+        this.loadMoreButton = document.getElementById('load-more-reviews');
+        if (this.loadMoreButton) {
+            this.loadMoreButton.addEventListener('click', () => this.loadMoreReviews());
+        }
+    }
+
+    loadMoreReviews() {
+        const cursor = this.loadMoreButton.dataset.cursor;
+        this.loadMoreButton.disabled = true;
+
+        // Next page after the last review shown (keyset pagination, see store/reviews.py)
+        fetch(`/api/products/${this.productId}/reviews/?cursor=${encodeURIComponent(cursor)}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                data.reviews.forEach(review => {
+                    // Skip reviews already shown (e.g. added on this page meanwhile)
+                    if (!this.reviewsList.querySelector(`.review[data-review-id="${review.id}"]`)) {
+                        this.reviewsList.appendChild(this.createReviewElement(review));
+                    }
+                });
+                if (data.next_cursor) {
+                    this.loadMoreButton.dataset.cursor = data.next_cursor;
+                    this.loadMoreButton.disabled = false;
+                } else {
+                    this.loadMoreButton.remove();
+                }
+            } else {
+                console.error('Error loading reviews:', data.error);
+                this.loadMoreButton.disabled = false;
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            this.loadMoreButton.disabled = false;
+        });
+    }
+
     setupCancelButton() {
         const submitBtn = this.reviewForm.querySelector('button[type="submit"]');
         const cancelBtn = document.createElement('button');
@@ -386,6 +428,11 @@ class ReviewSystem {
     }
     
     addReviewToList(review) {
+        // Add to the top of the reviews list
+        this.reviewsList.insertBefore(this.createReviewElement(review), this.reviewsList.firstChild);
+    }
+
+    createReviewElement(review) {
         // Create new review element
         const reviewElement = document.createElement('div');
         reviewElement.className = 'review';
@@ -405,10 +452,10 @@ class ReviewSystem {
             }
         }
         
-        // Set review HTML
+        // Set review HTML (user text is set below, not as HTML)
         reviewElement.innerHTML = `
             <div class="review-header">
-                <h4>${review.username}</h4>
+                <h4></h4>
                 <div class="rating">${starsHTML}</div>
                 <span class="review-date">${dateStr}</span>
                 <div class="review-actions">
@@ -421,12 +468,13 @@ class ReviewSystem {
                 </div>
             </div>
             <div class="review-content">
-                <p>${review.comment}</p>
+                <p></p>
             </div>
         `;
+        reviewElement.querySelector('.review-header h4').textContent = review.username;
+        reviewElement.querySelector('.review-content p').textContent = review.comment;
         
-        // Add to the top of the reviews list
-        this.reviewsList.insertBefore(reviewElement, this.reviewsList.firstChild);
+        return reviewElement;
     }
 }
 
@@ -8,22 +8,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const resultsContainer = document.getElementById('search-results');
     const suggestionsContainer = document.getElementById('search-suggestions');
     const recentSearchesContainer = document.getElementById('recent-search-buttons');
-    const productSort = document.getElementById('product-sort');
-    
-    // Sorting Options for dropdown
-    if (productSort) {
-        // Name filter (Ascending and Descending)
-        const nameAscOption = document.createElement('option');
-        nameAscOption.value = 'name-asc';
-        nameAscOption.textContent = 'Name: A to Z';
-        
-        const nameDescOption = document.createElement('option');
-        nameDescOption.value = 'name-desc';
-        nameDescOption.textContent = 'Name: Z to A';
-        
-        productSort.appendChild(nameAscOption);
-        productSort.appendChild(nameDescOption);
-    }
+    const suggestList = document.getElementById('search-suggest-list');
     
     // Recent searches functionality
     function loadRecentSearches() {
@@ -109,7 +94,13 @@ document.addEventListener('DOMContentLoaded', function() {
             // Only perform search if query is at least 2 characters
             if (query.length >= 2) {
                 searchTimeout = setTimeout(() => {
-                    performLiveSearch(query);
+                    // Full results only where the page has a live results area,
+                    // otherwise just the lightweight typeahead suggestions
+                    if (resultsContainer) {
+                        performLiveSearch(query);
+                    } else if (suggestList) {
+                        fetchTypeahead(query);
+                    }
                 }, 300);
             } else if (resultsContainer) {
                 // Clear results if query is too short
@@ -215,7 +206,7 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         
         // Fetch search results
-        fetch(`/api/search?${queryString}`)
+        fetch(`/api/search/?${queryString}`)
             .then(response => response.json())
             .then(data => {
                 if (resultsContainer) {
@@ -239,6 +230,23 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
     
+    // Typeahead: fill the search box's datalist with matching product names
+    function fetchTypeahead(query) {
+        fetch(`/api/search/suggest/?query=${encodeURIComponent(query)}`)
+            .then(response => response.json())
+            .then(data => {
+                suggestList.innerHTML = '';
+                data.suggestions.forEach(product => {
+                    const option = document.createElement('option');
+                    option.value = product.name;
+                    suggestList.appendChild(option);
+                });
+            })
+            .catch(error => {
+                console.error('Error fetching search suggestions:', error);
+            });
+    }
+    
     // Display search results
     function displaySearchResults(results) {
         if (!resultsContainer) return;
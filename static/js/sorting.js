@@ -1,51 +1,23 @@
 // sorting.js - Handles Product Sorting Feature
 
+// Products are sorted by the server (using the database indexes) and split into pages,
+// so picking a sort option reloads the listing with ?sort=<mode> instead of reordering the DOM.
 document.addEventListener('DOMContentLoaded', function() {
     const sortSelect = document.getElementById('product-sort');
-    const productContainer = document.querySelector('.product-flex');
     
-    if (sortSelect && productContainer) {
+    if (sortSelect) {
         sortSelect.addEventListener('change', function() {
-            const sortValue = this.value;
-            if (!sortValue) return;
+            const params = new URLSearchParams(window.location.search);
             
-            const products = Array.from(productContainer.querySelectorAll('.product-card'));
+            if (this.value) {
+                params.set('sort', this.value);
+            } else {
+                params.delete('sort');
+            }
             
-            products.sort((a, b) => {
-                // For price sorting
-                if (sortValue.startsWith('price')) {
-                    const priceA = parseFloat(a.querySelector('.product-price').textContent.replace('$', ''));
-                    const priceB = parseFloat(b.querySelector('.product-price').textContent.replace('$', ''));
-                    
-                    return sortValue === 'price-asc' ? priceA - priceB : priceB - priceA;
-                }
-                
-                // For rating sorting
-                else if (sortValue.startsWith('rating')) {
-                    const ratingA = parseFloat(a.querySelector('.product-rating span').textContent);
-                    const ratingB = parseFloat(b.querySelector('.product-rating span').textContent);
-                    
-                    return sortValue === 'rating-asc' ? ratingA - ratingB : ratingB - ratingA;
-                }
-                
-                // For name sorting
-                else if (sortValue.startsWith('name')) {
-                    const nameA = a.querySelector('h3').textContent.toLowerCase();
-                    const nameB = b.querySelector('h3').textContent.toLowerCase();
-                    
-                    if (sortValue === 'name-asc') {
-                        return nameA.localeCompare(nameB);
-                    } else {
-                        return nameB.localeCompare(nameA);
-                    }
-                }
-                
-                return 0;
-            });
-            
-            // Clear container and append sorted products
-            productContainer.innerHTML = '';
-            products.forEach(product => productContainer.appendChild(product));
+            // A new order starts again from the first page
+            params.delete('page');
+            window.location.search = params.toString();
         });
     }
-});
\ No newline at end of file
+});
@@ -1,3 +1,315 @@
-from django.contrib import admin
+# store/admin.py
+#
+# Admin for a large catalog: changelists don't COUNT(*) whole tables, foreign keys are
+# picked with autocomplete instead of dropdowns listing every product, and bulk
+# actions run as a single UPDATE instead of saving each object.
 
-# Register your models here.
+import logging
+from decimal import Decimal
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Round
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .models import Category, Product, Review, Stock, Cart, CartItem, Order, OrderItem, ProductPage
+from .suggest import suggest_index
+from .catalog import catalog
+from . import copurchases, inventory, tasks
+
+logger = logging.getLogger(__name__)
+
+# Unfiltered changelists of tables with more rows than this show an estimated count
+ESTIMATE_COUNTS_ABOVE = 10000
+
+# Products whose page documents are deleted per statement after a bulk action
+PAGE_DELETE_BATCH = 1000
+
+
+def _estimated_rows(model, alias):
+    """Row count from the Postgres planner statistics, None if unknown"""
+    with connections[alias].cursor() as cursor:
+        # Equivalent SQL Query (no ORM equivalent):
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        row = cursor.fetchone()
+    # -1 until the table was first analyzed
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes the size of an unfiltered list from the planner statistics,
+    since COUNT(*) reads the whole table on Postgres. Filtered lists, small tables
+    and other databases are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where and connections[queryset.db].vendor == 'postgresql':
+            estimate = _estimated_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > ESTIMATE_COUNTS_ABOVE:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Filtered lists would otherwise also count the whole table for "N total"
+    show_full_result_count = False
+    list_per_page = 50
+
+
+def _bulk_update_form(modeladmin, request, queryset, form_class, title):
+    """
+    Intermediate page of a bulk action. Returns (form, None) once the user submitted a
+    valid form, otherwise (None, response) to show the form.
+    """
+    form = form_class(request.POST if 'apply' in request.POST else None)
+    if form.is_valid():
+        return form, None
+
+    select_across = request.POST.get('select_across') in ('1', 'True')
+    selected = request.POST.getlist(helpers.ACTION_CHECKBOX_NAME)
+    return None, TemplateResponse(request, 'admin/store/bulk_update.html', {
+        **modeladmin.admin_site.each_context(request),
+        'title': title,
+        'opts': modeladmin.model._meta,
+        'form': form,
+        'action': request.POST['action'],
+        'select_across': select_across,
+        'selected': selected,
+        # Counting every row of a "select all" could scan the table
+        'count': None if select_across else len(selected),
+        'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+    })
+
+
+def _catalog_changed(product_ids):
+    """
+    Call once a bulk UPDATE of products (which sends no signals) is committed: drop their
+    precomputed pages (rebuilt on the next view), the search suggestions and the catalog
+    of every process. Not before, a page or catalog built in between would be built from
+    the old values and kept.
+    """
+    for start in range(0, len(product_ids), PAGE_DELETE_BATCH):
+        # ORM Query: Delete the page documents of the products
+        # Equivalent SQL Query:
+        # DELETE FROM store_productpage WHERE product_id IN (%s, ...);
+        ProductPage.objects.filter(product_id__in=product_ids[start:start + PAGE_DELETE_BATCH]).delete()
+    suggest_index.mark_stale()
+    catalog.publish_change()
+
+
+class PriceChangeForm(forms.Form):
+    MODES = (
+        ('set', 'Set the price to'),
+        ('percent', 'Change the price by (%)'),
+    )
+
+    mode = forms.ChoiceField(choices=MODES)
+    value = forms.DecimalField(max_digits=10, decimal_places=2, help_text="E.g. -20 for 20% off")
+
+    def clean(self):
+        cleaned = super().clean()
+        mode, value = cleaned.get('mode'), cleaned.get('value')
+        if mode == 'set' and value is not None and value < 0:
+            raise forms.ValidationError("The price can't be negative")
+        if mode == 'percent' and value is not None and value <= -100:
+            raise forms.ValidationError("A discount must be less than 100%")
+        return cleaned
+
+    def price_expression(self):
+        value = self.cleaned_data['value']
+        if self.cleaned_data['mode'] == 'set':
+            return Value(value)
+        return Greatest(Round(F('price') * (1 + value / Decimal(100)), 2), Value(Decimal('0.00')))
+
+
+class CategoryMoveForm(forms.Form):
+    # Few categories, a dropdown is fine here
+    category = forms.ModelChoiceField(queryset=Category.objects.order_by('name'))
+
+
+class SetStockForm(forms.Form):
+    size = forms.CharField(max_length=10, required=False, help_text="Leave empty for products without sizes")
+    quantity = forms.IntegerField(min_value=0, help_text="Units left to sell")
+    shards = forms.IntegerField(
+        min_value=1, max_value=64, initial=1,
+        help_text="Rows to spread the stock over, more for products many people buy at once"
+    )
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    search_fields = ('name',)
+    ordering = ('name',)
+
+
+class StockInline(admin.TabularInline):
+    """
+    Shown only: saving a quantity read when the page was opened would undo the checkouts
+    made since. Stock is set with the "Set stock" action (inventory.set_stock).
+    """
+    model = Stock
+    extra = 0
+    ordering = ('size', 'shard')
+    fields = ('size', 'shard', 'quantity')
+    readonly_fields = fields
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ('name', 'category', 'price', 'rating', 'updated_at')
+    list_select_related = ('category',)
+    list_filter = ('category',)
+    search_fields = ('name',)
+    # Served by the (name, id) index, also for the product autocomplete
+    ordering = ('name', 'id')
+    autocomplete_fields = ('category',)
+    readonly_fields = ('rating', 'created_at', 'updated_at')
+    inlines = (StockInline,)
+    actions = ('change_price', 'move_to_category', 'set_stock')
+
+    @admin.action(description="Change price of selected products")
+    def change_price(self, request, queryset):
+        form, response = _bulk_update_form(self, request, queryset, PriceChangeForm, "Change price")
+        if response:
+            return response
+
+        with transaction.atomic():
+            product_ids = list(queryset.values_list('id', flat=True))
+            # ORM Query: One UPDATE for every selected product
+            # Equivalent SQL Query:
+            # UPDATE store_product SET price = GREATEST(ROUND(price * %s, 2), 0), updated_at = NOW() WHERE ...;
+            count = queryset.update(price=form.price_expression(), updated_at=timezone.now())
+            transaction.on_commit(lambda: _catalog_changed(product_ids))
+        logger.info(f"Changed the price of {count} products")
+        self.message_user(request, f"Changed the price of {count} products.", messages.SUCCESS)
+
+    @admin.action(description="Move selected products to a category")
+    def move_to_category(self, request, queryset):
+        form, response = _bulk_update_form(self, request, queryset, CategoryMoveForm, "Move to category")
+        if response:
+            return response
+
+        category = form.cleaned_data['category']
+        with transaction.atomic():
+            # Before the UPDATE, the queryset may be filtered on the old category
+            product_ids = list(queryset.values_list('id', flat=True))
+            # ORM Query: One UPDATE for every selected product
+            # Equivalent SQL Query:
+            # UPDATE store_product SET category_id = %s, updated_at = NOW() WHERE ...;
+            count = queryset.update(category=category, updated_at=timezone.now())
+            transaction.on_commit(lambda: _catalog_changed(product_ids))
+        logger.info(f"Moved {count} products to {category}")
+        self.message_user(request, f"Moved {count} products to {category}.", messages.SUCCESS)
+
+    @admin.action(description="Set stock of selected products")
+    def set_stock(self, request, queryset):
+        form, response = _bulk_update_form(self, request, queryset, SetStockForm, "Set stock")
+        if response:
+            return response
+
+        size, quantity, shards = (form.cleaned_data[name] for name in ('size', 'quantity', 'shards'))
+        count = 0
+        for product_id in queryset.values_list('id', flat=True).iterator():
+            # Locks the product's stock rows while they are set, checkouts wait for it
+            inventory.set_stock(product_id, size, quantity, shards)
+            count += 1
+        self.message_user(request, f"Set the stock of {count} products to {quantity}.", messages.SUCCESS)
+
+
+@admin.register(Review)
+class ReviewAdmin(LargeTableAdmin):
+    list_display = ('product', 'username', 'rating', 'created_at')
+    list_select_related = ('product',)
+    list_filter = ('rating',)
+    search_fields = ('=username',)
+    autocomplete_fields = ('product',)
+
+    # Keep the product ratings in line with reviews edited here
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        tasks.schedule_rating_update(obj.product_id)
+        if change and 'product' in form.changed_data:
+            tasks.schedule_rating_update(form.initial['product'])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        tasks.schedule_rating_update(obj.product_id)
+
+    def delete_queryset(self, request, queryset):
+        product_ids = set(queryset.values_list('product_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for product_id in product_ids:
+            tasks.schedule_rating_update(product_id)
+
+
+class CartItemInline(admin.TabularInline):
+    model = CartItem
+    extra = 0
+    autocomplete_fields = ('product',)
+    # Changed through store/inventory.py only, so the stock stays consistent
+    readonly_fields = ('reserved_quantity', 'reserved_until')
+
+
+@admin.register(Cart)
+class CartAdmin(LargeTableAdmin):
+    list_display = ('id', 'session_id', 'created_at', 'updated_at')
+    search_fields = ('=session_id',)
+    readonly_fields = ('created_at', 'updated_at')
+    inlines = (CartItemInline,)
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+    autocomplete_fields = ('product',)
+
+
+@admin.register(Order)
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'full_name', 'email', 'total_amount', 'status', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('=email', '=session_id')
+    readonly_fields = ('session_id', 'created_at', 'updated_at', 'in_rollups')
+    inlines = (OrderItemInline,)
+    actions = ('mark_processing', 'mark_shipped', 'mark_delivered')
+
+    # Orders are cancelled here, keep the co-purchase counts in line
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'status' in form.changed_data and 'cancelled' in (obj.status, form.initial['status']):
+            copurchases.set_cancelled(obj.id, obj.status == 'cancelled')
+
+    def _set_status(self, request, queryset, status):
+        # ORM Query: One UPDATE for every selected order
+        # Equivalent SQL Query:
+        # UPDATE store_order SET status = %s, updated_at = NOW() WHERE ...;
+        count = queryset.update(status=status, updated_at=timezone.now())
+        self.message_user(request, f"Marked {count} orders as {status}.", messages.SUCCESS)
+
+    @admin.action(description="Mark selected orders as processing")
+    def mark_processing(self, request, queryset):
+        self._set_status(request, queryset, 'processing')
+
+    @admin.action(description="Mark selected orders as shipped")
+    def mark_shipped(self, request, queryset):
+        self._set_status(request, queryset, 'shipped')
+
+    @admin.action(description="Mark selected orders as delivered")
+    def mark_delivered(self, request, queryset):
+        self._set_status(request, queryset, 'delivered')
@@ -1,14 +1,16 @@
 # store/api_views.py
 
-import os
 import logging
-import requests
+from django.conf import settings
+from django.core.paginator import Paginator
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
-from .models import Product, VisualContent, Category, Review, Cart, CartItem, Product, Order, OrderItem
+from .models import Product, VisualContent, Category, Review, Cart, CartItem, Product, Order, OrderItem, EnrichmentData
+from .suggest import suggest_index
+from .catalog import catalog
+from . import product_pages, enrichment, popularity, reports, reviews
 
 logger = logging.getLogger(__name__)
-OPENWEATHER_API_KEY = os.environ.get('OPENWEATHER_API_KEY')
 
 def api_products(request):
     """Fetch all products"""
@@ -25,49 +27,30 @@ def api_products(request):
 def api_product_detail(request, product_id):
     """Fetch product detail by ID"""
     try:
-        # Use Django's get_object_or_404
-        product = get_object_or_404(Product, id=product_id)
-        
-        # Get visual content using filter rather than a custom method
-        visuals = VisualContent.objects.filter(product=product)
+        # Product, visuals and Pokemon data come from the precomputed page document
+        document = product_pages.get_document(product_id)
+        product = document['product']
         
         # Prepare the response data
         response_data = {
             'success': True,
-            'product': {
-                'id': product.id,
-                'name': product.name,
-                'description': product.description,
-                'price': float(product.price),
-                'rating': float(product.rating),
-                'category': product.category.name if product.category else None,
-                'feature': product.feature,
-                'pokemon': product.pokemon,
-                'location': product.location,
-            },
+            'product': dict(product, price=float(product['price'])),
             'visuals': [{
-                'id': v.id,
-                'name': v.name,
-                'description': v.description,
-                'short_name': v.short_name,
-                'file_type': v.file_type
-            } for v in visuals]
+                'id': v['id'],
+                'name': v['name'],
+                'description': v['description'],
+                'short_name': v['short_name'],
+                'file_type': v['file_type']
+            } for v in document['visuals']]
         }
         
-        # Fetch pokemon data if available
-        if product.pokemon:
-            try:
-                pokemon_data = _fetch_pokemon(product.pokemon)
-                if pokemon_data.get('success'):
-                    response_data['pokemon'] = pokemon_data
-            except Exception as e:
-                logger.error(f"Failed to fetch Pokemon data: {e}")
-                # Don't fail the whole request if Pokemon data fails
+        if document['pokemon']:
+            response_data['pokemon'] = document['pokemon']
         
         # Fetch weather data if available
-        if product.location:
+        if product['location']:
             try:
-                weather_data = _fetch_weather(product.location)
+                weather_data = _fetch_weather(product['location'])
                 if weather_data.get('success'):
                     response_data['weather'] = weather_data
             except Exception as e:
@@ -103,54 +86,12 @@ def api_weather_data(request, city_name):
 # --- Helper functions ---
 
 def _fetch_pokemon(name):
-    """Helper to get Pokemon data"""
-    url = f"https://pokeapi.co/api/v2/pokemon/{name.lower()}"
-    resp = requests.get(url, timeout=5)
-    
-    if resp.status_code == 404:
-        raise ValueError(f"Pokemon '{name}' not found")
-    resp.raise_for_status()
-    
-    data = resp.json()
-    return {
-        'success': True,
-        'name': data.get('name', '').capitalize(),
-        'sprite': data.get('sprites', {}).get('front_default', ''),
-        'types': [t['type']['name'].capitalize() for t in data.get('types', [])],
-        'height': data.get('height', 0),
-        'weight': data.get('weight', 0),
-        'stats': {s['stat']['name']: s['base_stat'] for s in data.get('stats', [])}
-    }
+    """Helper to get Pokemon data (stored locally, see enrichment.py)"""
+    return enrichment.get(EnrichmentData.POKEMON, name)
 
 def _fetch_weather(city):
-    """Helper to get weather data"""
-    if not OPENWEATHER_API_KEY:
-        raise EnvironmentError("OpenWeather API key not configured")
-
-    url = f"https://api.openweathermap.org/data/2.5/weather?q={city}&appid={OPENWEATHER_API_KEY}&units=metric"
-    resp = requests.get(url, timeout=5)
-
-    if resp.status_code == 404:
-        raise ValueError(f"City '{city}' not found")
-    resp.raise_for_status()
-
-    data = resp.json()
-    temp_c = data['main']['temp']
-    temp_f = temp_c * 9 / 5 + 32
-
-    return {
-        'success': True,
-        'city': data.get('name', city),
-        'temperature_celsius': temp_c,
-        'temperature_fahrenheit': temp_f,
-        'condition': data['weather'][0]['main'],
-        'description': data['weather'][0]['description'],
-        'icon': data['weather'][0]['icon'],
-        'icon_url': f"https://openweathermap.org/img/wn/{data['weather'][0]['icon']}@2x.png",
-        'humidity': data['main']['humidity'],
-        'wind_speed': data['wind']['speed'],
-        'timestamp': data['dt']
-    }
+    """Helper to get weather data (stored locally, refreshed after ENRICHMENT_TTL)"""
+    return enrichment.get(EnrichmentData.WEATHER, city)
 
 def search_api(request):
     """API endpoint for searching products with filters"""
@@ -159,6 +100,7 @@ def search_api(request):
     min_price = request.GET.get('min_price', None)
     max_price = request.GET.get('max_price', None)
     min_rating = request.GET.get('min_rating', None)
+    sort = request.GET.get('sort', None)
     
     # Convert string parameters to appropriate types
     if min_price:
@@ -179,20 +121,129 @@ def search_api(request):
         except ValueError:
             min_rating = None
     
-    # Search products with filters
-    results = Product.search(query, category, min_price, max_price, min_rating)
+    # Search products with filters in the in-memory catalog, loading only the page shown
+    results = catalog.search(
+        query, category, min_price, max_price, min_rating, sort,
+        queryset=Product.objects.select_related('category').prefetch_related('visuals')
+    )
+    page = Paginator(results, settings.PRODUCTS_PER_PAGE).get_page(request.GET.get('page'))
     
     # If no results, suggest similar products
     suggestions = []
-    if query and not results.exists():
-        suggestions = Product.suggest_similar(query)
+    if query and not page.paginator.count:
+        suggestions = catalog.suggest_similar(query)
+    
+    # Counts per category / price range / rating for the current search
+    facets = catalog.facets(query, category, min_price, max_price, min_rating)
     
     # Format the response
-    results_data = [product.to_json() for product in results]
+    results_data = [product.to_json() for product in page]
     suggestions_data = [product.to_json() for product in suggestions]
     
     return JsonResponse({
         'results': results_data,
         'suggestions': suggestions_data,
-        'query': query
-    })
\ No newline at end of file
+        'query': query,
+        'sort': sort if sort in Product.SORT_ORDERINGS else None,
+        'page': page.number,
+        'num_pages': page.paginator.num_pages,
+        'total': page.paginator.count,
+        'facets': facets
+    })
+
+def search_suggest_api(request):
+    """Search-as-you-type suggestions: product ids, names and images for a prefix"""
+    query = request.GET.get('query', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', 8)), 20)
+    except ValueError:
+        limit = 8
+    
+    response = JsonResponse({
+        'query': query,
+        'suggestions': suggest_index.suggest(query, limit) if limit > 0 else []
+    })
+    # Let the browser reuse suggestions for a prefix it already asked for
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+def api_product_reviews(request, product_id):
+    """
+    Reviews of a product, newest first.
+    ?limit=N (default REVIEWS_PER_PAGE, at most MAX_REVIEWS_PER_PAGE)
+    &cursor=... (next_cursor of the previous page; the first page also has the summary)
+    """
+    try:
+        limit = int(request.GET.get('limit', settings.REVIEWS_PER_PAGE))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'limit must be a number'}, status=400)
+    limit = max(1, min(limit, settings.MAX_REVIEWS_PER_PAGE))
+    cursor = request.GET.get('cursor')
+
+    response_data = {'success': True}
+    if not cursor:
+        summary = reviews.get_summary(product_id)
+        if summary is None:
+            return JsonResponse({'success': False, 'error': 'Product not found'}, status=404)
+        response_data['summary'] = summary.to_json()
+
+    try:
+        page, next_cursor = reviews.get_page(product_id, limit, cursor)
+    except reviews.InvalidCursor as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    response_data['reviews'] = [{
+        'id': review.id,
+        'username': review.username,
+        'rating': review.rating,
+        'comment': review.comment,
+        'created_at': review.created_at.isoformat(),
+    } for review in page]
+    response_data['next_cursor'] = next_cursor
+    return JsonResponse(response_data)
+
+
+def api_trending_products(request):
+    """
+    Products with the most page views in the last TRENDING_HOURS, most first.
+    ?limit=N (default TRENDING_PER_PAGE, at most MAX_TRENDING)
+    """
+    try:
+        limit = int(request.GET.get('limit', settings.TRENDING_PER_PAGE))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'limit must be a number'}, status=400)
+    limit = max(1, min(limit, settings.MAX_TRENDING))
+
+    return JsonResponse({
+        'success': True,
+        'hours': settings.TRENDING_HOURS,
+        'products': [{**product.to_json(), 'views': views} for product, views in popularity.trending.products(limit)],
+    })
+
+
+def sales_report_api(request):
+    """
+    Sales for staff dashboards, read from the daily rollups.
+    ?start=YYYY-MM-DD&end=YYYY-MM-DD (default: last 30 days)
+    &group=day|product|category|size (default: day)
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'error': 'Staff only'}, status=403)
+
+    group = request.GET.get('group', 'day')
+    if group != 'day' and group not in reports.GROUPINGS:
+        return JsonResponse({'success': False, 'error': f"Unknown group '{group}'"}, status=400)
+
+    start, end = reports.parse_period(request.GET.get('start'), request.GET.get('end'))
+    if group == 'day':
+        rows = reports.sales_by_day(start, end)
+    else:
+        rows = reports.sales_by(group, start, end)
+
+    return JsonResponse({
+        'success': True,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'group': group,
+        'results': [dict(row, revenue=float(row['revenue'])) for row in rows],
+    })
@@ -4,3 +4,28 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        from django.db.models.signals import post_save, post_delete
+        from .models import Product, Category, VisualContent, Review
+        from .suggest import suggest_index
+        from .catalog import catalog
+        from .product_pages import on_product_change
+        # Register the background tasks defined outside tasks.py
+        from . import enrichment, reports  # noqa: F401
+
+        # Rebuild the search suggestions after catalog changes
+        for model in (Product, Category, VisualContent):
+            post_save.connect(suggest_index.mark_stale, sender=model, dispatch_uid=f'suggest_save_{model.__name__}')
+            post_delete.connect(suggest_index.mark_stale, sender=model, dispatch_uid=f'suggest_delete_{model.__name__}')
+
+        # Keep the search catalog in line with product and category writes
+        post_save.connect(catalog.product_saved, sender=Product, dispatch_uid='catalog_save_Product')
+        post_delete.connect(catalog.product_deleted, sender=Product, dispatch_uid='catalog_delete_Product')
+        post_save.connect(catalog.mark_stale, sender=Category, dispatch_uid='catalog_save_Category')
+        post_delete.connect(catalog.mark_stale, sender=Category, dispatch_uid='catalog_delete_Category')
+
+        # Rebuild the precomputed product page after writes to the product or what it shows
+        for model in (Product, VisualContent, Review):
+            post_save.connect(on_product_change, sender=model, dispatch_uid=f'page_save_{model.__name__}')
+            post_delete.connect(on_product_change, sender=model, dispatch_uid=f'page_delete_{model.__name__}')
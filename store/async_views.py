@@ -0,0 +1,383 @@
+# store/async_views.py
+#
+# Cart, review and like API views as coroutines, so under ASGI (wildcatwear/asgi.py) a request
+# waiting on the database doesn't hold a worker thread. They work unchanged under WSGI.
+
+import json
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Sum, F
+from django.http import JsonResponse, Http404
+from .models import Product, Review, Cart, CartItem
+from . import inventory, tasks, likes
+
+logger = logging.getLogger(__name__)
+
+
+def csrf_exempt(view):
+    """
+    Mark a coroutine view as CSRF exempt. Django 4.2's csrf_exempt wraps the view
+    in a plain function, which would hide that the view is async.
+    """
+    view.csrf_exempt = True
+    return view
+
+
+async def _aget_or_404(queryset, **kwargs):
+    """Async get_object_or_404 (django.shortcuts has none before Django 5.0)"""
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+
+
+async def _asession_key(request):
+    """Session key of the request, creating the session if needed"""
+    if not request.session.session_key:
+        # Session stores have no async API before Django 5.0
+        await sync_to_async(request.session.create)()
+    return request.session.session_key
+
+
+async def _aget_cart(session_id):
+    """
+    Get or create a cart for the given session ID
+
+    # ORM Query:
+    cart, created = await Cart.objects.aget_or_create(session_id=session_id)
+
+    # Equivalent SQL:
+    # SELECT * FROM store_cart WHERE session_id = %s LIMIT 1;
+    # If not found:
+    # INSERT INTO store_cart (session_id, created_at, updated_at) VALUES (%s, NOW(), NOW());
+    """
+    cart, created = await Cart.objects.aget_or_create(session_id=session_id)
+    if created:
+        logger.info(f"Created new cart for session {session_id}")
+    return cart
+
+
+async def _acart_total(cart):
+    # ORM Query: Cart total in the database
+    # Equivalent SQL Query:
+    # SELECT SUM(p.price * ci.quantity) FROM store_cartitem ci
+    # JOIN store_product p ON ci.product_id = p.id WHERE ci.cart_id = %s;
+    total = await cart.items.aaggregate(total=Sum(F('product__price') * F('quantity')))
+    return float(total['total'] or 0)
+
+
+@csrf_exempt
+async def get_cart(request):
+    """Get the current cart items for a session"""
+    session_id = await _asession_key(request)
+    cart = await _aget_cart(session_id)
+
+    # ORM Query: Get all cart items with product details and images
+    # Equivalent SQL Query:
+    # SELECT ci.*, p.* FROM store_cartitem ci
+    # JOIN store_product p ON ci.product_id = p.id
+    # WHERE ci.cart_id = %s;
+    # SELECT * FROM store_visualcontent WHERE product_id IN (%s, ...);
+    items = [
+        item async for item in cart.items.select_related('product').prefetch_related('product__visuals')
+    ]
+
+    cart_items = []
+    for item in items:
+        product = item.product
+        cart_items.append({
+            'id': item.id,
+            'product_id': product.id,
+            'name': product.name,
+            'price': float(product.price),
+            'quantity': item.quantity,
+            'size': item.size,
+            'subtotal': float(item.subtotal),
+            'image': product.get_primary_image_name()
+        })
+
+    return JsonResponse({
+        'cart_id': cart.id,
+        'total': float(sum(item.subtotal for item in items)),
+        'items': cart_items
+    })
+
+
+@csrf_exempt
+async def add_to_cart(request):
+    """Add an item to the cart"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        product_id = data.get('product_id')
+        quantity = int(data.get('quantity', 1))
+        size = data.get('size')
+
+        # Validate product exists
+        product = await _aget_or_404(Product.objects, id=product_id)
+
+        # Get or create cart
+        session_id = await _asession_key(request)
+        cart = await _aget_cart(session_id)
+
+        # ORM Query: Get cart item if exists in cart
+        # Equivalent SQL Query:
+        # SELECT * FROM store_cartitem
+        # WHERE cart_id = %s AND product_id = %s AND (size = %s OR (size IS NULL AND %s IS NULL));
+        existing_item = await cart.items.filter(
+            product=product,
+            size=size
+        ).afirst()
+
+        if existing_item:
+            # Update the quantity and hold the extra units
+            await sync_to_async(inventory.reserve)(existing_item, existing_item.quantity + quantity)
+            logger.info(f"Updated cart item quantity: {existing_item.id}")
+            item = existing_item
+        else:
+            # ORM Query: Create new cart item
+            # Equivalent SQL Query:
+            # INSERT INTO store_cartitem (cart_id, product_id, quantity, size, created_at)
+            # VALUES (%s, %s, %s, %s, NOW());
+            item = await CartItem.objects.acreate(
+                cart=cart,
+                product=product,
+                quantity=quantity,
+                size=size
+            )
+            try:
+                await sync_to_async(inventory.reserve)(item, quantity)
+            except inventory.OutOfStock:
+                await item.adelete()
+                raise
+            logger.info(f"Added new item to cart: {item.id}")
+
+        # Keep the cart out of the stale cart purge while it is in use
+        await cart.atouch()
+
+        return JsonResponse({
+            'success': True,
+            'item_id': item.id,
+            'cart_total': await _acart_total(cart)
+        })
+
+    except inventory.OutOfStock as e:
+        return JsonResponse({'success': False, 'error': str(e), 'available': e.available}, status=409)
+    except Exception as e:
+        logger.error(f"Error adding to cart: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+
+@csrf_exempt
+async def update_cart_item(request, item_id):
+    """Update cart item quantity"""
+    if request.method != 'PUT':
+        return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        quantity = int(data.get('quantity', 1))
+
+        # ORM Query: Get cart item with its cart
+        # Equivalent SQL Query:
+        # SELECT * FROM store_cartitem JOIN store_cart ON ... WHERE store_cartitem.id = %s;
+        item = await _aget_or_404(CartItem.objects.select_related('cart'), id=item_id)
+
+        # Verify session owns this cart item
+        session_id = request.session.session_key
+        if item.cart.session_id != session_id:
+            return JsonResponse({'success': False, 'error': 'Unauthorized'}, status=403)
+
+        if quantity <= 0:
+            # Delete item if quantity is 0 or less, putting back the units it holds
+            # ORM Query: Delete cart item
+            # Equivalent SQL Query:
+            # DELETE FROM store_cartitem WHERE id = %s;
+            await sync_to_async(inventory.discard)(CartItem.objects.filter(id=item.id))
+            logger.info(f"Deleted cart item: {item_id}")
+        else:
+            # Update the quantity, holding or putting back the difference
+            await sync_to_async(inventory.reserve)(item, quantity)
+            logger.info(f"Updated cart item quantity: {item_id}")
+
+        cart = item.cart
+        await cart.atouch()
+        return JsonResponse({
+            'success': True,
+            'cart_total': await _acart_total(cart)
+        })
+
+    except inventory.OutOfStock as e:
+        return JsonResponse({'success': False, 'error': str(e), 'available': e.available}, status=409)
+    except Exception as e:
+        logger.error(f"Error updating cart item: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+
+@csrf_exempt
+async def remove_from_cart(request, item_id):
+    """Remove an item from the cart"""
+    if request.method != 'DELETE':
+        return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
+
+    try:
+        # ORM Query: Get cart item with its cart
+        # Equivalent SQL Query:
+        # SELECT * FROM store_cartitem JOIN store_cart ON ... WHERE store_cartitem.id = %s;
+        item = await _aget_or_404(CartItem.objects.select_related('cart'), id=item_id)
+
+        # Verify session owns this cart item
+        session_id = request.session.session_key
+        if item.cart.session_id != session_id:
+            return JsonResponse({'success': False, 'error': 'Unauthorized'}, status=403)
+
+        cart = item.cart
+
+        # ORM Query: Delete cart item, putting back the units it holds
+        # Equivalent SQL Query:
+        # DELETE FROM store_cartitem WHERE id = %s;
+        await sync_to_async(inventory.discard)(CartItem.objects.filter(id=item.id))
+        logger.info(f"Removed item from cart: {item_id}")
+        await cart.atouch()
+
+        return JsonResponse({
+            'success': True,
+            'cart_total': await _acart_total(cart)
+        })
+
+    except Exception as e:
+        logger.error(f"Error removing from cart: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+
+@csrf_exempt
+async def add_review_api(request):
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            product_id = data.get('product_id')
+
+            product = await _aget_or_404(Product.objects, id=product_id)
+
+            # ORM Query: Create new review
+            # Equivalent SQL Query:
+            # INSERT INTO store_review (product_id, username, rating, comment, created_at)
+            # VALUES (%s, %s, %s, %s, NOW())
+            review = await Review.objects.acreate(
+                product=product,
+                username=data.get('username'),
+                rating=int(data.get('rating')),
+                comment=data.get('comment')
+            )
+
+            # Update product rating in the background (see tasks.py)
+            await sync_to_async(tasks.schedule_rating_update)(product.id)
+
+            return JsonResponse({'success': True, 'review': review.to_json()})
+        except Exception as e:
+            return JsonResponse({'success': False, 'error': str(e)})
+
+    return JsonResponse({'success': False, 'error': 'Invalid request method'})
+
+
+@csrf_exempt
+async def update_review_api(request, review_id):
+    if request.method != 'PUT':
+        return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        review = await _aget_or_404(Review.objects.select_related('product'), id=review_id)
+
+        # Simple authentication check - match username
+        if review.username != data.get('username'):
+            return JsonResponse({'success': False, 'error': 'Username does not match'}, status=403)
+
+        # Update review fields
+        if 'rating' in data:
+            review.rating = int(data.get('rating'))
+
+        if 'comment' in data:
+            review.comment = data.get('comment')
+
+        # Save the updated review
+        await review.asave()
+
+        # Update product rating in the background
+        await sync_to_async(tasks.schedule_rating_update)(review.product_id)
+
+        return JsonResponse({'success': True, 'review': review.to_json()})
+
+    except Exception as e:
+        logger.error(f"Error updating review: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+
+@csrf_exempt
+async def delete_review_api(request, review_id):
+    if request.method != 'DELETE':
+        return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
+
+    try:
+        review = await _aget_or_404(Review.objects, id=review_id)
+
+        # Simple authentication check from request body
+        data = json.loads(request.body)
+        if review.username != data.get('username'):
+            return JsonResponse({'success': False, 'error': 'Username does not match'}, status=403)
+
+        # Get product before deleting review for rating update
+        product_id = review.product_id
+
+        # Delete the review
+        await review.adelete()
+
+        # Update product rating in the background (0 if no reviews are left)
+        await sync_to_async(tasks.schedule_rating_update)(product_id)
+
+        return JsonResponse({'success': True})
+
+    except Exception as e:
+        logger.error(f"Error deleting review: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+
+@csrf_exempt
+async def product_like_api(request, product_id):
+    """
+    GET: whether this visitor likes the product, and its number of likes.
+    POST {"liked": true|false}: like or unlike it (written in the background, see likes.py).
+    """
+    if request.method not in ('GET', 'POST'):
+        return JsonResponse({'success': False, 'error': 'Invalid request method'}, status=405)
+
+    # ORM Query: The product exists (a primary key lookup, the like itself is buffered)
+    # Equivalent SQL Query:
+    # SELECT 1 FROM store_product WHERE id = %s LIMIT 1;
+    if not await Product.objects.filter(id=product_id).aexists():
+        return JsonResponse({'success': False, 'error': 'Product not found'}, status=404)
+
+    session_id = await _asession_key(request)
+
+    if request.method == 'POST':
+        try:
+            liked = json.loads(request.body).get('liked', True)
+        except (ValueError, AttributeError):
+            return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+        if not isinstance(liked, bool):
+            return JsonResponse({'success': False, 'error': 'liked must be true or false'}, status=400)
+
+        if settings.LIKES_FLUSH_INTERVAL:
+            # Only buffered, no writes
+            taken = likes.buffer.set(product_id, session_id, liked)
+        else:
+            taken = await sync_to_async(likes.buffer.set)(product_id, session_id, liked)
+        if not taken:
+            return JsonResponse({'success': False, 'error': 'Likes are not being saved right now, try again shortly'}, status=503)
+        return JsonResponse({'success': True, 'liked': liked})
+
+    liked, count = await sync_to_async(likes.get_state)(product_id, session_id)
+    return JsonResponse({'success': True, 'liked': liked, 'likes': count})
@@ -0,0 +1,72 @@
+# store/bulk.py
+#
+# Shared by the counters written in bulk (page views, likes, co-purchases): adding to
+# stored counts a batch of rows per statement, and the background thread that writes a
+# process's in-memory buffer every few seconds.
+
+import threading
+from django.db import connection, connections
+
+# Rows per INSERT statement
+INSERT_BATCH = 300
+
+
+def add_counts(model, key_fields, count_field, rows):
+    """
+    Add rows of (*keys, count) to the count_field of the model's rows with those
+    keys, creating the rows that don't exist yet. Needs a unique constraint on
+    key_fields. Run it in a transaction, with the rows in key order so concurrent
+    callers lock them in the same order.
+    """
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    keys = [quote(model._meta.get_field(field).column) for field in key_fields]
+    count = quote(model._meta.get_field(count_field).column)
+    placeholders = "(" + ", ".join(["%s"] * (len(keys) + 1)) + ")"
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), INSERT_BATCH):
+            batch = rows[start:start + INSERT_BATCH]
+            # Equivalent SQL Query (no ORM equivalent, bulk_create can't add to the existing count):
+            # INSERT INTO store_productviews (product_id, hour, views) VALUES (%s, %s, %s), ...
+            # ON CONFLICT (product_id, hour) DO UPDATE SET views = store_productviews.views + EXCLUDED.views;
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(keys)}, {count}) VALUES "
+                + ", ".join([placeholders] * len(batch))
+                + f" ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {count} = {table}.{count} + EXCLUDED.{count}",
+                [value for row in batch for value in row]
+            )
+
+
+class Flusher:
+    """
+    Thread calling flush() every interval() seconds, or as soon as it is woken (when
+    the buffer it writes is filling up). Started by the first start() call.
+    """
+
+    def __init__(self, flush, interval, name):
+        self._flush = flush
+        self._interval = interval
+        self._name = name
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._interval())
+            self._wake.clear()
+            try:
+                self._flush()
+            finally:
+                # This thread's connections, like at the end of a request
+                connections.close_all()
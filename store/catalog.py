@@ -0,0 +1,551 @@
+# store/catalog.py
+
+import copy
+import time
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Sort modes (Product.SORT_ORDERINGS) -> (column, descending). Every ordering breaks ties by
+# id in the same direction, so a descending sort is exactly the ascending one reversed.
+SORT_COLUMNS = {
+    'price-asc': ('price', False),
+    'price-desc': ('price', True),
+    'rating-asc': ('rating', False),
+    'rating-desc': ('rating', True),
+    'name-asc': ('name', False),
+    'name-desc': ('name', True),
+    'newest': ('created', True),
+    'popular': ('popularity', True),
+}
+
+# Text searches whose matching rows are kept per catalog snapshot (a search and its facets
+# run the same text query)
+TEXT_MATCHES_CACHED = 16
+
+# Product fields searches read: saves that leave all of them alone don't touch the catalog
+SEARCHED_FIELDS = frozenset(
+    ('name', 'description', 'price', 'rating', 'category', 'category_id', 'created_at', 'popularity')
+)
+
+# Watermark row counting catalog changes made without signals or in other processes
+VERSION_WATERMARK = 'catalog_version'
+
+# Sort columns -> the arrays holding their values
+COLUMN_ARRAYS = {'price': 'prices', 'rating': 'ratings', 'created': 'created', 'popularity': 'popularity'}
+
+
+class Columns:
+    """
+    One snapshot of the catalog, a row per product in (name, id) order:
+      ids, prices, ratings, created,  int64 / float64 arrays
+      popularity
+      categories                      int32 codes into category_names (name order)
+      names                           lowercase names in one bytes buffer, row i is
+                                      names[name_offsets[i]:name_offsets[i + 1] - 1]
+      live                            False for products deleted since the build
+    Searches may hold a snapshot while it is replaced, so its arrays are never written:
+    changes make a new snapshot with replace().
+    """
+
+    def __init__(self, ids, prices, ratings, created, popularity, categories, category_names, category_codes,
+                 names, name_offsets):
+        self.ids = ids
+        self.prices = prices
+        self.ratings = ratings
+        self.created = created
+        self.popularity = popularity
+        self.categories = categories
+        self.category_names = category_names
+        self.category_codes = category_codes  # category id -> code
+        self.category_by_name = {name: code for code, name in enumerate(category_names)}
+        self.names = names
+        self.name_offsets = name_offsets
+        self.live = np.ones(len(ids), dtype=bool)
+        self.id_order = np.argsort(ids, kind='stable')  # rows by id, for lookups
+        self._orderings = {}
+        self._text_matches = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        arrays = (self.ids, self.prices, self.ratings, self.created, self.popularity, self.categories,
+                  self.name_offsets, self.live, self.id_order)
+        return sum(a.nbytes for a in arrays) + len(self.names)
+
+    def row(self, product_id):
+        """Row of a product, None if it isn't in this snapshot"""
+        i = int(np.searchsorted(self.ids, product_id, sorter=self.id_order))
+        if i < len(self.ids) and self.ids[self.id_order[i]] == product_id:
+            return int(self.id_order[i])
+        return None
+
+    def name(self, row):
+        return self.names[self.name_offsets[row]:self.name_offsets[row + 1] - 1].decode()
+
+    def ordering(self, sort):
+        """Row positions in the order of a sort mode (id order for unknown modes)"""
+        column, descending = SORT_COLUMNS.get(sort, ('id', False))
+        rows = self._orderings.get(column)
+        if rows is None:
+            if column == 'name':
+                rows = np.arange(len(self.ids))
+            elif column == 'id':
+                rows = self.id_order
+            else:
+                values = {
+                    'price': self.prices, 'rating': self.ratings, 'created': self.created, 'popularity': self.popularity,
+                }[column]
+                # Sorted by the column, then id (lexsort sorts by the last key first)
+                rows = np.lexsort((self.ids, values))
+            self._orderings[column] = rows
+        return rows[::-1] if descending else rows
+
+    def replace(self, text_changed=False, **arrays):
+        """
+        New snapshot with the given arrays replaced, sharing the others with this one.
+        text_changed=True drops the cached text matches (a name or description changed).
+        """
+        columns = copy.copy(self)
+        columns.__dict__.update(arrays)
+        columns._orderings = {
+            column: rows for column, rows in self._orderings.items() if COLUMN_ARRAYS.get(column) not in arrays
+        }
+        columns._lock = threading.Lock()
+        with self._lock:
+            columns._text_matches = OrderedDict() if text_changed else self._text_matches.copy()
+        return columns
+
+    def text_rows(self, query):
+        """Rows whose name or description contains query (case-insensitive), from the database"""
+        from .models import Product
+
+        with self._lock:
+            rows = self._text_matches.get(query)
+            if rows is not None:
+                self._text_matches.move_to_end(query)
+                return rows
+
+        # ORM Query: Ids of the products matching the text, the rest of the search is done here
+        # Equivalent SQL Query:
+        # SELECT id FROM store_product WHERE name ILIKE %s OR description ILIKE %s;
+        matched = np.fromiter(
+            Product.objects.filter(Q(name__icontains=query) | Q(description__icontains=query))
+            .values_list('id', flat=True).iterator(),
+            dtype=np.int64,
+        )
+        rows = np.array([], dtype=np.int64)
+        if len(self.ids):
+            found = self.id_order[np.minimum(np.searchsorted(self.ids, matched, sorter=self.id_order), len(self.ids) - 1)]
+            # Products created since the build aren't in the catalog
+            rows = found[self.ids[found] == matched]
+
+        with self._lock:
+            self._text_matches[query] = rows
+            if len(self._text_matches) > TEXT_MATCHES_CACHED:
+                self._text_matches.popitem(last=False)
+        return rows
+
+    def name_rows(self, text, prefix=False):
+        """Rows whose lowercase name contains (or with prefix=True, starts with) text"""
+        needle = text.encode()
+        hits = array('q')
+        skip = 0
+        if prefix:
+            if self.names.startswith(needle):
+                hits.append(0)
+            # A name starts right after the separator of the previous one
+            needle = b'\n' + needle
+            skip = 1
+        pos = self.names.find(needle)
+        while pos != -1:
+            hits.append(pos + skip)
+            pos = self.names.find(needle, pos + 1)
+        rows = np.searchsorted(self.name_offsets, np.frombuffer(hits, dtype=np.int64), side='right') - 1
+        return np.unique(rows[self.live[rows]])
+
+
+class SearchResults:
+    """
+    Products of a catalog search in the order of its sort mode. Paginator pages it like
+    a queryset: the count is a sum over the mask, and a page only walks the ordering as
+    far as that page and loads its products from `queryset`.
+    """
+    CHUNK = 65536
+
+    def __init__(self, columns, rows, mask, queryset):
+        self.columns = columns
+        self.rows = rows  # every row in sort order
+        self.mask = mask  # matching rows
+        self.queryset = queryset
+        self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = int(np.count_nonzero(self.mask))
+        return self._count
+
+    @property
+    def ids(self):
+        """Ids of all matching products, in order"""
+        return self.columns.ids[self.rows[self.mask[self.rows]]]
+
+    def _ids(self, stop):
+        """Ids of the first `stop` matching products"""
+        found = [np.array([], dtype=np.int64)]
+        count = 0
+        for begin in range(0, len(self.rows), self.CHUNK):
+            chunk = self.rows[begin:begin + self.CHUNK]
+            found.append(chunk[self.mask[chunk]])
+            count += len(found[-1])
+            if count >= stop:
+                break
+        return self.columns.ids[np.concatenate(found)[:stop]]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop, step = index.indices(len(self))
+        ids = self._ids(stop)[start:stop:step].tolist()
+        products = self.queryset.in_bulk(ids)
+        # Products deleted since the catalog was built are left out
+        return [products[product_id] for product_id in ids if product_id in products]
+
+
+class ColumnarCatalog:
+    """
+    The columns product searches filter and sort on, kept in memory as arrays so a
+    search is a few vectorized comparisons instead of a query over the product table
+    and no Product instances are created for products that aren't shown.
+
+    Built in a background thread when the server starts (warm(), see wsgi.py), searches
+    before that are answered by the database. Product writes in this process swap in a
+    snapshot with the new values (see apps.py), other changes mark it stale. Bulk changes
+    and changes from other processes (management commands) go through publish_change(),
+    which every process notices within CATALOG_VERSION_CHECK seconds. A stale catalog, or
+    one older than CATALOG_TTL (which brings in the edits of other web processes), is rebuilt
+    in a background thread while searches keep using the previous one.
+    """
+
+    def __init__(self):
+        self._columns = None
+        self._built_at = None
+        self._stale = True
+        self._build_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        # Held while a new snapshot is swapped in, so two writers can't lose each other's change
+        self._swap_lock = threading.Lock()
+        # VERSION_WATERMARK when the catalog was built, and when it was last compared
+        self._version = None
+        self._version_checked_at = None
+
+    def mark_stale(self, **kwargs):
+        """Signal receiver: rebuild the catalog in the background before long"""
+        self._stale = True
+
+    def publish_change(self):
+        """
+        Mark the catalog stale in every process: this one now, the others at their next
+        version check. For writes that send no signals (QuerySet.update) or run outside
+        the web processes.
+        """
+        from .models import Watermark
+
+        self.mark_stale()
+        # ORM Query: Bump the catalog version
+        # Equivalent SQL Query:
+        # INSERT INTO store_watermark (name, position, updated_at) VALUES ('catalog_version', 0, NOW())
+        # ON CONFLICT (name) DO NOTHING;
+        # UPDATE store_watermark SET position = position + 1, updated_at = NOW() WHERE name = 'catalog_version';
+        Watermark.objects.get_or_create(name=VERSION_WATERMARK)
+        Watermark.objects.filter(name=VERSION_WATERMARK).update(position=F('position') + 1, updated_at=timezone.now())
+
+    def _read_version(self):
+        from .models import Watermark
+
+        # ORM Query: The catalog version
+        # Equivalent SQL Query:
+        # SELECT position FROM store_watermark WHERE name = 'catalog_version' LIMIT 1;
+        return Watermark.objects.filter(name=VERSION_WATERMARK).values_list('position', flat=True).first() or 0
+
+    def _check_version(self):
+        """Mark the catalog stale if another process published a change since it was built"""
+        now = time.monotonic()
+        if self._version_checked_at is not None and now - self._version_checked_at < settings.CATALOG_VERSION_CHECK:
+            return
+        self._version_checked_at = now
+        if self._read_version() != self._version:
+            self._stale = True
+
+    def _needs_rebuild(self):
+        return self._stale or time.monotonic() - self._built_at > settings.CATALOG_TTL
+
+    def columns(self):
+        """The current snapshot, None until the first build is done"""
+        columns = self._columns
+        if columns is not None:
+            self._check_version()
+        if columns is None or self._needs_rebuild():
+            self._refresh_in_background()
+        return columns
+
+    def warm(self):
+        """Start building the catalog so the first searches don't have to wait for it"""
+        if self._columns is None:
+            self._refresh_in_background()
+
+    def _refresh_in_background(self):
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _refresh(self):
+        try:
+            with self._build_lock:
+                self.rebuild()
+        except Exception as e:
+            logger.error(f"Catalog rebuild failed: {e}")
+        finally:
+            self._refreshing = False
+            connections.close_all()
+
+    def rebuild(self):
+        """Load the catalog columns from the database"""
+        from .models import Product, Category
+
+        self._stale = False
+        # Read first, a change published while loading makes the next check rebuild again
+        version = self._read_version()
+        start = time.perf_counter()
+
+        # ORM Query: Categories in name order, their codes in the catalog
+        # Equivalent SQL Query:
+        # SELECT id, name FROM store_category ORDER BY name;
+        category_names = []
+        category_codes = {}
+        for code, (category_id, name) in enumerate(Category.objects.order_by('name').values_list('id', 'name')):
+            category_names.append(name)
+            category_codes[category_id] = code
+
+        ids, prices, ratings, created, popularity = array('q'), array('d'), array('d'), array('q'), array('q')
+        categories = array('i')
+        names = []
+        # ORM Query: Only the searched columns, streamed in name order
+        # Equivalent SQL Query:
+        # SELECT id, name, price, rating, category_id, created_at, popularity FROM store_product ORDER BY name, id;
+        for product_id, name, price, rating, category_id, created_at, views in (
+            Product.objects.order_by('name', 'id')
+            .values_list('id', 'name', 'price', 'rating', 'category_id', 'created_at', 'popularity')
+            .iterator(chunk_size=10000)
+        ):
+            ids.append(product_id)
+            prices.append(float(price))
+            ratings.append(rating)
+            created.append(int(created_at.timestamp() * 1000000))
+            popularity.append(views)
+            categories.append(category_codes.get(category_id, -1))
+            names.append(name.lower().encode())
+
+        name_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum([len(name) + 1 for name in names], out=name_offsets[1:])
+
+        columns = Columns(
+            ids=np.frombuffer(ids, dtype=np.int64).copy(),
+            prices=np.frombuffer(prices, dtype=np.float64).copy(),
+            ratings=np.frombuffer(ratings, dtype=np.float64).copy(),
+            created=np.frombuffer(created, dtype=np.int64).copy(),
+            popularity=np.frombuffer(popularity, dtype=np.int64).copy(),
+            categories=np.frombuffer(categories, dtype=np.int32).copy(),
+            category_names=category_names,
+            category_codes=category_codes,
+            # Newline separated, so a substring never spans two names
+            names=b''.join(name + b'\n' for name in names),
+            name_offsets=name_offsets,
+        )
+
+        # Swap in the whole snapshot at once
+        with self._swap_lock:
+            self._columns = columns
+            self._built_at = time.monotonic()
+            self._version = version
+            self._version_checked_at = self._built_at
+        logger.info(
+            f"Built catalog: {len(columns)} products, {columns.nbytes / 1048576:.1f}MB "
+            f"in {(time.perf_counter() - start) * 1000:.0f}ms"
+        )
+
+    def product_saved(self, sender, instance, created, update_fields=None, **kwargs):
+        """Signal receiver: swap in a snapshot with the product's new values"""
+        if update_fields is not None and not SEARCHED_FIELDS.intersection(update_fields):
+            return
+        with self._swap_lock:
+            columns = self._columns
+            if columns is None:
+                return
+            if self._build_lock.locked():
+                # The rebuild in progress may have read the product before this write
+                self._stale = True
+            row = None if created else columns.row(instance.id)
+            code = columns.category_codes.get(instance.category_id)
+            if row is None or code is None or columns.name(row) != instance.name.lower():
+                # New product or category, or a new name (rows are in name order)
+                self.mark_stale()
+                return
+
+            changes = {}
+            values = {
+                'prices': float(instance.price),
+                'ratings': float(instance.rating),
+                'created': int(instance.created_at.timestamp() * 1000000),
+                'popularity': instance.popularity,
+                'categories': code,
+            }
+            for name, value in values.items():
+                array = getattr(columns, name)
+                if array[row] != value:
+                    changes[name] = array.copy()
+                    changes[name][row] = value
+            # The description isn't in the catalog, only in the cached text matches
+            text_changed = update_fields is None or 'description' in update_fields
+            if changes or text_changed:
+                self._columns = columns.replace(text_changed, **changes)
+
+    def product_deleted(self, sender, instance, **kwargs):
+        """Signal receiver: leave the product out of searches"""
+        with self._swap_lock:
+            columns = self._columns
+            if columns is None:
+                return
+            row = columns.row(instance.id)
+            if row is not None and columns.live[row]:
+                live = columns.live.copy()
+                live[row] = False
+                self._columns = columns.replace(live=live)
+
+    def _masks(self, columns, query, category, min_price, max_price, min_rating):
+        """(base, category, price, rating) boolean masks of a search, None for filters not given"""
+        base = columns.live.copy()
+        if query:
+            text = np.zeros(len(columns), dtype=bool)
+            text[columns.text_rows(query)] = True
+            base &= text
+
+        category_mask = None
+        if category:
+            code = columns.category_by_name.get(category)
+            category_mask = columns.categories == (code if code is not None else -2)
+
+        price_mask = None
+        if min_price is not None:
+            price_mask = columns.prices >= min_price
+        if max_price is not None:
+            below = columns.prices <= max_price
+            price_mask = below if price_mask is None else price_mask & below
+
+        rating_mask = columns.ratings >= min_rating if min_rating is not None else None
+        return base, category_mask, price_mask, rating_mask
+
+    def search(self, query=None, category=None, min_price=None, max_price=None, min_rating=None,
+               sort=None, queryset=None):
+        """
+        Product.search in memory: the matching products as SearchResults in the order
+        of the sort mode, loaded from queryset (default: all products) page by page.
+        Until the catalog is built this is Product.search's queryset.
+        """
+        from .models import Product
+
+        columns = self.columns()
+        if columns is None:
+            return Product.search(query, category, min_price, max_price, min_rating, sort, queryset=queryset)
+        mask = np.logical_and.reduce(
+            [m for m in self._masks(columns, query, category, min_price, max_price, min_rating) if m is not None]
+        )
+        return SearchResults(
+            columns, columns.ordering(sort), mask, queryset if queryset is not None else Product.objects.all()
+        )
+
+    def facets(self, query=None, category=None, min_price=None, max_price=None, min_rating=None):
+        """Product.search_facets in memory, same result"""
+        from .models import Product
+
+        columns = self.columns()
+        if columns is None:
+            return Product.search_facets(query, category, min_price, max_price, min_rating)
+        base, category_mask, price_mask, rating_mask = self._masks(
+            columns, query, category, min_price, max_price, min_rating
+        )
+
+        def without(*masks):
+            # Each facet applies every filter except its own
+            return np.logical_and.reduce([base] + [m for m in masks if m is not None])
+
+        category_counts = np.bincount(
+            columns.categories[without(price_mask, rating_mask)] + 1, minlength=len(columns.category_names) + 1
+        )[1:]
+
+        edges = Product.FACET_PRICE_EDGES
+        in_price_facets = without(category_mask, rating_mask)
+        # Bucket i holds edges[i] <= price < edges[i + 1], the last one is open-ended
+        buckets = np.digitize(columns.prices[in_price_facets], edges) - 1
+        price_counts = np.bincount(buckets[buckets >= 0], minlength=len(edges))
+
+        ratings = columns.ratings[without(category_mask, price_mask)]
+
+        return {
+            'categories': [
+                {'name': name, 'count': int(count)}
+                for name, count in zip(columns.category_names, category_counts)
+            ],
+            'price': [
+                {'min': low, 'max': high, 'count': int(count)}
+                for low, high, count in zip(edges, edges[1:] + (None,), price_counts)
+            ],
+            'rating': [
+                {'min': stars, 'count': int(np.count_nonzero(ratings >= stars))}
+                for stars in Product.FACET_MIN_RATINGS
+            ],
+        }
+
+    def suggest_similar(self, query, limit=8):
+        """
+        Product.suggest_similar over the name buffer: products sharing a word (or, failing
+        that, three letters) with the query, names starting with the query first
+        """
+        from .models import Product
+
+        if not query:
+            return []
+        columns = self.columns()
+        if columns is None:
+            return list(Product.suggest_similar(query))[:limit]
+
+        empty = np.array([], dtype=np.int64)
+        words = [word for word in query.lower().split() if len(word) > 2]
+        rows = np.unique(np.concatenate([columns.name_rows(word) for word in words] + [empty]))
+        if not len(rows) and len(query) > 3:
+            trigrams = {query[i:i + 3].lower() for i in range(len(query) - 2)}
+            rows = np.unique(np.concatenate([columns.name_rows(trigram) for trigram in trigrams]))
+
+        # Rows are in name order already: names starting with the query, then the others
+        starts = columns.name_rows(query.lower(), prefix=True)
+        ranked = np.concatenate([np.intersect1d(rows, starts), np.setdiff1d(rows, starts)])[:limit]
+        ids = columns.ids[ranked].tolist()
+        products = Product.objects.in_bulk(ids)
+        return [products[product_id] for product_id in ids if product_id in products]
+
+
+catalog = ColumnarCatalog()
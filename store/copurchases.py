@@ -0,0 +1,184 @@
+# store/copurchases.py
+#
+# "Customers also bought": how many orders contained each pair of products, kept as a
+# sparse item x item matrix in CoPurchase. Orders are read in chunks of ids after the
+# last processed one (the watermark); each chunk's pair counts are summed into a sparse
+# matrix in memory and added to the stored counts, so memory depends on the chunk size
+# rather than the number of order lines. An order cancelled (or un-cancelled) after it
+# was counted has its pairs taken out (or added back) when its status changes.
+
+import logging
+from array import array
+from datetime import timedelta
+from itertools import groupby, permutations
+from operator import itemgetter
+import numpy as np
+from scipy import sparse
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .bulk import add_counts
+from .models import Order, OrderItem, Product, CoPurchase, Watermark
+
+logger = logging.getLogger(__name__)
+
+WATERMARK = 'copurchases'
+
+# Orders with more distinct products than this (bulk or wholesale orders) are skipped,
+# their pairs would outnumber those of many regular orders
+MAX_BASKET = 50
+
+# Orders are only read once they are this old, so an order that committed after one with
+# a higher id (concurrent checkouts) isn't skipped by the watermark
+SETTLE = timedelta(minutes=5)
+
+
+def pair_counts(lines):
+    """
+    Co-purchase counts of (order_id, product_id) rows sorted by order as a sparse
+    matrix (COO, duplicates summed): cell (a, b) is the number of orders with both
+    """
+    rows, columns = array('q'), array('q')
+    for _, basket in groupby(lines, key=itemgetter(0)):
+        products = sorted({product_id for _, product_id in basket})
+        if len(products) > MAX_BASKET:
+            continue
+        for a, b in permutations(products, 2):
+            rows.append(a)
+            columns.append(b)
+
+    rows = np.frombuffer(rows, dtype=np.int64)
+    columns = np.frombuffer(columns, dtype=np.int64)
+    size = int(max(rows.max(), columns.max())) + 1 if len(rows) else 0
+    counts = sparse.coo_array((np.ones(len(rows), dtype=np.int64), (rows, columns)), shape=(size, size))
+    counts.sum_duplicates()
+    return counts
+
+
+def _add(counts):
+    """Add a chunk's pair counts to the stored ones"""
+    # Products deleted since the order would fail the foreign keys
+    existing = set(Product.objects.filter(id__in=np.unique(counts.row).tolist()).values_list('id', flat=True))
+    cells = [
+        (product_id, other_id, orders)
+        for product_id, other_id, orders in zip(counts.row.tolist(), counts.col.tolist(), counts.data.tolist())
+        if product_id in existing and other_id in existing
+    ]
+
+    # ON CONFLICT (product_id, other_id) DO UPDATE SET orders = orders + EXCLUDED.orders
+    add_counts(CoPurchase, ['product', 'other'], 'orders', cells)
+    return len(cells)
+
+
+def update_chunk(chunk_size):
+    """Add the next chunk of orders after the watermark; returns how many orders were added"""
+    with transaction.atomic():
+        # ORM Query: Lock the watermark so concurrent runs don't count orders twice
+        # Equivalent SQL Query:
+        # SELECT * FROM store_watermark WHERE name = 'copurchases' FOR UPDATE;
+        watermark, _ = Watermark.objects.get_or_create(name=WATERMARK)
+        watermark = Watermark.objects.select_for_update().get(id=watermark.id)
+
+        # ORM Query: Next orders after the watermark
+        # Equivalent SQL Query:
+        # SELECT id FROM store_order WHERE id > %s AND created_at < %s ORDER BY id LIMIT %s;
+        order_ids = list(
+            Order.objects.filter(id__gt=watermark.position, created_at__lt=timezone.now() - SETTLE)
+            .order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not order_ids:
+            return 0
+
+        # ORM Query: Products of those orders
+        # Equivalent SQL Query:
+        # SELECT i.order_id, i.product_id FROM store_orderitem i JOIN store_order o ON i.order_id = o.id
+        # WHERE i.order_id > %s AND i.order_id <= %s AND i.product_id IS NOT NULL AND o.status != 'cancelled'
+        # ORDER BY i.order_id;
+        lines = (
+            OrderItem.objects.filter(
+                order_id__gt=watermark.position, order_id__lte=order_ids[-1], product__isnull=False
+            )
+            .exclude(order__status='cancelled')
+            .order_by('order_id').values_list('order_id', 'product_id')
+        )
+        cells = _add(pair_counts(lines.iterator(chunk_size=5000)))
+
+        watermark.position = order_ids[-1]
+        watermark.save(update_fields=['position', 'updated_at'])
+    logger.info(f"Added {len(order_ids)} orders ({cells} product pairs) to the co-purchases")
+    return len(order_ids)
+
+
+def set_cancelled(order_id, cancelled):
+    """
+    Take a counted order's pairs out of the stored counts when it is cancelled, or add
+    them back when it no longer is. Run it in the transaction that changes the status;
+    orders after the watermark are left to update_chunk, which skips cancelled ones.
+    """
+    with transaction.atomic():
+        # ORM Query: Lock the watermark, update_chunk reads the status once it has the lock
+        # Equivalent SQL Query:
+        # SELECT * FROM store_watermark WHERE name = 'copurchases' FOR UPDATE;
+        watermark = Watermark.objects.select_for_update().filter(name=WATERMARK).first()
+        if watermark is None or order_id > watermark.position:
+            return 0
+
+        # ORM Query: Products of the order
+        # Equivalent SQL Query:
+        # SELECT product_id FROM store_orderitem WHERE order_id = %s AND product_id IS NOT NULL;
+        products = sorted(set(
+            OrderItem.objects.filter(order_id=order_id, product__isnull=False).values_list('product_id', flat=True)
+        ))
+        if len(products) < 2 or len(products) > MAX_BASKET:
+            return 0
+        if not cancelled:
+            cells = _add(pair_counts((order_id, product_id) for product_id in products))
+            logger.info(f"Added back {cells} product pairs of order {order_id}")
+            return cells
+
+        # An INSERT of a negative count would fail the orders >= 0 check even on conflict
+        cells = 0
+        for product_id in products:
+            # ORM Query: One less order for each of the product's pairs in the order
+            # Equivalent SQL Query:
+            # UPDATE store_copurchase SET orders = orders - 1 WHERE product_id = %s AND other_id IN (...) AND orders > 0;
+            cells += CoPurchase.objects.filter(
+                product_id=product_id, other_id__in=products, orders__gt=0
+            ).exclude(other_id=product_id).update(orders=F('orders') - 1)
+
+        # ORM Query: Pairs no order contains any more
+        # Equivalent SQL Query:
+        # DELETE FROM store_copurchase WHERE product_id IN (...) AND orders = 0;
+        CoPurchase.objects.filter(product_id__in=products, orders=0).delete()
+    logger.info(f"Removed {cells} product pairs of cancelled order {order_id}")
+    return cells
+
+
+def update(chunk_size):
+    """Add every order placed since the last run; returns how many orders were added"""
+    total = 0
+    while True:
+        added = update_chunk(chunk_size)
+        if not added:
+            return total
+        total += added
+
+
+def reset():
+    """Forget every count, the next update starts over from the first order"""
+    with transaction.atomic():
+        CoPurchase.objects.all().delete()
+        Watermark.objects.filter(name=WATERMARK).delete()
+
+
+def also_bought(product, limit):
+    """The products most often bought together with a product (with visuals), most orders first"""
+    # ORM Query: Top of the product's row of the matrix
+    # Equivalent SQL Query:
+    # SELECT store_product.* FROM store_copurchase JOIN store_product ON store_product.id = other_id
+    # WHERE product_id = %s ORDER BY orders DESC, other_id LIMIT %s;
+    rows = (
+        CoPurchase.objects.filter(product=product).order_by('-orders', 'other_id')
+        .select_related('other').prefetch_related('other__visuals')[:limit]
+    )
+    return [row.other for row in rows]
@@ -0,0 +1,338 @@
+# store/enrichment.py
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import requests
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import EnrichmentData
+from .tasks import task, enqueue
+from .stampede import SingleFlight, Throttle, expires_early
+
+logger = logging.getLogger(__name__)
+
+OPENWEATHER_API_KEY = os.environ.get('OPENWEATHER_API_KEY')
+
+
+class NotFound(ValueError):
+    """The remote API has no data for this Pokemon name or city"""
+
+
+def request_pokemon(name):
+    """Get Pokemon data from PokeAPI"""
+    url = f"{settings.POKEAPI_URL}/pokemon/{name.lower()}"
+    resp = requests.get(url, timeout=5)
+
+    if resp.status_code == 404:
+        raise NotFound(f"Pokemon '{name}' not found")
+    resp.raise_for_status()
+
+    data = resp.json()
+    return {
+        'success': True,
+        'name': data.get('name', '').capitalize(),
+        'sprite': data.get('sprites', {}).get('front_default', ''),
+        'types': [t['type']['name'].capitalize() for t in data.get('types', [])],
+        'height': data.get('height', 0),
+        'weight': data.get('weight', 0),
+        'stats': {s['stat']['name']: s['base_stat'] for s in data.get('stats', [])}
+    }
+
+
+def request_weather(city):
+    """Get the current weather of a city from OpenWeather"""
+    if not OPENWEATHER_API_KEY:
+        raise EnvironmentError("OpenWeather API key not configured")
+
+    url = f"{settings.OPENWEATHER_URL}/weather?q={city}&appid={OPENWEATHER_API_KEY}&units=metric"
+    resp = requests.get(url, timeout=5)
+
+    if resp.status_code == 404:
+        raise NotFound(f"City '{city}' not found")
+    resp.raise_for_status()
+
+    data = resp.json()
+    temp_c = data['main']['temp']
+    temp_f = temp_c * 9 / 5 + 32
+
+    return {
+        'success': True,
+        'city': data.get('name', city),
+        'temperature_celsius': temp_c,
+        'temperature_fahrenheit': temp_f,
+        'condition': data['weather'][0]['main'],
+        'description': data['weather'][0]['description'],
+        'icon': data['weather'][0]['icon'],
+        'icon_url': f"https://openweathermap.org/img/wn/{data['weather'][0]['icon']}@2x.png",
+        'humidity': data['main']['humidity'],
+        'wind_speed': data['wind']['speed'],
+        'timestamp': data['dt']
+    }
+
+
+# Source -> function fetching one key from the remote API
+FETCHERS = {
+    EnrichmentData.POKEMON: request_pokemon,
+    EnrichmentData.WEATHER: request_weather,
+}
+
+
+class MemoryTier:
+    """
+    Per-process LRU of entries in front of the enrichment table. Entries keep their
+    fetch time, so expiry works the same as for the table. The first lookup in a
+    process preloads the most recently used rows, so requests right after a deploy
+    don't each go to the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (source, key) -> (data, fetched_at)
+        self._loaded = False
+
+    def get(self, source, key):
+        with self._lock:
+            entry = self._entries.get((source, key))
+            if entry is not None:
+                self._entries.move_to_end((source, key))
+            return entry
+
+    def put(self, source, key, data, fetched_at):
+        with self._lock:
+            self._entries[(source, key)] = (data, fetched_at)
+            self._entries.move_to_end((source, key))
+            while len(self._entries) > settings.ENRICHMENT_MEMORY_SIZE:
+                self._entries.popitem(last=False)
+
+    def preload(self):
+        if self._loaded:
+            return
+        self._loaded = True
+
+        # ORM Query: Most recently used entries
+        # Equivalent SQL Query:
+        # SELECT source, key, data, fetched_at FROM store_enrichmentdata ORDER BY used_at DESC LIMIT %s;
+        rows = EnrichmentData.objects.order_by('-used_at').values_list(
+            'source', 'key', 'data', 'fetched_at'
+        )[:settings.ENRICHMENT_MEMORY_SIZE]
+        # Oldest first, so the most recently used end up at the fresh end of the LRU
+        for source, key, data, fetched_at in reversed(list(rows)):
+            self.put(source, key, data, fetched_at)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+memory = MemoryTier()
+
+
+def normalize_key(key):
+    return ' '.join(key.lower().split())
+
+
+def _not_found(error):
+    """Stored in place of the data of a key the remote API doesn't know"""
+    return {'success': False, 'error': str(error)}
+
+
+def is_not_found(data):
+    return data.get('success') is False
+
+
+def _ttl(source, data):
+    if is_not_found(data):
+        return settings.ENRICHMENT_NOT_FOUND_TTL
+    return settings.ENRICHMENT_TTL.get(source)
+
+
+def is_fresh(source, fetched_at, data):
+    """
+    Pokemon data never changes; weather is good for ENRICHMENT_TTL['weather'] seconds,
+    and "not found" answers for ENRICHMENT_NOT_FOUND_TTL (the key may appear later)
+    """
+    ttl = _ttl(source, data)
+    return ttl is None or fetched_at >= timezone.now() - timedelta(seconds=ttl)
+
+
+def store(source, key, data, evict=True):
+    key = normalize_key(key)
+    now = timezone.now()
+
+    # ORM Query: Insert or replace the stored response
+    # Equivalent SQL Query:
+    # INSERT INTO store_enrichmentdata (source, key, data, fetched_at, used_at) VALUES (%s, %s, %s, NOW(), NOW())
+    # ON CONFLICT (source, key) DO UPDATE SET data = EXCLUDED.data, fetched_at = EXCLUDED.fetched_at, ...;
+    EnrichmentData.objects.update_or_create(
+        source=source, key=key, defaults={'data': data, 'fetched_at': now, 'used_at': now}
+    )
+    memory.put(source, key, data, now)
+    if evict:
+        evict_least_used()
+
+
+def evict_least_used():
+    """Delete the least recently used rows beyond ENRICHMENT_MAX_ENTRIES"""
+    limit = settings.ENRICHMENT_MAX_ENTRIES
+
+    # ORM Query: Ids past the size limit (uses the used_at index)
+    # Equivalent SQL Query:
+    # SELECT id FROM store_enrichmentdata ORDER BY used_at DESC LIMIT 1000 OFFSET %s;
+    ids = list(EnrichmentData.objects.order_by('-used_at').values_list('id', flat=True)[limit:limit + 1000])
+    if ids:
+        EnrichmentData.objects.filter(id__in=ids).delete()
+        logger.info(f"Evicted {len(ids)} enrichment entries")
+
+
+def _touch(source, key, used_at):
+    # Recording every read would turn reads into writes, the LRU order only needs to be coarse
+    if used_at < timezone.now() - timedelta(seconds=settings.ENRICHMENT_TOUCH_INTERVAL):
+        EnrichmentData.objects.filter(source=source, key=key).update(used_at=timezone.now())
+
+
+# Concurrent misses for the same entry make one remote request
+_fetches = SingleFlight()
+
+# Background refreshes are queued at most once a minute per entry and process
+_refreshes = Throttle(60)
+
+# Duration of the last remote fetch per source, the recompute cost used for early expiration
+_fetch_seconds = {}
+
+
+def fetch(source, key):
+    """Fetch one entry from the remote API and store it (a "not found" answer too)"""
+    start = time.perf_counter()
+    try:
+        data = FETCHERS[source](key)
+    except NotFound as e:
+        # Otherwise every request for the key would ask the remote API again
+        data = _not_found(e)
+    _fetch_seconds[source] = time.perf_counter() - start
+    store(source, key, data)
+    return data
+
+
+def _fetch_missing(source, key):
+    """Fetch an entry unless a fetch that finished after the caller's reads stored it"""
+    entry = memory.get(source, key)
+    if entry is not None and is_fresh(source, entry[1], entry[0]):
+        return entry[0]
+    return fetch(source, key)
+
+
+@task('store.refresh_enrichment')
+def refresh(source, key):
+    fetch(source, key)
+
+
+def _schedule_refresh(source, key):
+    if _refreshes.allow((source, key)):
+        enqueue(refresh, source, key, dedup_key=f'enrichment:{source}:{key}')
+
+
+def _expires_early(source, fetched_at, data):
+    ttl = _ttl(source, data)
+    if ttl is None:
+        return False
+    age = (timezone.now() - fetched_at).total_seconds()
+    return expires_early(age, ttl, _fetch_seconds.get(source, 1.0), settings.STAMPEDE_BETA)
+
+
+def _servable_stale(source, fetched_at, data):
+    """Expired entries are still served, while a refresh runs, for ENRICHMENT_STALE_SECONDS"""
+    ttl = _ttl(source, data)
+    return ttl is None or fetched_at >= timezone.now() - timedelta(seconds=ttl + settings.ENRICHMENT_STALE_SECONDS)
+
+
+def get(source, key):
+    """
+    Get enrichment data from the in-memory tier or the local table.
+    Entries close to expiry are refreshed in the background (probabilistically,
+    so one request triggers it), expired ones are served while they are refreshed.
+    Only a miss fetches in the request, once for all concurrent callers; if the
+    remote API fails then, an expired copy is served rather than nothing.
+    Raises NotFound for keys the remote API doesn't know, which are stored as well.
+    """
+    data = _get(source, normalize_key(key))
+    if is_not_found(data):
+        raise NotFound(data['error'])
+    return data
+
+
+def _get(source, key):
+    memory.preload()
+
+    entry = memory.get(source, key)
+    if entry is not None and is_fresh(source, entry[1], entry[0]):
+        if _expires_early(source, entry[1], entry[0]):
+            _schedule_refresh(source, key)
+        return entry[0]
+
+    # ORM Query: Read the stored response
+    # Equivalent SQL Query:
+    # SELECT data, fetched_at, used_at FROM store_enrichmentdata WHERE source = %s AND key = %s;
+    row = EnrichmentData.objects.filter(source=source, key=key).values_list('data', 'fetched_at', 'used_at').first()
+    if row:
+        data, fetched_at, used_at = row
+        if is_fresh(source, fetched_at, data):
+            memory.put(source, key, data, fetched_at)
+            _touch(source, key, used_at)
+            if _expires_early(source, fetched_at, data):
+                _schedule_refresh(source, key)
+            return data
+        if _servable_stale(source, fetched_at, data):
+            _schedule_refresh(source, key)
+            return data
+
+    try:
+        return _fetches.do((source, key), lambda: _fetch_missing(source, key))
+    except Exception as e:
+        if row is None:
+            raise
+        logger.warning(f"Serving stale {source} data for {key}: {e}")
+        return row[0]
+
+
+async def _fetch_all(jobs, concurrency):
+    """Fetch (source, key) pairs concurrently, at most `concurrency` requests in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(source, key):
+        async with semaphore:
+            try:
+                return source, key, await asyncio.to_thread(FETCHERS[source], key), None
+            except Exception as e:
+                return source, key, None, e
+
+    return await asyncio.gather(*(fetch(source, key) for source, key in jobs))
+
+
+def warm(jobs, concurrency=None):
+    """
+    Fetch every (source, key) pair concurrently and store the results.
+    Returns (fetched, not_found, failed) counts.
+    """
+    # Fetch in the event loop, write to the database afterwards from synchronous code
+    results = asyncio.run(_fetch_all(jobs, concurrency or settings.ENRICHMENT_CONCURRENCY))
+
+    fetched = not_found = failed = 0
+    for source, key, data, error in results:
+        if isinstance(error, NotFound):
+            store(source, key, _not_found(error), evict=False)
+            not_found += 1
+            continue
+        if error is not None:
+            logger.error(f"Failed to fetch {source} data for {key}: {error}")
+            failed += 1
+            continue
+        store(source, key, data, evict=False)
+        fetched += 1
+
+    evict_least_used()
+    return fetched, not_found, failed
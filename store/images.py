@@ -0,0 +1,220 @@
+# store/images.py
+
+import io
+import os
+import json
+import base64
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+# Derivative format -> (Pillow format name, content type)
+FORMATS = {
+    'avif': ('AVIF', 'image/avif'),
+    'webp': ('WEBP', 'image/webp'),
+    'jpg': ('JPEG', 'image/jpeg'),
+}
+
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Width of the inline low-quality placeholder shown while the real image loads
+PLACEHOLDER_WIDTH = 16
+
+# Rendered width of the image for the `sizes` attribute
+CARD_SIZES = "(max-width: 768px) 50vw, (max-width: 1024px) 33vw, 25vw"
+DETAIL_SIZES = "(max-width: 768px) 100vw, 50vw"
+
+# Parsed manifest, reloaded whenever the file on disk changes
+_manifest_cache = {'mtime': None, 'data': {}}
+
+
+def _manifest_path():
+    return os.path.join(settings.IMAGE_DERIVATIVES_DIR, MANIFEST_NAME)
+
+
+def load_manifest():
+    """Return the derivative manifest: source filename -> derivative info"""
+    try:
+        mtime = os.stat(_manifest_path()).st_mtime
+    except FileNotFoundError:
+        return {}
+
+    if mtime != _manifest_cache['mtime']:
+        with open(_manifest_path(), encoding='utf-8') as manifest_file:
+            _manifest_cache['data'] = json.load(manifest_file)
+        _manifest_cache['mtime'] = mtime
+    return _manifest_cache['data']
+
+
+def get_derivatives(filename):
+    """Get the manifest entry for a source image, or None if it has no derivatives"""
+    return load_manifest().get(filename)
+
+
+def get_srcsets(filename):
+    """
+    Build a srcset string per format for a source image, e.g.
+    {'webp': '/static/images/derived/cap.1a2b3c-320w.webp 320w, ...', ...}
+    Returns an empty dict when no derivatives have been generated yet.
+    """
+    entry = get_derivatives(filename)
+    if not entry:
+        return {}
+
+    url_prefix = settings.IMAGE_DERIVATIVES_URL
+    return {
+        fmt: ', '.join(
+            f"{url_prefix}{name} {width}w" for width, name in sorted(files.items(), key=lambda item: int(item[0]))
+        )
+        for fmt, files in entry['derivatives'].items()
+    }
+
+
+def source_hash(path):
+    """Short content hash of an image file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def _target_widths(source_width, widths):
+    """Configured widths narrower than the source, plus the largest one capped to the source"""
+    widths = sorted(widths)
+    targets = {w for w in widths if w < source_width}
+    targets.add(min(source_width, widths[-1]))
+    return sorted(targets)
+
+
+def _build_image(source_path, filename, digest, options):
+    """
+    Resize one source image into every width/format. Runs in a worker process,
+    so it only takes and returns plain data (settings may not be configured there).
+    """
+    output_dir = options['output_dir']
+    stem = os.path.splitext(filename)[0]
+
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+
+    has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    # JPEG has no alpha channel, flatten transparent images onto white
+    if has_alpha:
+        flat = Image.new('RGB', image.size, (255, 255, 255))
+        flat.paste(image, mask=image.getchannel('A'))
+    else:
+        flat = image
+
+    derivatives = {fmt: {} for fmt in options['formats']}
+    for width in _target_widths(image.width, options['widths']):
+        height = max(1, round(image.height * width / image.width))
+        for fmt in options['formats']:
+            pil_format = FORMATS[fmt][0]
+            base = flat if pil_format == 'JPEG' else image
+            resized = base.resize((width, height), Image.LANCZOS)
+
+            name = f"{stem}.{digest}-{width}w.{fmt}"
+            resized.save(
+                os.path.join(output_dir, name), pil_format,
+                quality=options['quality'], optimize=pil_format == 'JPEG'
+            )
+            derivatives[fmt][str(width)] = name
+
+    return {
+        'hash': digest,
+        'width': image.width,
+        'height': image.height,
+        # Transparent images would show the placeholder through, so they get none
+        'placeholder': '' if has_alpha else _build_placeholder(flat),
+        'derivatives': derivatives,
+    }
+
+
+def _build_placeholder(image):
+    """Tiny blurred-looking WebP of the image as a base64 data URI"""
+    thumb = image.copy()
+    thumb.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH))
+    buffer = io.BytesIO()
+    thumb.save(buffer, 'WEBP', quality=30)
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _remove_files(entry):
+    for files in entry.get('derivatives', {}).values():
+        for name in files.values():
+            try:
+                os.remove(os.path.join(settings.IMAGE_DERIVATIVES_DIR, name))
+            except FileNotFoundError:
+                pass
+
+
+def build_derivatives(force=False, workers=None):
+    """
+    Generate resized derivatives for every image in IMAGE_SOURCE_DIR.
+    Only images whose content hash changed since the last run are rebuilt
+    (all of them with force=True); derivatives of changed or deleted sources
+    are removed. Returns (built, unchanged, removed) counts.
+    """
+    source_dir = settings.IMAGE_SOURCE_DIR
+    os.makedirs(settings.IMAGE_DERIVATIVES_DIR, exist_ok=True)
+
+    manifest = dict(load_manifest())
+    sources = {
+        filename: os.path.join(source_dir, filename)
+        for filename in sorted(os.listdir(source_dir))
+        if filename.lower().endswith(SOURCE_EXTENSIONS) and os.path.isfile(os.path.join(source_dir, filename))
+    }
+
+    # Drop derivatives of images that no longer exist
+    removed = 0
+    for filename in list(manifest):
+        if filename not in sources:
+            _remove_files(manifest.pop(filename))
+            removed += 1
+
+    options = {
+        'output_dir': settings.IMAGE_DERIVATIVES_DIR,
+        'widths': settings.IMAGE_DERIVATIVE_WIDTHS,
+        'formats': settings.IMAGE_DERIVATIVE_FORMATS,
+        'quality': settings.IMAGE_DERIVATIVE_QUALITY,
+    }
+
+    pending = {}
+    for filename, path in sources.items():
+        digest = source_hash(path)
+        entry = manifest.get(filename)
+        if force or not entry or entry['hash'] != digest or 'placeholder' not in entry:
+            pending[filename] = (path, digest)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            filename: pool.submit(_build_image, path, filename, digest, options)
+            for filename, (path, digest) in pending.items()
+        }
+        for filename, future in futures.items():
+            try:
+                new_entry = future.result()
+            except Exception as e:
+                logger.error(f"Failed to build derivatives for {filename}: {e}")
+                continue
+            if filename in manifest and manifest[filename]['hash'] != new_entry['hash']:
+                _remove_files(manifest[filename])
+            manifest[filename] = new_entry
+
+    # Write to a temp file first so readers never see a half-written manifest
+    tmp_path = _manifest_path() + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(tmp_path, _manifest_path())
+
+    return len(pending), len(sources) - len(pending), removed
@@ -0,0 +1,217 @@
+# store/inventory.py
+#
+# Stock tracking. Stock only changes through conditional UPDATEs, so two checkouts can
+# never sell the same unit and nothing has to be locked up front:
+#   UPDATE store_stock SET quantity = quantity - n WHERE ... AND quantity >= n
+# Adding an item to the cart reserves its units for CART_RESERVATION_MINUTES. Expired
+# reservations are put back by `python manage.py release_reservations`, and checkout turns
+# the cart's reservations into sales, taking the units again if they were released.
+#
+# The row of a product is locked from its UPDATE until the transaction commits, so a
+# flash sale on one product queues every checkout behind that row. Splitting its stock
+# over several shard rows (set_stock(..., shards=8)) lets checkouts update different rows.
+
+import random
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import Stock, CartItem
+
+logger = logging.getLogger(__name__)
+
+
+class OutOfStock(Exception):
+    """Not enough units of a product (and size) left to reserve"""
+
+    def __init__(self, product_id, size, available):
+        self.product_id = product_id
+        self.size = size
+        self.available = available
+        if available:
+            message = f"Only {available} left in stock"
+        else:
+            message = "Out of stock"
+        super().__init__(message)
+
+
+def _stock(product_id, size):
+    # Cart items use None for "no size", stock rows ''
+    return Stock.objects.filter(product_id=product_id, size=size or '')
+
+
+def available(product_id, size=None):
+    """Units left to sell (not counting units reserved in carts), None if not tracked"""
+    # ORM Query: Add up the shards
+    # Equivalent SQL Query:
+    # SELECT SUM(quantity) FROM store_stock WHERE product_id = %s AND size = %s;
+    return _stock(product_id, size).aggregate(total=Sum('quantity'))['total']
+
+
+def set_stock(product_id, size, quantity, shards=1):
+    """Set the units left to sell, spread evenly over `shards` rows"""
+    with transaction.atomic():
+        # ORM Query: Lock the current rows so no checkout changes them meanwhile
+        # Equivalent SQL Query:
+        # SELECT * FROM store_stock WHERE product_id = %s AND size = %s FOR UPDATE;
+        list(_stock(product_id, size).select_for_update())
+
+        _stock(product_id, size).filter(shard__gte=shards).delete()
+        for shard in range(shards):
+            Stock.objects.update_or_create(
+                product_id=product_id, size=size or '', shard=shard,
+                defaults={'quantity': quantity // shards + (shard < quantity % shards)}
+            )
+    logger.info(f"Set stock of product {product_id} ({size or '-'}) to {quantity} in {shards} shards")
+
+
+def take(product_id, size, quantity):
+    """
+    Take units from the stock. Returns True if they were taken, False if there
+    aren't enough left and None if the product isn't tracked.
+    """
+    # ORM Query: Shards and what they held a moment ago
+    # Equivalent SQL Query:
+    # SELECT shard, quantity FROM store_stock WHERE product_id = %s AND size = %s;
+    shards = list(_stock(product_id, size).values_list('shard', 'quantity'))
+    if not shards:
+        return None
+
+    # Random order spreads concurrent checkouts over the shards
+    random.shuffle(shards)
+    for shard, held in shards:
+        if held < quantity:
+            continue
+        # ORM Query: Take the units if they are still there
+        # Equivalent SQL Query:
+        # UPDATE store_stock SET quantity = quantity - %s
+        # WHERE product_id = %s AND size = %s AND shard = %s AND quantity >= %s;
+        if _stock(product_id, size).filter(shard=shard, quantity__gte=quantity).update(
+            quantity=F('quantity') - quantity
+        ):
+            return True
+
+    if len(shards) > 1 and sum(held for _, held in shards) >= quantity:
+        # No single shard has enough, but together they might
+        return _take_across_shards(product_id, size, quantity)
+    return False
+
+
+def _take_across_shards(product_id, size, quantity):
+    with transaction.atomic():
+        # ORM Query: Lock every shard, in a fixed order to avoid deadlocks
+        # Equivalent SQL Query:
+        # SELECT * FROM store_stock WHERE product_id = %s AND size = %s ORDER BY shard FOR UPDATE;
+        rows = list(_stock(product_id, size).select_for_update().order_by('shard'))
+        if sum(row.quantity for row in rows) < quantity:
+            return False
+
+        for row in rows:
+            part = min(row.quantity, quantity)
+            if part:
+                Stock.objects.filter(id=row.id).update(quantity=F('quantity') - part)
+                quantity -= part
+            if not quantity:
+                break
+    return True
+
+
+def put_back(product_id, size, quantity):
+    """Return units to the stock (no-op if the product isn't tracked)"""
+    ids = list(_stock(product_id, size).values_list('id', flat=True))
+    if not ids:
+        return
+
+    # ORM Query: Add the units to any shard
+    # Equivalent SQL Query:
+    # UPDATE store_stock SET quantity = quantity + %s WHERE id = %s;
+    Stock.objects.filter(id=random.choice(ids)).update(quantity=F('quantity') + quantity)
+
+
+def reserve(item, quantity):
+    """
+    Set a cart item's quantity and hold that many units for it until
+    CART_RESERVATION_MINUTES from now, taking or putting back the difference
+    with what it already holds. Raises OutOfStock (changing nothing) when
+    there aren't enough units left.
+    """
+    with transaction.atomic():
+        # ORM Query: Lock the cart item so concurrent requests don't both take the difference
+        # Equivalent SQL Query:
+        # SELECT reserved_quantity FROM store_cartitem WHERE id = %s FOR UPDATE;
+        held = CartItem.objects.select_for_update().values_list('reserved_quantity', flat=True).get(id=item.id)
+
+        reserved = quantity
+        if quantity > held:
+            taken = take(item.product_id, item.size, quantity - held)
+            if taken is False:
+                raise OutOfStock(item.product_id, item.size, held + (available(item.product_id, item.size) or 0))
+            if taken is None:
+                # Not tracked, nothing to hold
+                reserved = held
+        elif quantity < held:
+            put_back(item.product_id, item.size, held - quantity)
+
+        item.quantity = quantity
+        item.reserved_quantity = reserved
+        item.reserved_until = timezone.now() + timedelta(minutes=settings.CART_RESERVATION_MINUTES)
+
+        # ORM Query: Save the reservation
+        # Equivalent SQL Query:
+        # UPDATE store_cartitem SET quantity = %s, reserved_quantity = %s, reserved_until = %s WHERE id = %s;
+        CartItem.objects.filter(id=item.id).update(
+            quantity=item.quantity, reserved_quantity=item.reserved_quantity, reserved_until=item.reserved_until
+        )
+
+
+def release(items):
+    """Put back the units held by these cart items (a CartItem queryset); returns how many were released"""
+    with transaction.atomic():
+        # ORM Query: Lock the items that hold units
+        # Equivalent SQL Query:
+        # SELECT id, product_id, size, reserved_quantity FROM store_cartitem
+        # WHERE ... AND reserved_quantity > 0 ORDER BY id FOR UPDATE;
+        held = list(
+            items.select_for_update().filter(reserved_quantity__gt=0).order_by('id')
+            .values_list('id', 'product_id', 'size', 'reserved_quantity')
+        )
+        if not held:
+            return 0
+
+        totals = {}
+        for _, product_id, size, quantity in held:
+            key = (product_id, size or '')
+            totals[key] = totals.get(key, 0) + quantity
+        # Same order as take() callers, see checkout
+        for (product_id, size), quantity in sorted(totals.items()):
+            put_back(product_id, size, quantity)
+
+        CartItem.objects.filter(id__in=[row[0] for row in held]).update(reserved_quantity=0, reserved_until=None)
+    return len(held)
+
+
+def discard(items):
+    """Release and delete cart items"""
+    with transaction.atomic():
+        release(items)
+        items.delete()
+
+
+def release_expired(batch_size):
+    """Put back the units of up to batch_size expired reservations; returns how many were released"""
+    now = timezone.now()
+    with transaction.atomic():
+        # ORM Query: Next batch of expired reservations, skipping items a request is changing
+        # Equivalent SQL Query:
+        # SELECT id FROM store_cartitem WHERE reserved_until < %s AND reserved_quantity > 0
+        # LIMIT %s FOR UPDATE SKIP LOCKED;
+        batch = list(
+            CartItem.objects.select_for_update(skip_locked=True)
+            .filter(reserved_until__lt=now, reserved_quantity__gt=0)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not batch:
+            return 0
+        return release(CartItem.objects.filter(id__in=batch, reserved_until__lt=now))
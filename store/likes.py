@@ -0,0 +1,217 @@
+# store/likes.py
+#
+# Product likes with write-behind: liking or unliking only records the visitor's latest
+# choice in this process's buffer, and a background thread writes the buffer every
+# LIKES_FLUSH_INTERVAL seconds (sooner once half of LIKES_BUFFER_MAX choices are waiting). A flush
+# inserts and deletes ProductLike rows in bulk and moves the ProductStats.likes counters
+# with one UPDATE per distinct change, so a burst of likes costs a few statements instead
+# of a transaction each, and toggling back and forth between flushes costs nothing.
+#
+# Choices still in the buffer are lost if the process dies, and other processes see
+# them after the next flush. The buffer never holds more than LIKES_BUFFER_MAX choices,
+# also while the database is down: new choices are refused then, and what a failed
+# flush puts back is cut to what fits.
+
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .bulk import Flusher
+from .models import Product, ProductLike, ProductStats
+
+logger = logging.getLogger(__name__)
+
+# Choices written per transaction
+FLUSH_CHUNK = 1000
+
+
+def apply(choices):
+    """
+    Write {(product_id, session_id): liked} to the database in one transaction.
+    Returns how many likes were added and removed.
+    """
+    with transaction.atomic():
+        # Products deleted meanwhile can't be liked
+        product_ids = set(Product.objects.filter(id__in={key[0] for key in choices}).values_list('id', flat=True))
+        choices = {key: liked for key, liked in choices.items() if key[0] in product_ids}
+        if not choices:
+            return 0, 0
+        product_ids = sorted(product_ids)
+
+        # ORM Query: Lock the counters (in id order, to avoid deadlocks) so concurrent flushes
+        # of other processes change the likes of a product one after the other
+        # Equivalent SQL Query:
+        # INSERT INTO store_productstats (product_id, likes) VALUES (%s, 0), ... ON CONFLICT DO NOTHING;
+        # SELECT product_id FROM store_productstats WHERE product_id IN (...) ORDER BY product_id FOR UPDATE;
+        ProductStats.objects.bulk_create([ProductStats(product_id=product_id) for product_id in product_ids], ignore_conflicts=True)
+        list(ProductStats.objects.select_for_update().filter(product_id__in=product_ids).order_by('product_id').values_list('product_id'))
+
+        # ORM Query: Which of these visitors like these products now
+        # Equivalent SQL Query:
+        # SELECT id, product_id, session_id FROM store_productlike WHERE product_id IN (...) AND session_id IN (...);
+        existing = {
+            (product_id, session_id): like_id
+            for like_id, product_id, session_id in ProductLike.objects.filter(
+                product_id__in=product_ids, session_id__in={key[1] for key in choices}
+            ).values_list('id', 'product_id', 'session_id')
+        }
+        added = [key for key, liked in choices.items() if liked and key not in existing]
+        removed = [key for key, liked in choices.items() if not liked and key in existing]
+
+        ProductLike.objects.bulk_create([ProductLike(product_id=product_id, session_id=session_id) for product_id, session_id in added])
+        ProductLike.objects.filter(id__in=[existing[key] for key in removed]).delete()
+
+        changes = Counter(product_id for product_id, _ in added)
+        changes.subtract(product_id for product_id, _ in removed)
+        by_change = defaultdict(list)
+        for product_id, change in changes.items():
+            if change:
+                by_change[change].append(product_id)
+        for change, changed_ids in by_change.items():
+            # ORM Query: Move every counter that changes by the same amount at once
+            # Equivalent SQL Query:
+            # UPDATE store_productstats SET likes = likes + %s WHERE product_id IN (...);
+            ProductStats.objects.filter(product_id__in=changed_ids).update(likes=F('likes') + change)
+    return len(added), len(removed)
+
+
+class LikeBuffer:
+    """
+    Latest like choices of visitors not written yet, with the thread that writes them
+    every flush_interval seconds (LIKES_FLUSH_INTERVAL by default, 0 writes each choice at once)
+    """
+
+    def __init__(self, flush_interval=None):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # One flush at a time (the thread's and the one at exit), so choices are written in order
+        self._flushing = threading.Lock()
+        self._pending = {}  # product_id -> {session_id: liked}
+        self._size = 0
+        self._flusher = Flusher(self.flush, self._interval, 'like-flusher')
+
+    def set(self, product_id, session_id, liked):
+        """
+        Record that a visitor likes (or no longer likes) a product. Returns False if the
+        buffer is full (the database is not keeping up) and the choice wasn't taken.
+        """
+        if not self._interval():
+            apply({(product_id, session_id): liked})
+            return True
+        with self._lock:
+            sessions = self._pending.get(product_id, {})
+            if session_id not in sessions:
+                if self._size >= settings.LIKES_BUFFER_MAX:
+                    return False
+                self._size += 1
+            self._pending.setdefault(product_id, sessions)[session_id] = liked
+            full = self._size >= settings.LIKES_BUFFER_MAX // 2
+        self._flusher.start()
+        if full:
+            self._flusher.wake()
+        return True
+
+    def pending(self, product_id, session_id):
+        """The unwritten choice of a visitor for a product, None if there is none"""
+        with self._lock:
+            return self._pending.get(product_id, {}).get(session_id)
+
+    def pending_for(self, product_id):
+        """Unwritten choices for a product, {session_id: liked}"""
+        with self._lock:
+            return dict(self._pending.get(product_id, {}))
+
+    def __len__(self):
+        return self._size
+
+    def flush(self):
+        """Write every pending choice; returns how many likes were added and removed"""
+        with self._flushing:
+            with self._lock:
+                choices, self._pending, self._size = self._pending, {}, 0
+            items = [
+                ((product_id, session_id), liked)
+                for product_id, sessions in choices.items() for session_id, liked in sessions.items()
+            ]
+            added = removed = 0
+            for start in range(0, len(items), FLUSH_CHUNK):
+                chunk = dict(items[start:start + FLUSH_CHUNK])
+                try:
+                    chunk_added, chunk_removed = apply(chunk)
+                except Exception as e:
+                    dropped = 0
+                    with self._lock:
+                        for (product_id, session_id), liked in items[start:]:
+                            sessions = self._pending.get(product_id, {})
+                            # Choices made since the flush started are newer
+                            if session_id in sessions:
+                                continue
+                            if self._size >= settings.LIKES_BUFFER_MAX:
+                                dropped += 1
+                                continue
+                            self._pending.setdefault(product_id, sessions)[session_id] = liked
+                            self._size += 1
+                    logger.error(f"Failed to write {len(items) - start} likes, retrying on the next flush: {e}")
+                    if dropped:
+                        logger.error(f"Dropped {dropped} of those likes, the buffer is full")
+                    break
+                added += chunk_added
+                removed += chunk_removed
+        if items:
+            logger.info(f"Flushed {len(items)} like choices: {added} added, {removed} removed")
+        return added, removed
+
+    def _interval(self):
+        if self.flush_interval is None:
+            return settings.LIKES_FLUSH_INTERVAL
+        return self.flush_interval
+
+
+buffer = LikeBuffer()
+
+# Write what is left when the process exits normally
+atexit.register(buffer.flush)
+
+
+def get_state(product_id, session_id):
+    """
+    (liked, likes) of a product for a visitor. Both include the choices not written yet
+    in this process; other processes' choices count once they flush theirs.
+    """
+    pending = buffer.pending_for(product_id)
+    # ORM Query: Which of the visitors with unwritten choices (and this visitor) like the product now
+    # Equivalent SQL Query:
+    # SELECT session_id FROM store_productlike WHERE product_id = %s AND session_id IN (...);
+    stored = set(
+        ProductLike.objects.filter(product_id=product_id, session_id__in=[session_id, *pending])
+        .values_list('session_id', flat=True)
+    )
+    # ORM Query: Read the counter
+    # Equivalent SQL Query:
+    # SELECT likes FROM store_productstats WHERE product_id = %s;
+    likes = ProductStats.objects.filter(product_id=product_id).values_list('likes', flat=True).first() or 0
+
+    # Choices that will add or remove a like when they are written
+    likes += sum(1 for session, liked in pending.items() if liked and session not in stored)
+    likes -= sum(1 for session, liked in pending.items() if not liked and session in stored)
+    return pending.get(session_id, session_id in stored), likes
+
+
+def recount(product_ids=None):
+    """Set the like counters from the ProductLike rows (all products by default), e.g. after manual changes"""
+    stats = ProductStats.objects.all()
+    if product_ids is not None:
+        stats = stats.filter(product_id__in=product_ids)
+    # ORM Query: Count the rows of every product at once
+    # Equivalent SQL Query:
+    # UPDATE store_productstats SET likes = (SELECT COUNT(*) FROM store_productlike
+    # WHERE store_productlike.product_id = store_productstats.product_id) WHERE ...;
+    counts = (
+        ProductLike.objects.filter(product_id=OuterRef('product_id'))
+        .values('product_id').annotate(count=Count('id')).values('count')
+    )
+    return stats.update(likes=Coalesce(Subquery(counts), 0))
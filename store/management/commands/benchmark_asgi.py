@@ -0,0 +1,162 @@
+# store/management/commands/benchmark_asgi.py
+
+import io
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare GET /api/cart/ under the WSGI handler (a fixed pool of worker threads, like "
+        "gunicorn --threads) and the ASGI handler (requests as coroutines, like uvicorn), in process"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help="Requests per handler")
+        parser.add_argument('--concurrency', type=int, default=200, help="Requests in progress at once")
+        parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads")
+        parser.add_argument(
+            '--db-latency', type=float, default=5.0,
+            help="Milliseconds added to every query, like a database on another host (0 for none)"
+        )
+
+    def handle(self, *args, **options):
+        if options['requests'] <= 0 or options['concurrency'] <= 0 or options['threads'] <= 0:
+            raise CommandError("--requests, --concurrency and --threads must be positive")
+        if options['db_latency'] < 0:
+            raise CommandError("--db-latency can't be negative")
+
+        # One session per client, each reads its own cart
+        cookies = []
+        for _ in range(options['concurrency']):
+            session = SessionStore()
+            session.create()
+            cookies.append(f"{settings.SESSION_COOKIE_NAME}={session.session_key}")
+
+        latency = options['db_latency'] / 1000
+
+        def slow_queries(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            # Sent again each time a thread's connection reconnects
+            if slow_queries not in connection.execute_wrappers:
+                connection.execute_wrappers.append(slow_queries)
+
+        if latency:
+            connection_created.connect(add_latency, dispatch_uid='benchmark_asgi_latency')
+        try:
+            wsgi = WSGIHandler()
+            # Creates the carts, not timed
+            self.run_wsgi(wsgi, cookies, len(cookies), options['threads'], len(cookies))
+
+            self.stdout.write(
+                f"GET /api/cart/, {options['requests']} requests, {options['concurrency']} at once, "
+                f"{options['db_latency']:g}ms per query:"
+            )
+            self.report(
+                f"WSGI, {options['threads']} threads",
+                *self.run_wsgi(wsgi, cookies, options['requests'], options['threads'], options['concurrency'])
+            )
+            self.report("ASGI", *asyncio.run(self.run_asgi(ASGIHandler(), cookies, options['requests'])))
+        finally:
+            connection_created.disconnect(dispatch_uid='benchmark_asgi_latency')
+
+    def run_wsgi(self, handler, cookies, requests, threads, concurrency):
+        def request(cookie, queued):
+            statuses = []
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/cart/', 'QUERY_STRING': '',
+                'SERVER_NAME': '127.0.0.1', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'REMOTE_ADDR': '127.0.0.1', 'HTTP_COOKIE': cookie, 'wsgi.url_scheme': 'http',
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(),
+            }
+            response = handler(environ, lambda status, headers: statuses.append(int(status.split()[0])))
+            b''.join(response)
+            response.close()
+            return statuses[0], time.perf_counter() - queued
+
+        # A new request as soon as one is answered, `concurrency` in progress. Those past the
+        # busy threads wait in the pool's queue, as in a server's backlog
+        in_progress = threading.BoundedSemaphore(concurrency)
+        with Monitor() as monitor, ThreadPoolExecutor(max_workers=threads) as pool:
+            started = time.perf_counter()
+            futures = []
+            for i in range(requests):
+                in_progress.acquire()
+                futures.append(pool.submit(request, cookies[i % len(cookies)], time.perf_counter()))
+                futures[-1].add_done_callback(lambda future: in_progress.release())
+            results = [future.result() for future in futures]
+        return results, time.perf_counter() - started, monitor.peak
+
+    async def run_asgi(self, handler, cookies, requests):
+        async def request(cookie):
+            queued = time.perf_counter()
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+                'method': 'GET', 'path': '/api/cart/', 'query_string': b'', 'root_path': '',
+                'headers': [(b'host', b'127.0.0.1'), (b'cookie', cookie.encode())],
+                'client': ('127.0.0.1', 50000), 'server': ('127.0.0.1', 80),
+            }
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            await handler(scope, receive, send)
+            return messages[0]['status'], time.perf_counter() - queued
+
+        async def client(cookie, count):
+            return [await request(cookie) for _ in range(count)]
+
+        with Monitor() as monitor:
+            started = time.perf_counter()
+            counts = [requests // len(cookies) + (i < requests % len(cookies)) for i in range(len(cookies))]
+            results = await asyncio.gather(*[client(cookie, count) for cookie, count in zip(cookies, counts)])
+        return [result for client_results in results for result in client_results], \
+            time.perf_counter() - started, monitor.peak
+
+    def report(self, label, results, elapsed, threads):
+        failed = sum(1 for status, _ in results if status != 200)
+        if failed:
+            raise CommandError(f"{label}: {failed} requests failed")
+        timings = sorted(seconds * 1000 for _, seconds in results)
+        self.stdout.write(
+            f"  {label:<20} {len(results) / elapsed:7.0f} req/s   median {timings[len(timings) // 2]:7.1f}ms   "
+            f"p99 {timings[int(len(timings) * 0.99)]:7.1f}ms   peak {threads} threads"
+        )
+
+
+class Monitor:
+    """Highest number of threads alive while the with block runs"""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._done = threading.Event()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._done.set()
+        self._thread.join()
+        # Leave out this sampling thread
+        self.peak -= 1
+
+    def _sample(self):
+        while not self._done.wait(0.005):
+            self.peak = max(self.peak, threading.active_count())
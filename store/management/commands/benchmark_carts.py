@@ -0,0 +1,121 @@
+# store/management/commands/benchmark_carts.py
+
+import time
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models
+from django.utils import timezone
+from store.models import Cart
+from store.views import _get_cart
+
+# Session IDs of the seeded carts, removed again when the benchmark ends
+PREFIX = 'benchmark-'
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed abandoned and active carts, then time the per-request cart lookup "
+        "without the session_id index, with it, and after purge_stale_carts"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=1000000, help="Carts seeded")
+        parser.add_argument(
+            '--stale-fraction', type=float, default=0.9,
+            help="Share of the seeded carts older than CART_RETENTION_DAYS"
+        )
+        parser.add_argument('--lookups', type=int, default=2000, help="Cart lookups timed per run")
+        parser.add_argument('--batch-size', type=int, default=10000, help="Carts inserted per query")
+        parser.add_argument(
+            '--i-know', action='store_true',
+            help="Confirm the run may drop the store_cart session_id index and purge real abandoned carts"
+        )
+
+    def handle(self, *args, **options):
+        if not options['i_know']:
+            raise CommandError(
+                "This drops the session_id index of the live store_cart table while it runs (every cart "
+                "lookup scans the table meanwhile) and purges every abandoned cart, not only the seeded "
+                "ones. Run it against a local or staging database, with --i-know"
+            )
+        if options['carts'] <= 0 or options['lookups'] <= 0 or options['batch_size'] <= 0:
+            raise CommandError("--carts, --lookups and --batch-size must be positive")
+        if not 0 <= options['stale_fraction'] < 1:
+            raise CommandError("--stale-fraction must be at least 0 and below 1")
+        if Cart.objects.filter(session_id__startswith=PREFIX).exists():
+            raise CommandError(f"Carts from an earlier run are still there, delete the '{PREFIX}' sessions first")
+
+        stale = int(options['carts'] * options['stale_fraction'])
+        live = options['carts'] - stale
+        try:
+            self.seed(stale, live, options['batch_size'])
+            rng = random.Random(1)
+            sessions = [f"{PREFIX}live-{rng.randrange(live)}" for _ in range(options['lookups'])]
+
+            self.stdout.write(f"get_cart for {len(sessions)} active carts, ms:")
+            with self.without_session_index():
+                self.report(f"{Cart.objects.count()} carts, no index", sessions)
+            self.report(f"{Cart.objects.count()} carts, indexed", sessions)
+
+            started = time.perf_counter()
+            call_command('purge_stale_carts', skip_sessions=True, stdout=self.stdout)
+            self.stdout.write(f"Purge took {time.perf_counter() - started:.1f}s")
+            self.report(f"{Cart.objects.count()} carts, indexed, purged", sessions)
+        finally:
+            # ORM Query: Remove the seeded carts
+            # Equivalent SQL Query:
+            # DELETE FROM store_cart WHERE session_id LIKE 'benchmark-%';
+            Cart.objects.filter(session_id__startswith=PREFIX).delete()
+
+    def seed(self, stale, live, batch_size):
+        started = time.perf_counter()
+        for kind, count in (('stale', stale), ('live', live)):
+            for offset in range(0, count, batch_size):
+                Cart.objects.bulk_create(
+                    Cart(session_id=f"{PREFIX}{kind}-{i}")
+                    for i in range(offset, min(offset + batch_size, count))
+                )
+
+        # bulk_create stamps updated_at with now, update() leaves auto_now alone
+        # ORM Query: Age the abandoned carts past the retention period
+        # Equivalent SQL Query:
+        # UPDATE store_cart SET updated_at = %s WHERE session_id LIKE 'benchmark-stale-%';
+        Cart.objects.filter(session_id__startswith=f"{PREFIX}stale-").update(
+            updated_at=timezone.now() - timedelta(days=settings.CART_RETENTION_DAYS + 1)
+        )
+        self.stdout.write(
+            f"Seeded {stale} abandoned and {live} active carts in {time.perf_counter() - started:.1f}s"
+        )
+
+    @contextmanager
+    def without_session_index(self):
+        """Drop the session_id index for the duration of the with block"""
+        indexed = Cart._meta.get_field('session_id')
+        plain = models.CharField(max_length=indexed.max_length)
+        plain.set_attributes_from_name(indexed.name)
+        plain.model = Cart
+
+        with connection.schema_editor() as editor:
+            editor.alter_field(Cart, indexed, plain)
+        try:
+            yield
+        finally:
+            started = time.perf_counter()
+            with connection.schema_editor() as editor:
+                editor.alter_field(Cart, plain, indexed)
+            self.stdout.write(f"Rebuilt the session_id index in {time.perf_counter() - started:.1f}s")
+
+    def report(self, label, sessions):
+        timings = []
+        for session_id in sessions:
+            started = time.perf_counter()
+            _get_cart(session_id)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        median = timings[len(timings) // 2]
+        p99 = timings[int(len(timings) * 0.99)]
+        self.stdout.write(f"  {label:<40} median {median:8.3f}   p99 {p99:8.3f}")
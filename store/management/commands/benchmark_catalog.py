@@ -0,0 +1,80 @@
+# store/management/commands/benchmark_catalog.py
+
+import gc
+import time
+import tracemalloc
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from store.models import Product, Category
+from store.catalog import ColumnarCatalog
+
+
+class Command(BaseCommand):
+    help = "Compare memory and search latency of the in-memory catalog (store/catalog.py) with the ORM"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per search, the median is shown")
+        parser.add_argument(
+            '--orm-sample', type=int, default=100000,
+            help="Products loaded as model instances to measure their memory (scaled to the whole catalog)"
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] <= 0 or options['orm_sample'] <= 0:
+            raise CommandError("--repeat and --orm-sample must be positive")
+
+        total = Product.objects.count()
+        if not total:
+            raise CommandError("No products to benchmark")
+
+        catalog = ColumnarCatalog()
+        started = time.perf_counter()
+        catalog.rebuild()
+        columns = catalog.columns()
+        self.stdout.write(f"{total} products, catalog built in {time.perf_counter() - started:.1f}s")
+
+        sample = min(total, options['orm_sample'])
+        gc.collect()
+        tracemalloc.start()
+        products = list(Product.objects.all()[:sample])
+        orm_bytes = tracemalloc.get_traced_memory()[0] / len(products) * total
+        tracemalloc.stop()
+        del products
+        self.stdout.write(
+            f"Memory: catalog {columns.nbytes / 1048576:.1f}MB, "
+            f"Product instances {orm_bytes / 1048576:.1f}MB (from {sample})"
+        )
+
+        category = Category.objects.order_by('id').values_list('name', flat=True).first()
+        searches = [
+            ("price 20-50", {'min_price': 20.0, 'max_price': 50.0}),
+            ("rating >= 4, by price", {'min_rating': 4.0, 'sort': 'price-asc'}),
+            (f"category {category}, newest", {'category': category, 'sort': 'newest'}),
+            (f"{category} 10-30, rating >= 3, by rating", {
+                'category': category, 'min_price': 10.0, 'max_price': 30.0, 'min_rating': 3.0, 'sort': 'rating-desc',
+            }),
+        ]
+
+        self.stdout.write("First page and count / facets, median ms:    ORM    catalog")
+        for label, filters in searches:
+            orm = self.time(options['repeat'], lambda: self.first_page(Product.search(**filters)))
+            memory = self.time(options['repeat'], lambda: self.first_page(catalog.search(**filters)))
+            self.stdout.write(f"  {label:<40} {orm:8.1f} {memory:8.1f}")
+
+            filters = {key: value for key, value in filters.items() if key != 'sort'}
+            orm = self.time(options['repeat'], lambda: Product.search_facets(**filters))
+            memory = self.time(options['repeat'], lambda: catalog.facets(**filters))
+            self.stdout.write(f"  {'  facets':<40} {orm:8.1f} {memory:8.1f}")
+
+    def first_page(self, results):
+        page = Paginator(results, settings.PRODUCTS_PER_PAGE).page(1)
+        return page.paginator.count, list(page)
+
+    def time(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return sorted(timings)[len(timings) // 2]
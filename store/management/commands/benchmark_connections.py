@@ -0,0 +1,117 @@
+# store/management/commands/benchmark_connections.py
+
+import time
+import threading
+from http.client import HTTPConnection
+from http.cookies import SimpleCookie
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import connections
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # Without it the small response writes stall on delayed ACKs and hide the database time
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure get_cart requests per second through a threaded WSGI server "
+        "for each DB_CONN_MAX_AGE value (connection per request vs reused connections)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--conn-max-age', type=int, nargs='+', default=[0, 60],
+            help="CONN_MAX_AGE values to compare (0 opens a connection for every request)"
+        )
+        parser.add_argument('--requests', type=int, default=5000, help="Requests per run")
+        parser.add_argument('--concurrency', type=int, default=8, help="Clients sending requests at once")
+
+    def handle(self, *args, **options):
+        if options['requests'] <= 0 or options['concurrency'] <= 0:
+            raise CommandError("--requests and --concurrency must be positive")
+        if any(age < 0 for age in options['conn_max_age']):
+            raise CommandError("--conn-max-age values can't be negative")
+
+        database = connections.settings['default']
+        self.stdout.write(
+            f"GET /api/cart/ against {database['ENGINE'].rsplit('.', 1)[-1]} "
+            f"{database.get('HOST') or database['NAME']} (DB_POOL_MODE={settings.DB_POOL_MODE}), "
+            f"{options['requests']} requests from {options['concurrency']} clients"
+        )
+
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+        server.set_app(get_internal_wsgi_application())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        original = database['CONN_MAX_AGE']
+        try:
+            for age in options['conn_max_age']:
+                # Server threads read it from the shared settings dict when they connect
+                database['CONN_MAX_AGE'] = age
+                rate, opened = self.run(server.server_address[1], options['requests'], options['concurrency'])
+                self.stdout.write(f"  CONN_MAX_AGE={age:<6} {rate:8.0f} req/s   {opened} database connections opened")
+        finally:
+            database['CONN_MAX_AGE'] = original
+            server.shutdown()
+            server.server_close()
+
+    def run(self, port, requests, concurrency):
+        opened = []
+        opened_lock = threading.Lock()
+        original_connect = connections['default'].__class__.connect
+
+        def counting_connect(wrapper):
+            with opened_lock:
+                opened.append(wrapper.alias)
+            return original_connect(wrapper)
+
+        # Every client keeps its HTTP connection, and so its server thread, for the whole run
+        clients = []
+        for _ in range(concurrency):
+            client = HTTPConnection('127.0.0.1', port)
+            client.request('GET', '/api/cart/')
+            response = client.getresponse()
+            response.read()
+            if response.status != 200:
+                raise CommandError(f"GET /api/cart/ returned {response.status}")
+            cookie = SimpleCookie(response.getheader('Set-Cookie'))
+            clients.append((client, f"{settings.SESSION_COOKIE_NAME}={cookie[settings.SESSION_COOKIE_NAME].value}"))
+
+        barrier = threading.Barrier(concurrency + 1)
+        failures = []
+
+        def worker(client, cookie, count):
+            barrier.wait()
+            for _ in range(count):
+                client.request('GET', '/api/cart/', headers={'Cookie': cookie})
+                response = client.getresponse()
+                response.read()
+                if response.status != 200:
+                    failures.append(response.status)
+
+        workers = [
+            threading.Thread(target=worker, args=(client, cookie, requests // concurrency + (i < requests % concurrency)))
+            for i, (client, cookie) in enumerate(clients)
+        ]
+        connections['default'].__class__.connect = counting_connect
+        try:
+            for thread in workers:
+                thread.start()
+            barrier.wait()
+            started = time.perf_counter()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            connections['default'].__class__.connect = original_connect
+            for client, _ in clients:
+                client.close()
+
+        if failures:
+            raise CommandError(f"{len(failures)} requests failed (status {failures[0]})")
+        return requests / elapsed, len(opened)
@@ -0,0 +1,108 @@
+# store/management/commands/benchmark_likes.py
+
+import time
+import random
+import threading
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from store.models import Product, ProductLike
+from store import likes
+
+SESSION_PREFIX = 'benchmark-'
+
+
+class TimedLikeBuffer(likes.LikeBuffer):
+    """Keeps how long each flush took, those of its thread included"""
+
+    def __init__(self, flush_interval):
+        super().__init__(flush_interval)
+        self.flushes = []
+
+    def flush(self):
+        started = time.perf_counter()
+        result = super().flush()
+        self.flushes.append(time.perf_counter() - started)
+        return result
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare writing likes one transaction each with the write-behind buffer (store/likes.py). "
+        "Run against a local or staging database: it adds likes and removes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--likes', type=int, default=100000, help="Likes through the buffer")
+        parser.add_argument('--direct', type=int, default=2000, help="Likes written one transaction each")
+        parser.add_argument('--products', type=int, default=1000, help="Products liked (the first N)")
+        parser.add_argument('--sessions', type=int, default=50000, help="Distinct visitors")
+        parser.add_argument('--threads', type=int, default=4, help="Threads liking at once, like request workers")
+        parser.add_argument('--flush-interval', type=float, default=1.0, help="Seconds between flushes")
+
+    def handle(self, *args, **options):
+        if min(options['likes'], options['direct'], options['products'], options['sessions'], options['threads']) <= 0:
+            raise CommandError("Every count must be positive")
+        if options['flush_interval'] <= 0:
+            raise CommandError("--flush-interval must be positive")
+
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True)[:options['products']])
+        if not product_ids:
+            raise CommandError("No products to like")
+
+        def random_like(rng):
+            return rng.choice(product_ids), f"{SESSION_PREFIX}{rng.randrange(options['sessions'])}", rng.random() < 0.9
+
+        try:
+            # One transaction per like, like writing it in the request
+            rng = random.Random(1)
+            started = time.perf_counter()
+            for _ in range(options['direct']):
+                product_id, session_id, liked = random_like(rng)
+                likes.apply({(product_id, session_id): liked})
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"Direct:   {options['direct']} likes in {elapsed:.2f}s, {options['direct'] / elapsed:.0f} likes/s")
+
+            # Threads add to a buffer while its thread flushes it
+            buffer = TimedLikeBuffer(options['flush_interval'])
+            refused = []
+
+            def worker(seed, count):
+                rng = random.Random(seed)
+                retries = 0
+                for _ in range(count):
+                    like = random_like(rng)
+                    # A full buffer refuses new likes until the flush catches up, clients retry
+                    while not buffer.set(*like):
+                        retries += 1
+                        time.sleep(0.01)
+                refused.append(retries)
+
+            per_thread = options['likes'] // options['threads']
+            threads = [threading.Thread(target=worker, args=(seed, per_thread)) for seed in range(options['threads'])]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            buffered = time.perf_counter() - started
+            # Whatever the last interval left, as a shutting down process would
+            buffer.flush()
+            elapsed = time.perf_counter() - started
+
+            total = per_thread * options['threads']
+            self.stdout.write(
+                f"Buffered: {total} likes in {elapsed:.2f}s, {total / elapsed:.0f} likes/s written "
+                f"({total / buffered:.0f} likes/s accepted by the buffer)"
+            )
+            if sum(refused):
+                self.stdout.write(f"  {sum(refused)} likes refused while the buffer was full, then retried")
+            if buffer.flushes:
+                self.stdout.write(
+                    f"  {len(buffer.flushes)} flushes, longest {max(buffer.flushes):.2f}s, "
+                    f"{sum(buffer.flushes):.2f}s in total"
+                )
+        finally:
+            touched = list(ProductLike.objects.filter(session_id__startswith=SESSION_PREFIX).values_list('product_id', flat=True).distinct())
+            ProductLike.objects.filter(session_id__startswith=SESSION_PREFIX).delete()
+            likes.recount(touched)
+            connections.close_all()
@@ -0,0 +1,50 @@
+# store/management/commands/benchmark_recommendations.py
+
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from store.models import Product
+from store import recommendations
+
+
+class Command(BaseCommand):
+    help = "Time vectorizing and finding the neighbours of the first N products, without storing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000, help="Products to include")
+        parser.add_argument('--neighbours', type=int, default=settings.SIMILAR_PRODUCTS)
+        parser.add_argument('--batch-size', type=int, help="Products scored at once (default: about 200MB of scores)")
+        parser.add_argument('--examples', type=int, default=3, help="Products whose neighbours are printed")
+
+    def handle(self, *args, **options):
+        if min(options['products'], options['neighbours'], options['batch_size'] or 1) <= 0:
+            raise CommandError("--products, --neighbours and --batch-size must be positive")
+
+        started = time.perf_counter()
+        rows = list(
+            Product.objects.order_by('id').values_list('id', 'name', 'description', 'feature')[:options['products']]
+        )
+        if len(rows) < 2:
+            raise CommandError("Not enough products to benchmark")
+        self.stdout.write(f"Read {len(rows)} products in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        matrix = recommendations.vectorize(row[1:] for row in rows)
+        self.stdout.write(
+            f"Vectorized into {matrix.shape[1]} terms, {matrix.nnz} nonzeros in {time.perf_counter() - started:.1f}s"
+        )
+
+        started = time.perf_counter()
+        examples = {}
+        for start, indices, scores in recommendations.neighbours(matrix, options['neighbours'], options['batch_size']):
+            if start == 0:
+                examples = {row: (indices[row], scores[row]) for row in range(min(options['examples'], len(indices)))}
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Neighbours of {len(rows)} products in {elapsed:.1f}s ({len(rows) / elapsed:.0f} products/s)"
+        )
+
+        for row, (indices, scores) in examples.items():
+            self.stdout.write(f"  {rows[row][1]}:")
+            for index, score in zip(indices, scores):
+                self.stdout.write(f"    {score:.2f}  {rows[index][1]}")
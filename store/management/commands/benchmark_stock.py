@@ -0,0 +1,115 @@
+# store/management/commands/benchmark_stock.py
+
+import time
+import threading
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from store.models import Product, Stock
+from store import inventory
+
+
+class Command(BaseCommand):
+    help = (
+        "Flash sale benchmark: many concurrent checkouts of one product. Changes its stock "
+        "while running and restores it afterwards, so run it against a staging database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_id', type=int)
+        parser.add_argument('--size', default='', help="Size to sell (default: no size)")
+        parser.add_argument('--checkouts', type=int, default=500, help="Checkouts to attempt")
+        parser.add_argument('--concurrency', type=int, default=100, help="Checkouts running at once")
+        parser.add_argument('--stock', type=int, default=200, help="Units on sale")
+        parser.add_argument('--shards', type=int, default=1, help="Stock rows to split the units over")
+        parser.add_argument(
+            '--hold', type=float, default=5,
+            help="Milliseconds each checkout keeps its transaction open after taking the stock "
+                 "(stands in for writing the order)"
+        )
+
+    def handle(self, *args, **options):
+        for name in ('checkouts', 'concurrency', 'shards'):
+            if options[name] <= 0:
+                raise CommandError(f"--{name} must be positive")
+        if options['stock'] < 0:
+            raise CommandError("--stock must be zero or more")
+        product_id, size = options['product_id'], options['size']
+        if not Product.objects.filter(id=product_id).exists():
+            raise CommandError(f"No product with id {product_id}")
+
+        saved = list(Stock.objects.filter(product_id=product_id, size=size).values('shard', 'quantity'))
+        inventory.set_stock(product_id, size, options['stock'], options['shards'])
+        try:
+            results = self.run(product_id, size, options)
+            left = inventory.available(product_id, size)
+        finally:
+            Stock.objects.filter(product_id=product_id, size=size).delete()
+            Stock.objects.bulk_create(Stock(product_id=product_id, size=size, **row) for row in saved)
+
+        elapsed = results['elapsed']
+        latencies = sorted(results['latencies'])
+        sold = results['sold']
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+
+        self.stdout.write(
+            f"{options['checkouts']} checkouts, {options['concurrency']} at once, "
+            f"{options['stock']} units in {options['shards']} shards"
+        )
+        self.stdout.write(f"Sold {sold}, sold out {results['sold_out']}, errors {len(results['errors'])}")
+        self.stdout.write(
+            f"{elapsed:.2f}s, {options['checkouts'] / elapsed:.0f} checkouts/s, "
+            f"latency p50 {percentile(0.5):.1f}ms p95 {percentile(0.95):.1f}ms p99 {percentile(0.99):.1f}ms"
+        )
+        for error in results['errors'][:5]:
+            self.stdout.write(f"  {error}")
+
+        if left != options['stock'] - sold or sold > options['stock']:
+            raise CommandError(f"Stock is inconsistent: {options['stock']} - {sold} sold != {left} left")
+        self.stdout.write(self.style.SUCCESS(f"{left} left, no unit sold twice"))
+
+    def run(self, product_id, size, options):
+        lock = threading.Lock()
+        remaining = [options['checkouts']]
+        results = {'sold': 0, 'sold_out': 0, 'errors': [], 'latencies': []}
+        concurrency = min(options['concurrency'], options['checkouts'])
+        start_line = threading.Barrier(concurrency + 1)
+
+        def checkout():
+            started = time.perf_counter()
+            with transaction.atomic():
+                taken = inventory.take(product_id, size, 1)
+                if taken:
+                    time.sleep(options['hold'] / 1000)
+            return taken, time.perf_counter() - started
+
+        def worker():
+            start_line.wait()
+            try:
+                while True:
+                    with lock:
+                        if not remaining[0]:
+                            return
+                        remaining[0] -= 1
+                    try:
+                        taken, seconds = checkout()
+                    except Exception as e:
+                        with lock:
+                            results['errors'].append(str(e))
+                        continue
+                    with lock:
+                        results['sold' if taken else 'sold_out'] += 1
+                        results['latencies'].append(seconds)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        start_line.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        results['elapsed'] = time.perf_counter() - started
+        return results
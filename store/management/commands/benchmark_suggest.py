@@ -0,0 +1,102 @@
+# store/management/commands/benchmark_suggest.py
+
+import time
+import random
+import threading
+from django.core.management.base import BaseCommand, CommandError
+from store.models import Product
+from store.suggest import SuggestIndex
+
+# Words of the synthetic product names
+WORDS = (
+    'arizona', 'wildcats', 'wilbur', 'wilma', 'tucson', 'desert', 'cactus', 'saguaro', 'red', 'blue',
+    'navy', 'white', 'classic', 'vintage', 'retro', 'official', 'youth', 'women', 'men', 'fleece',
+    'cotton', 'hoodie', 't-shirt', 'cap', 'beanie', 'scarf', 'mug', 'keychain', 'flag', 'pennant',
+    'sticker', 'poster', 'jersey', 'jacket', 'socks', 'backpack', 'bottle', 'lanyard', 'blanket', 'pin',
+)
+CATEGORIES = ('Apparel', 'Accessories', 'Gifts')
+POKEMON = ('pikachu', 'charizard', 'eevee', 'snorlax', 'bulbasaur', None, None, None)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the search suggestion index (store/suggest.py): build time, lookup latency, "
+        "and lookups while the index is being rebuilt"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--synthetic', type=int, default=0,
+            help="Index N generated products instead of the database's"
+        )
+        parser.add_argument('--lookups', type=int, default=10000, help="Prefix lookups timed")
+
+    def handle(self, *args, **options):
+        if options['synthetic'] < 0 or options['lookups'] <= 0:
+            raise CommandError("--synthetic can't be negative and --lookups must be positive")
+
+        index = SuggestIndex()
+        if options['synthetic']:
+            rows = self.synthetic_rows(options['synthetic'])
+            started = time.perf_counter()
+            index.build(rows, {})
+        else:
+            if not Product.objects.exists():
+                raise CommandError("No products to benchmark, try --synthetic 100000")
+            started = time.perf_counter()
+            index.rebuild()
+        build_seconds = time.perf_counter() - started
+        names = [product['name'] for product in index._products.values()]
+        self.stdout.write(f"{len(names)} products, {len(index._keys)} keys, built in {build_seconds:.2f}s")
+
+        # What people type: the first 1 to 6 letters of a word of a product name
+        rng = random.Random(1)
+        prefixes = []
+        for _ in range(options['lookups']):
+            word = rng.choice(rng.choice(names).split())
+            prefixes.append(word[:rng.randint(1, 6)])
+
+        def lookups(cached=True):
+            timings = []
+            for prefix in prefixes:
+                if not cached:
+                    with index._lock:
+                        index._responses.clear()
+                lookup_started = time.perf_counter()
+                index.suggest(prefix)
+                timings.append(time.perf_counter() - lookup_started)
+            timings.sort()
+            return timings
+
+        def report(label, timings):
+            median = timings[len(timings) // 2] * 1e6
+            p99 = timings[int(len(timings) * 0.99)] * 1e6
+            self.stdout.write(f"  {label:<36} median {median:8.1f}us   p99 {p99:10.1f}us   max {timings[-1] * 1e3:8.1f}ms")
+
+        self.stdout.write(f"{len(prefixes)} lookups:")
+        report("uncached", lookups(cached=False))
+        report("cached", lookups())
+
+        if options['synthetic']:
+            # The background rebuild reloads from the database, not the generated rows
+            index.rebuild = lambda: index.build(rows, {})
+        # A product change: lookups keep the old index while one rebuild runs in the background
+        built_at = index._built_at
+        index.mark_stale()
+        refresh_started = time.perf_counter()
+        stale = lookups()
+        while index._built_at == built_at:
+            time.sleep(0.01)
+        report("during a rebuild", stale)
+        self.stdout.write(
+            f"  rebuilt in the background in {time.perf_counter() - refresh_started:.2f}s, "
+            f"{threading.active_count()} threads (a lookup rebuilding in the request would take {build_seconds:.2f}s)"
+        )
+
+    def synthetic_rows(self, count):
+        rng = random.Random(0)
+        return [
+            (product_id, ' '.join(rng.sample(WORDS, rng.randint(2, 5))).title(),
+             rng.choice(POKEMON), rng.choice(CATEGORIES))
+            for product_id in range(1, count + 1)
+        ]
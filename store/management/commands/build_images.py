@@ -0,0 +1,49 @@
+# store/management/commands/build_images.py
+
+import time
+from django.core.management.base import BaseCommand
+from store.images import build_derivatives, load_manifest
+from store.models import VisualContent
+
+
+class Command(BaseCommand):
+    help = "Generate resized AVIF/WebP/JPEG derivatives of the product images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Rebuild every image, not only the ones that changed"
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help="Number of worker processes (defaults to the CPU count)"
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        built, unchanged, removed = build_derivatives(force=options['force'], workers=options['workers'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Built derivatives for {built} images, {unchanged} unchanged, "
+            f"{removed} removed in {elapsed:.1f}s"
+        )
+        self.stdout.write(f"Updated dimensions and placeholders of {self.sync_visuals()} visuals")
+
+    def sync_visuals(self):
+        """Copy image dimensions and placeholders from the manifest onto VisualContent rows"""
+        updated = 0
+        for filename, entry in load_manifest().items():
+            short_name, _, file_type = filename.rpartition('.')
+            # ORM Query: Update visuals using this image whose metadata is out of date
+            # Equivalent SQL Query:
+            # UPDATE store_visualcontent SET width = %s, height = %s, placeholder = %s
+            # WHERE short_name = %s AND file_type = %s
+            # AND NOT (width = %s AND height = %s AND placeholder = %s);
+            updated += VisualContent.objects.filter(
+                short_name=short_name, file_type=file_type
+            ).exclude(
+                width=entry['width'], height=entry['height'], placeholder=entry['placeholder']
+            ).update(
+                width=entry['width'], height=entry['height'], placeholder=entry['placeholder']
+            )
+        return updated
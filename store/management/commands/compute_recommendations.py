@@ -0,0 +1,37 @@
+# store/management/commands/compute_recommendations.py
+
+import time
+import logging
+from django.conf import settings
+from django.core.management.base import CommandError
+from store.management.periodic import PeriodicCommand
+from store import recommendations
+
+logger = logging.getLogger(__name__)
+
+
+class Command(PeriodicCommand):
+    help = "Recompute the most similar products of every product (shown as recommendations on product pages)"
+    interval_help = "Keep running and recompute every N seconds (0 runs once)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--neighbours', type=int, default=settings.SIMILAR_PRODUCTS,
+            help="Similar products stored per product"
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            help="Products scored at once, memory grows with batch size x catalog size (default: about 200MB)"
+        )
+        super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options['neighbours'] <= 0 or (options['batch_size'] or 1) <= 0:
+            raise CommandError("--neighbours and --batch-size must be positive")
+        super().handle(*args, **options)
+
+    def run_once(self, options):
+        started = time.perf_counter()
+        stored = recommendations.compute(options['neighbours'], options['batch_size'])
+        logger.info(f"Stored {stored} similar products")
+        self.stdout.write(f"Stored {stored} similar products in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,133 @@
+# store/management/commands/purge_stale_carts.py
+
+import time
+import logging
+from datetime import timedelta
+from importlib import import_module
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.utils import timezone
+from store.management.periodic import PeriodicCommand
+from store.models import Cart, CartItem
+from store import inventory
+
+logger = logging.getLogger(__name__)
+
+
+class Command(PeriodicCommand):
+    help = "Delete abandoned carts and expired sessions in small batches"
+    interval_help = "Keep running and repeat the purge every N seconds (0 runs once)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.CART_RETENTION_DAYS,
+            help="Delete carts not updated in this many days"
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.CART_PURGE_BATCH_SIZE,
+            help="Rows deleted per transaction"
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0.0,
+            help="Seconds to sleep between batches to yield to live traffic"
+        )
+        parser.add_argument(
+            '--skip-sessions', action='store_true',
+            help="Only purge carts, leave expired sessions alone"
+        )
+        super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError("--days must be zero or more")
+        if options['batch_size'] <= 0:
+            raise CommandError("--batch-size must be positive")
+        super().handle(*args, **options)
+
+    def run_once(self, options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+        pause = options['pause']
+
+        carts_deleted, items_deleted = self.purge_carts(cutoff, batch_size, pause)
+        self.stdout.write(
+            f"Deleted {carts_deleted} stale carts and {items_deleted} cart items "
+            f"(untouched since {cutoff:%Y-%m-%d %H:%M})"
+        )
+
+        if not options['skip_sessions']:
+            sessions_deleted = self.purge_sessions(batch_size, pause)
+            if sessions_deleted is None:
+                self.stdout.write("Cleared expired sessions")
+            else:
+                self.stdout.write(f"Deleted {sessions_deleted} expired sessions")
+
+    def purge_carts(self, cutoff, batch_size, pause):
+        """Delete stale carts one bounded batch at a time"""
+        carts_deleted = items_deleted = 0
+
+        while True:
+            with transaction.atomic():
+                # ORM Query: Pick the next batch of stale carts (uses the updated_at index)
+                # Equivalent SQL Query:
+                # SELECT id FROM store_cart WHERE updated_at < %s ORDER BY updated_at LIMIT %s;
+                batch = list(
+                    Cart.objects.filter(updated_at__lt=cutoff)
+                    .order_by('updated_at')
+                    .values_list('id', flat=True)[:batch_size]
+                )
+                if not batch:
+                    break
+
+                # Put back the stock still held by their items
+                inventory.release(CartItem.objects.filter(cart_id__in=batch, cart__updated_at__lt=cutoff))
+
+                # ORM Query: Delete the carts (cascades to their items)
+                # Equivalent SQL Query:
+                # DELETE FROM store_cartitem WHERE cart_id IN (%s, ...);
+                # DELETE FROM store_cart WHERE id IN (%s, ...);
+                # The cutoff is re-checked so a cart touched mid-batch survives
+                _, counts = Cart.objects.filter(id__in=batch, updated_at__lt=cutoff).delete()
+                carts_deleted += counts.get(Cart._meta.label, 0)
+                items_deleted += counts.get(CartItem._meta.label, 0)
+
+            logger.info(f"Purged batch of {len(batch)} stale carts")
+            if pause:
+                time.sleep(pause)
+
+        return carts_deleted, items_deleted
+
+    def purge_sessions(self, batch_size, pause):
+        """
+        Delete expired database sessions in batches.
+        Returns None when the session engine is not database backed and had to
+        clear itself in one go.
+        """
+        engine = import_module(settings.SESSION_ENGINE)
+        store_class = engine.SessionStore
+
+        if not hasattr(store_class, 'get_model_class'):
+            store_class.clear_expired()
+            return None
+
+        session_model = store_class.get_model_class()
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                # ORM Query: Delete the next batch of expired sessions
+                # Equivalent SQL Query:
+                # DELETE FROM django_session WHERE session_key IN
+                # (SELECT session_key FROM django_session WHERE expire_date < NOW() LIMIT %s);
+                batch = list(
+                    session_model.objects.filter(expire_date__lt=timezone.now())
+                    .values_list('session_key', flat=True)[:batch_size]
+                )
+                if not batch:
+                    break
+                deleted += session_model.objects.filter(session_key__in=batch).delete()[0]
+
+            if pause:
+                time.sleep(pause)
+
+        return deleted
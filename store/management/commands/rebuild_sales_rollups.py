@@ -0,0 +1,41 @@
+# store/management/commands/rebuild_sales_rollups.py
+
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from store import reports
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales rollups from the orders (backfill or repair)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=1,
+            help="Rebuild the last N days (default: today)"
+        )
+        parser.add_argument(
+            '--since',
+            help="Rebuild every day from this date (YYYY-MM-DD) to today, overrides --days"
+        )
+
+    def handle(self, *args, **options):
+        end = timezone.localdate()
+        if options['since']:
+            start = parse_date(options['since'])
+            if start is None:
+                raise CommandError("--since must be a YYYY-MM-DD date")
+        else:
+            if options['days'] <= 0:
+                raise CommandError("--days must be positive")
+            start = end - timedelta(days=options['days'] - 1)
+
+        # One transaction per day keeps locks on the orders short
+        total = 0
+        day = start
+        while day <= end:
+            total += reports.rebuild(day, day)
+            day += timedelta(days=1)
+
+        self.stdout.write(f"Rebuilt rollups for {start} to {end} from {total} orders")
@@ -0,0 +1,37 @@
+# store/management/commands/release_reservations.py
+
+import logging
+from django.conf import settings
+from django.core.management.base import CommandError
+from store.management.periodic import PeriodicCommand
+from store import inventory
+
+logger = logging.getLogger(__name__)
+
+
+class Command(PeriodicCommand):
+    help = "Put back the stock held by cart items whose reservation expired"
+    interval_help = "Keep running and release expired reservations every N seconds (0 runs once)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.RESERVATION_RELEASE_BATCH_SIZE,
+            help="Reservations released per transaction"
+        )
+        super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError("--batch-size must be positive")
+        super().handle(*args, **options)
+
+    def run_once(self, options):
+        released = 0
+        while True:
+            count = inventory.release_expired(options['batch_size'])
+            if not count:
+                break
+            released += count
+            logger.info(f"Released batch of {count} expired reservations")
+
+        self.stdout.write(f"Released {released} expired reservations")
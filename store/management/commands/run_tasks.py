@@ -0,0 +1,52 @@
+# store/management/commands/run_tasks.py
+
+import time
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from store import tasks
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks (rating updates, product page rebuilds)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.TASK_BATCH_SIZE,
+            help="Tasks claimed per round"
+        )
+        parser.add_argument(
+            '--interval', type=float, default=settings.TASK_POLL_INTERVAL,
+            help="Seconds to wait before polling again when the queue is empty"
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Run the tasks that are due now and exit"
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError("--batch-size must be positive")
+
+        total_succeeded = total_failed = 0
+        try:
+            while True:
+                # Long running process: drop connections the database closed or that are past CONN_MAX_AGE
+                close_old_connections()
+                succeeded, failed = tasks.run_pending(options['batch_size'])
+                total_succeeded += succeeded
+                total_failed += failed
+
+                if succeeded or failed:
+                    logger.info(f"Ran {succeeded + failed} tasks ({failed} failed)")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(f"Ran {total_succeeded + total_failed} tasks ({total_failed} failed)")
@@ -0,0 +1,35 @@
+# store/management/commands/set_stock.py
+
+from django.core.management.base import BaseCommand, CommandError
+from store.models import Product
+from store import inventory
+
+
+class Command(BaseCommand):
+    help = "Set the stock of a product (and size), optionally split over shard rows for flash sales"
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_id', type=int)
+        parser.add_argument('quantity', type=int, help="Units left to sell, not counting units reserved in carts")
+        parser.add_argument(
+            '--size', default='',
+            help="Size the stock is for (default: products without sizes)"
+        )
+        parser.add_argument(
+            '--shards', type=int, default=1,
+            help="Rows to split the stock over; more rows let more checkouts run at once"
+        )
+
+    def handle(self, *args, **options):
+        if options['quantity'] < 0:
+            raise CommandError("quantity must be zero or more")
+        if options['shards'] <= 0:
+            raise CommandError("--shards must be positive")
+        if not Product.objects.filter(id=options['product_id']).exists():
+            raise CommandError(f"No product with id {options['product_id']}")
+
+        inventory.set_stock(options['product_id'], options['size'], options['quantity'], options['shards'])
+        self.stdout.write(
+            f"Stock of product {options['product_id']} ({options['size'] or '-'}) set to "
+            f"{options['quantity']} in {options['shards']} shards"
+        )
@@ -0,0 +1,37 @@
+# store/management/commands/update_copurchases.py
+
+import time
+from django.core.management.base import CommandError
+from store.management.periodic import PeriodicCommand
+from store import copurchases
+
+
+class Command(PeriodicCommand):
+    help = "Add orders placed since the last run to the \"Customers also bought\" counts"
+    interval_help = "Keep running and add new orders every N seconds (0 runs once)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help="Orders read and added per transaction (bounds memory use)"
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help="Drop the counts and start over from the first order"
+        )
+        super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0:
+            raise CommandError("--chunk-size must be positive")
+
+        if options['rebuild']:
+            copurchases.reset()
+            self.stdout.write("Dropped the co-purchase counts")
+
+        super().handle(*args, **options)
+
+    def run_once(self, options):
+        started = time.perf_counter()
+        added = copurchases.update(options['chunk_size'])
+        self.stdout.write(f"Added {added} orders in {time.perf_counter() - started:.1f}s")
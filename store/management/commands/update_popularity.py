@@ -0,0 +1,15 @@
+# store/management/commands/update_popularity.py
+
+import time
+from store.management.periodic import PeriodicCommand
+from store import popularity
+
+
+class Command(PeriodicCommand):
+    help = "Set the \"Most Popular\" sort from the page views of the last POPULARITY_DAYS and drop older views"
+    interval_help = "Keep running and update every N seconds (0 runs once)"
+
+    def run_once(self, options):
+        started = time.perf_counter()
+        changed = popularity.update_popularity()
+        self.stdout.write(f"Updated {changed} products in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,67 @@
+# store/management/commands/warm_enrichment.py
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from store.management.periodic import PeriodicCommand
+from store import enrichment
+from store.models import Product, EnrichmentData
+
+
+class Command(PeriodicCommand):
+    help = "Fetch Pokemon and weather data for every product ahead of the first page view"
+    interval_help = "Keep running and warm again every N seconds, e.g. to refresh the weather (0 runs once)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.ENRICHMENT_CONCURRENCY,
+            help="Requests in flight at once"
+        )
+        parser.add_argument(
+            '--source', choices=[source for source, _ in EnrichmentData.SOURCES],
+            help="Only warm one source"
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Refetch entries that are still fresh"
+        )
+        super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options['concurrency'] <= 0:
+            raise CommandError("--concurrency must be positive")
+        super().handle(*args, **options)
+
+    def run_once(self, options):
+        sources = [options['source']] if options['source'] else [source for source, _ in EnrichmentData.SOURCES]
+
+        jobs = []
+        for source in sources:
+            keys = self.distinct_keys(source)
+            if not options['force']:
+                keys -= self.fresh_keys(source)
+            jobs.extend((source, key) for key in sorted(keys))
+
+        fetched, not_found, failed = enrichment.warm(jobs, options['concurrency'])
+        self.stdout.write(f"Fetched {fetched} entries ({not_found} not found, {failed} failed)")
+
+    def distinct_keys(self, source):
+        """Normalized Pokemon names or cities used by products"""
+        column = 'pokemon' if source == EnrichmentData.POKEMON else 'location'
+
+        # ORM Query: Distinct non-empty values of the column
+        # Equivalent SQL Query:
+        # SELECT DISTINCT pokemon FROM store_product WHERE pokemon IS NOT NULL AND pokemon != '';
+        values = (
+            Product.objects.exclude(**{f'{column}__isnull': True}).exclude(**{column: ''})
+            .values_list(column, flat=True).distinct()
+        )
+        return {enrichment.normalize_key(value) for value in values if value.strip()}
+
+    def fresh_keys(self, source):
+        # ORM Query: Stored entries of the source
+        # Equivalent SQL Query:
+        # SELECT key, fetched_at, data FROM store_enrichmentdata WHERE source = %s;
+        return {
+            key for key, fetched_at, data in EnrichmentData.objects.filter(source=source).values_list('key', 'fetched_at', 'data')
+            if enrichment.is_fresh(source, fetched_at, data)
+        }
@@ -0,0 +1,36 @@
+# store/management/periodic.py
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+
+class PeriodicCommand(BaseCommand):
+    """
+    A maintenance command that runs once, or with --interval N keeps running and
+    runs again every N seconds until it is stopped (Ctrl+C). Subclasses implement
+    run_once(options).
+    """
+
+    interval_help = "Keep running and repeat every N seconds (0 runs once)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0, help=self.interval_help)
+
+    def handle(self, *args, **options):
+        if options['interval'] < 0:
+            raise CommandError("--interval can't be negative")
+
+        try:
+            while True:
+                self.run_once(options)
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+                # Like at the start of a request: drop connections that broke or expired meanwhile
+                close_old_connections()
+        except KeyboardInterrupt:
+            pass
+
+    def run_once(self, options):
+        raise NotImplementedError
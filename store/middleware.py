@@ -0,0 +1,224 @@
+# store/middleware.py
+
+import math
+import time
+import logging
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from whitenoise.middleware import WhiteNoiseMiddleware
+from . import ratelimit, routers
+
+logger = logging.getLogger(__name__)
+
+# Cookie marking a session that recently wrote catalog data
+REPLICA_PIN_COOKIE = 'db_pin'
+
+
+class SyncAndAsyncMiddleware:
+    """
+    Base of the middleware below. Each one runs in the mode of the chain around it:
+    under ASGI it is a coroutine function, so a request gets to the async views without
+    a thread waiting for it. A sync-only middleware makes Django run everything after it
+    through async_to_sync, which parks a thread for the whole request.
+
+    Subclasses implement __acall__ next to __call__, and aprocess_view next to
+    process_view if they have one (Django would run a sync process_view in a thread).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            if hasattr(self, 'aprocess_view'):
+                self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoiseMiddleware (collected static files with far-future cache headers) that
+    also works in an async chain: finding the file is a dict lookup and serving it
+    opens the file, so nothing here needs a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class ReplicaPinMiddleware(SyncAndAsyncMiddleware):
+    """
+    Read-your-writes for the read replicas (see routers.PrimaryReplicaRouter):
+    after a request writes catalog data (a review, a product), the session's
+    requests read from the primary for REPLICA_PIN_SECONDS, until the replicas
+    have caught up.
+    """
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = routers.start_request(self.pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.end_request(token)
+        return self.pin(response, wrote)
+
+    async def __acall__(self, request):
+        # Set in the request's own context, the ORM calls the async views make in
+        # threads (sync_to_async) run in a copy of it and share the state
+        token = routers.start_request(self.pinned(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            wrote = routers.end_request(token)
+        return self.pin(response, wrote)
+
+    def pinned(self, request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS') or REPLICA_PIN_COOKIE in request.COOKIES
+
+    def pin(self, response, wrote):
+        if wrote:
+            response.set_cookie(
+                REPLICA_PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax'
+            )
+        return response
+
+
+def _reject(request, status, error, retry_after):
+    """Error response for a request that wasn't served, JSON for the API"""
+    if request.path.startswith('/api/'):
+        response = JsonResponse({'success': False, 'error': error}, status=status)
+    else:
+        response = HttpResponse(error, status=status, content_type='text/plain')
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def client_ip(request):
+    """
+    Address of the client. Behind RATE_LIMIT_PROXIES reverse proxies it is the
+    address the outermost proxy appended to X-Forwarded-For, the client can't fake it.
+    """
+    if settings.RATE_LIMIT_PROXIES:
+        forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        if len(forwarded) >= settings.RATE_LIMIT_PROXIES:
+            return forwarded[-settings.RATE_LIMIT_PROXIES]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+class RateLimitMiddleware(SyncAndAsyncMiddleware):
+    """
+    Token bucket rate limits for the views in RATE_LIMITS, per client IP and view.
+    Over the limit the client gets 429 with Retry-After. Clients are told apart by
+    IP because a scraper can send a new (or no) session cookie with every request.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.buckets = ratelimit.get_buckets()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        limit = settings.RATE_LIMITS.get(request.resolver_match.url_name)
+        if limit is None:
+            return None
+        return self.limited(request, self.buckets.take(self.key(request), *limit))
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        limit = settings.RATE_LIMITS.get(request.resolver_match.url_name)
+        if limit is None:
+            return None
+        return self.limited(request, await self.buckets.atake(self.key(request), *limit))
+
+    def key(self, request):
+        return f'{request.resolver_match.url_name}:{client_ip(request)}'
+
+    def limited(self, request, wait):
+        """429 response if the bucket had no token left, else None"""
+        if not wait:
+            return None
+        logger.info(f"Rate limited {client_ip(request)} on {request.resolver_match.url_name}")
+        return _reject(request, 429, 'Too many requests, slow down', wait)
+
+
+# Load of this process, shared by its threads
+load = ratelimit.LoadMonitor()
+
+
+class LoadSheddingMiddleware(SyncAndAsyncMiddleware):
+    """
+    Turn away requests to the views in LOAD_SHED_ROUTES (search, catalog reads, reviews)
+    with 503 and Retry-After while this process is overloaded: more than
+    LOAD_SHED_MAX_IN_FLIGHT requests in progress, or a recent response time over
+    LOAD_SHED_LATENCY_MS. What is left of the database goes to carts and checkout.
+    """
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        load.start()
+        started = time.monotonic()
+        try:
+            return self.get_response(request)
+        finally:
+            self.finish(request, started)
+
+    async def __acall__(self, request):
+        # Under ASGI the requests in progress are the ones awaiting here, not threads
+        load.start()
+        started = time.monotonic()
+        try:
+            return await self.get_response(request)
+        finally:
+            self.finish(request, started)
+
+    def finish(self, request, started):
+        # Turned away requests took no time, they would hide the slowdown
+        load.finish(None if getattr(request, 'load_shed', False) else time.monotonic() - started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        return self.shed(request)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        # Only memory is read, no need for a thread
+        return self.shed(request)
+
+    def shed(self, request):
+        """503 response if the request is turned away, else None"""
+        if request.resolver_match.url_name not in settings.LOAD_SHED_ROUTES:
+            return None
+
+        reason = load.overloaded()
+        if reason is None:
+            return None
+
+        request.load_shed = True
+        logger.warning(f"Shedding {request.path}: {reason}")
+        return _reject(request, 503, 'Server busy, please try again shortly', settings.LOAD_SHED_RETRY_AFTER)
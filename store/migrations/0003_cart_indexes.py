@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-19 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_cart_category_order_product_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='session_id',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
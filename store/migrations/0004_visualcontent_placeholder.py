@@ -0,0 +1,28 @@
+# Generated by Django 4.2.20 on 2026-10-19 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_cart_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visualcontent',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='visualcontent',
+            name='placeholder',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='visualcontent',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
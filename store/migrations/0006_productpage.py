@@ -0,0 +1,22 @@
+# Generated by Django 4.2.20 on 2026-10-19 17:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_product_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPage',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='page', serialize=False, to='store.product')),
+                ('document', models.JSONField()),
+                ('built_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.20 on 2026-10-19 17:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrichmentData',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('pokemon', 'Pokemon'), ('weather', 'Weather')], max_length=20)),
+                ('key', models.CharField(max_length=100)),
+                ('data', models.JSONField()),
+                ('fetched_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='enrichmentdata',
+            constraint=models.UniqueConstraint(fields=('source', 'key'), name='enrichment_source_key'),
+        ),
+    ]
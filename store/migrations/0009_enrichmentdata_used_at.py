@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-19 17:44
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_enrichmentdata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enrichmentdata',
+            name='used_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='enrichmentdata',
+            index=models.Index(fields=['used_at'], name='enrichment_used_at_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-19 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_enrichmentdata_used_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productpage',
+            name='build_seconds',
+            field=models.FloatField(default=0),
+        ),
+    ]
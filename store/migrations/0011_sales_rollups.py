@@ -0,0 +1,49 @@
+# Generated by Django 4.2.20 on 2026-10-19 17:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_productpage_build_seconds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='in_rollups',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('product_name', models.CharField(max_length=255)),
+                ('category_name', models.CharField(max_length=100)),
+                ('size', models.CharField(blank=True, default='', max_length=10)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'category_name'], name='daily_sales_category_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyproductsales',
+            constraint=models.UniqueConstraint(fields=('date', 'product', 'size'), name='daily_product_sales_key'),
+        ),
+    ]
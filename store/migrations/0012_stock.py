@@ -0,0 +1,46 @@
+# Generated by Django 4.2.20 on 2026-10-19 17:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(blank=True, default='', max_length=10)),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('quantity', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['reserved_until'], name='cartitem_reserved_until_idx'),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock', to='store.product'),
+        ),
+        migrations.AddConstraint(
+            model_name='stock',
+            constraint=models.UniqueConstraint(fields=('product', 'size', 'shard'), name='stock_product_size_shard'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.20 on 2026-10-19 18:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_products', to='store.product')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='similarproduct',
+            constraint=models.UniqueConstraint(fields=('product', 'rank'), name='similar_product_rank'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.20 on 2026-10-19 18:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_similarproduct'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CoPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='copurchases', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-orders'], name='copurchase_top_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='copurchase',
+            constraint=models.UniqueConstraint(fields=('product', 'other'), name='copurchase_product_other'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.20 on 2026-10-19 18:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_copurchase_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='review_summary', serialize=False, to='store.product')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('average', models.FloatField(default=0)),
+                ('stars', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', '-created_at', '-id'], name='review_product_latest_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.20 on 2026-10-19 18:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_review_pagination'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='store.product')),
+                ('likes', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductLike',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='likes', to='store.product')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='productlike',
+            constraint=models.UniqueConstraint(fields=('product', 'session_id'), name='product_like_session'),
+        ),
+    ]
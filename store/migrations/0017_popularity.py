@@ -0,0 +1,51 @@
+# Generated by Django 4.2.20 on 2026-10-19 18:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_likes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductViews',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Product views',
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='popularity',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['popularity', 'id'], name='product_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'popularity', 'id'], name='product_cat_popularity_idx'),
+        ),
+        migrations.AddField(
+            model_name='productviews',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_counts', to='store.product'),
+        ),
+        migrations.AddIndex(
+            model_name='productviews',
+            index=models.Index(fields=['hour'], name='product_views_recent_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productviews',
+            constraint=models.UniqueConstraint(fields=('product', 'hour'), name='product_views_hour'),
+        ),
+    ]
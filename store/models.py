@@ -1,7 +1,10 @@
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models import Q
+from django.db.models import Q, Count, Avg
 from django.conf import settings
+from django.utils import timezone
+from django.utils.html import escape
+from . import images
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -16,6 +19,24 @@ class Product(models.Model):
     """
     Product model for storing product information
     """
+    # Sort modes for product listings -> ORDER BY columns.
+    # id breaks ties so pages are stable, and each ordering is backed by the indexes in Meta
+    SORT_ORDERINGS = {
+        'price-asc': ('price', 'id'),
+        'price-desc': ('-price', '-id'),
+        'rating-asc': ('rating', 'id'),
+        'rating-desc': ('-rating', '-id'),
+        'name-asc': ('name', 'id'),
+        'name-desc': ('-name', '-id'),
+        'newest': ('-created_at', '-id'),
+        'popular': ('-popularity', '-id'),
+    }
+    
+    # Price histogram bucket edges for search facets, the last bucket is open-ended
+    FACET_PRICE_EDGES = (0, 10, 25, 50, 100)
+    # "N stars & up" rating facets, matching the min_rating filter
+    FACET_MIN_RATINGS = (4, 3, 2, 1)
+    
     name = models.CharField(max_length=255)
     description = models.TextField()
     feature = models.TextField(blank=True, null=True)
@@ -27,9 +48,27 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     pokemon = models.CharField(max_length=100, blank=True, null=True)
     location = models.CharField(max_length=100, blank=True, null=True)
+    # Page views in the last POPULARITY_DAYS, set by `update_popularity` (store/popularity.py)
+    popularity = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Whole catalog listings
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['rating', 'id'], name='product_rating_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_idx'),
+            models.Index(fields=['created_at', 'id'], name='product_created_idx'),
+            models.Index(fields=['popularity', 'id'], name='product_popularity_idx'),
+            # Category listings
+            models.Index(fields=['category', 'price', 'id'], name='product_cat_price_idx'),
+            models.Index(fields=['category', 'rating', 'id'], name='product_cat_rating_idx'),
+            models.Index(fields=['category', 'name', 'id'], name='product_cat_name_idx'),
+            models.Index(fields=['category', 'created_at', 'id'], name='product_cat_created_idx'),
+            models.Index(fields=['category', 'popularity', 'id'], name='product_cat_popularity_idx'),
+        ]
+    
     def __str__(self):
         return self.name
         
@@ -48,11 +87,16 @@ class Product(models.Model):
             'image': self.get_primary_image_name()
         }
         
+    def get_primary_visual(self):
+        """Get the primary visual for this product (uses prefetched visuals when available)"""
+        visuals = sorted(self.visuals.all(), key=lambda v: v.id)
+        return visuals[0] if visuals else None
+    
     def get_primary_image_name(self):
         """Get the primary image filename for this product"""
-        visual = self.visuals.first()
+        visual = self.get_primary_visual()
         if visual:
-            return f"{visual.short_name}.{visual.file_type}"
+            return visual.get_filename()
         return "default.jpg"
     
     def get_features_list(self):
@@ -61,12 +105,31 @@ class Product(models.Model):
             return []
         return [f.strip() for f in self.feature.split(',')]
     
+    def update_rating(self):
+        """Set the rating to the average of the product's reviews (0 without reviews)"""
+        # ORM Query: Calculate average rating
+        # Equivalent SQL Query:
+        # SELECT AVG(rating) FROM store_review WHERE product_id=%s
+        avg_rating = self.reviews.aggregate(Avg('rating'))['rating__avg']
+        self.rating = avg_rating or 0
+        self.save(update_fields=['rating', 'updated_at'])
+    
     @classmethod
-    def search(cls, query=None, category=None, min_price=None, max_price=None, min_rating=None):
+    def sort_products(cls, products, sort=None):
         """
-        Search products with filters
+        Order a product queryset by one of SORT_ORDERINGS.
+        Unknown or missing sort modes fall back to id order so pagination stays stable.
         """
-        products = cls.objects.all()
+        return products.order_by(*cls.SORT_ORDERINGS.get(sort, ('id',)))
+    
+    @classmethod
+    def search(cls, query=None, category=None, min_price=None, max_price=None, min_rating=None, sort=None,
+               queryset=None):
+        """
+        Search products with filters, ordered by the given sort mode
+        (queryset: the products to search, default all)
+        """
+        products = queryset if queryset is not None else cls.objects.all()
         
         # Filter by query (search in name and description)
         if query:
@@ -88,7 +151,64 @@ class Product(models.Model):
         if min_rating is not None:
             products = products.filter(rating__gte=min_rating)
         
-        return products
+        return cls.sort_products(products, sort)
+        
+    @classmethod
+    def search_facets(cls, query=None, category=None, min_price=None, max_price=None, min_rating=None):
+        """
+        Count the products of a search per category, price bucket and rating bucket
+        in a single aggregate query. Each facet applies every filter except its own,
+        so the other options of that facet still show how many products they would give.
+        """
+        products = cls.objects.all()
+        if query:
+            products = products.filter(
+                Q(name__icontains=query) | 
+                Q(description__icontains=query)
+            )
+        
+        category_q = Q(category__name=category) if category else Q()
+        price_q = Q()
+        if min_price is not None:
+            price_q &= Q(price__gte=min_price)
+        if max_price is not None:
+            price_q &= Q(price__lte=max_price)
+        rating_q = Q(rating__gte=min_rating) if min_rating is not None else Q()
+        
+        categories = list(Category.objects.order_by('name').values_list('id', 'name'))
+        price_buckets = list(zip(cls.FACET_PRICE_EDGES, cls.FACET_PRICE_EDGES[1:] + (None,)))
+        
+        # ORM Query: One conditional COUNT per facet bucket
+        # Equivalent SQL Query:
+        # SELECT COUNT(id) FILTER (WHERE category_id = %s AND price >= %s ...) AS category_1,
+        #        COUNT(id) FILTER (WHERE price >= 0 AND price < 10 AND ...) AS price_0, ...
+        #        COUNT(id) FILTER (WHERE rating >= 4 AND ...) AS rating_4, ...
+        # FROM store_product WHERE name ILIKE %s OR description ILIKE %s;
+        aggregates = {}
+        for category_id, _ in categories:
+            aggregates[f'category_{category_id}'] = Count('id', filter=Q(category_id=category_id) & price_q & rating_q)
+        for i, (low, high) in enumerate(price_buckets):
+            bucket_q = Q(price__gte=low) if high is None else Q(price__gte=low, price__lt=high)
+            aggregates[f'price_{i}'] = Count('id', filter=bucket_q & category_q & rating_q)
+        for stars in cls.FACET_MIN_RATINGS:
+            aggregates[f'rating_{stars}'] = Count('id', filter=Q(rating__gte=stars) & category_q & price_q)
+        
+        counts = products.aggregate(**aggregates)
+        
+        return {
+            'categories': [
+                {'name': name, 'count': counts[f'category_{category_id}']}
+                for category_id, name in categories
+            ],
+            'price': [
+                {'min': low, 'max': high, 'count': counts[f'price_{i}']}
+                for i, (low, high) in enumerate(price_buckets)
+            ],
+            'rating': [
+                {'min': stars, 'count': counts[f'rating_{stars}']}
+                for stars in cls.FACET_MIN_RATINGS
+            ],
+        }
         
     @classmethod
     def suggest_similar(cls, query):
@@ -138,14 +258,54 @@ class VisualContent(models.Model):
     file_type = models.CharField(max_length=10)
     css_class = models.CharField(max_length=50, default='product-image')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='visuals')
+    # Filled in by `manage.py build_images`
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    placeholder = models.TextField(blank=True, default='')  # Tiny base64 data URI
     
     def __str__(self):
         return f"{self.name} ({self.product.name})"
         
-    def get_html(self, css_override=None):
-        """Return an HTML <img> tag for the visual content"""
-        css_class = css_override if css_override else self.css_class
-        return f'<img class="{css_class}" alt="{self.description}" src="/static/images/{self.short_name}.{self.file_type}">'
+    def get_filename(self):
+        """Get the original image filename in static/images"""
+        return f"{self.short_name}.{self.file_type}"
+    
+    def get_url(self):
+        """Get the URL of the original image"""
+        return f"/static/images/{self.get_filename()}"
+        
+    def get_html(self, css_override=None, alt=None, sizes=images.CARD_SIZES, lazy=True):
+        """
+        Return the HTML for the visual content: a <picture> with AVIF/WebP/JPEG
+        srcsets when resized derivatives exist, otherwise a plain <img> tag.
+        An empty css_override renders the image without a class. Pass lazy=False
+        for images visible above the fold.
+        """
+        css_class = self.css_class if css_override is None else css_override
+        alt_text = escape(self.description if alt is None else alt)
+        srcsets = images.get_srcsets(self.get_filename())
+        
+        attrs = f' class="{css_class}"' if css_class else ''
+        attrs += f' alt="{alt_text}" src="{self.get_url()}"'
+        # Known dimensions let the browser reserve space before the image arrives
+        if self.width and self.height:
+            attrs += f' width="{self.width}" height="{self.height}"'
+        attrs += ' loading="lazy" decoding="async"' if lazy else ' fetchpriority="high"'
+        # Blurry inline preview, covered by the real image once it has loaded
+        if self.placeholder:
+            attrs += f' style="background: url({self.placeholder}) center / cover no-repeat"'
+        
+        if not srcsets:
+            return f'<img{attrs}>'
+        
+        # Browsers pick the first <source> type they support, so list the smallest formats first
+        sources = ''.join(
+            f'<source type="{images.FORMATS[fmt][1]}" srcset="{srcsets[fmt]}" sizes="{sizes}">'
+            for fmt in images.FORMATS if fmt in srcsets and fmt != 'jpg'
+        )
+        if 'jpg' in srcsets:
+            attrs += f' srcset="{srcsets["jpg"]}" sizes="{sizes}"'
+        return f'<picture>{sources}<img{attrs}></picture>'
     
     def to_json(self):
         """Convert visual content to JSON serializable dictionary"""
@@ -157,7 +317,11 @@ class VisualContent(models.Model):
             'file_type': self.file_type,
             'css_class': self.css_class,
             'product_id': self.product.id,
-            'img_url': f"/static/images/{self.short_name}.{self.file_type}"
+            'img_url': self.get_url(),
+            'srcset': images.get_srcsets(self.get_filename()),
+            'width': self.width,
+            'height': self.height,
+            'placeholder': self.placeholder
         }
 
 class Review(models.Model):
@@ -170,6 +334,12 @@ class Review(models.Model):
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Newest reviews of a product, paged by (created_at, id), see store/reviews.py
+            models.Index(fields=['product', '-created_at', '-id'], name='review_product_latest_idx'),
+        ]
+    
     def __str__(self):
         return f"Review for {self.product.name} by {self.username}"
     
@@ -185,18 +355,135 @@ class Review(models.Model):
             'product_rating': self.product.rating
     }
 
+class ReviewSummary(models.Model):
+    """
+    Review count, average and star histogram of a product, recomputed after its
+    reviews change (store/reviews.py) so listing reviews doesn't aggregate them
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='review_summary')
+    count = models.PositiveIntegerField(default=0)
+    average = models.FloatField(default=0)
+    stars = models.JSONField(default=list)  # Number of 1 to 5 star reviews
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Reviews of product {self.product_id}: {self.count}"
+    
+    def to_json(self):
+        return {
+            'count': self.count,
+            'average': round(self.average, 2),
+            'stars': {str(star): count for star, count in enumerate(self.stars, 1)},
+        }
+
+class ProductLike(models.Model):
+    """A visitor (session) liking a product, written in batches by store/likes.py"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='likes')
+    session_id = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'session_id'], name='product_like_session'),
+        ]
+    
+    def __str__(self):
+        return f"{self.session_id} likes {self.product_id}"
+
+class ProductStats(models.Model):
+    """
+    Counters of a product, updated in batches along with the rows they count
+    (store/likes.py) so they are read without counting rows
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    likes = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Stats of product {self.product_id}"
+
+class ProductViews(models.Model):
+    """Page views of a product during one hour, added to by the view counters (store/popularity.py)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='view_counts')
+    hour = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name_plural = "Product views"
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'hour'], name='product_views_hour'),
+        ]
+        indexes = [
+            # Totals of the last hours or days
+            models.Index(fields=['hour'], name='product_views_recent_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.views} views of product {self.product_id} at {self.hour}"
+
+class ProductPage(models.Model):
+    """
+    Precomputed product page: everything the product page shows (product, visuals,
+    latest reviews, recommendations, Pokemon data) in one JSON document, so a page
+    view is a single primary key read. Built by store/product_pages.py.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='page')
+    document = models.JSONField()
+    built_at = models.DateTimeField(auto_now=True)
+    build_seconds = models.FloatField(default=0)  # How long the last build took
+
+    def __str__(self):
+        return f"Page for product {self.product_id}"
+
+class EnrichmentData(models.Model):
+    """
+    Stored third-party API response (PokeAPI, OpenWeather) for a Pokemon name or city,
+    filled by `python manage.py warm_enrichment` and on demand by store/enrichment.py
+    """
+    POKEMON = 'pokemon'
+    WEATHER = 'weather'
+    SOURCES = (
+        (POKEMON, 'Pokemon'),
+        (WEATHER, 'Weather')
+    )
+    
+    source = models.CharField(max_length=20, choices=SOURCES)
+    key = models.CharField(max_length=100)  # Lowercase Pokemon name or city
+    data = models.JSONField()
+    fetched_at = models.DateTimeField()
+    # Last read, coarse (see ENRICHMENT_TOUCH_INTERVAL); the least recently used rows are evicted first
+    used_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'key'], name='enrichment_source_key'),
+        ]
+        indexes = [
+            models.Index(fields=['used_at'], name='enrichment_used_at_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.source}: {self.key}"
+
 class Cart(models.Model):
     """
     Cart model for storing user shopping carts
     """
     # Will be linked to User model in future
-    session_id = models.CharField(max_length=255)
+    session_id = models.CharField(max_length=255, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     def __str__(self):
         return f"Cart {self.id} - {self.session_id}"
     
+    def touch(self):
+        """Mark the cart as recently used so the stale cart purge skips it"""
+        self.save(update_fields=['updated_at'])
+    
+    async def atouch(self):
+        """Async version of touch()"""
+        await self.asave(update_fields=['updated_at'])
+    
     @property
     def total_price(self):
         """Calculate total price of items in cart"""
@@ -210,8 +497,16 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     size = models.CharField(max_length=10, blank=True, null=True)  # For apparel
+    # Units taken from the product's Stock for this cart until reserved_until (see store/inventory.py)
+    reserved_quantity = models.PositiveIntegerField(default=0)
+    reserved_until = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['reserved_until'], name='cartitem_reserved_until_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.quantity}x {self.product.name} in Cart {self.cart.id}"
     
@@ -220,6 +515,43 @@ class CartItem(models.Model):
         """Calculate subtotal for this cart item"""
         return self.product.price * self.quantity
 
+class Stock(models.Model):
+    """
+    Units of a product and size left to sell. Products without Stock rows aren't tracked.
+    A hot product can be split into several shard rows whose quantities add up to its
+    stock, so concurrent checkouts update different rows (see store/inventory.py).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock')
+    size = models.CharField(max_length=10, blank=True, default='')  # '' for products without sizes
+    shard = models.PositiveSmallIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'size', 'shard'], name='stock_product_size_shard'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} ({self.size or '-'}) #{self.shard}: {self.quantity}"
+
+class SimilarProduct(models.Model):
+    """
+    A product's nearest neighbours by text (name, description, features), best first.
+    Computed offline by `python manage.py compute_recommendations` (store/recommendations.py).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similar_products')
+    similar = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()  # 0 is the most similar
+    score = models.FloatField()  # Cosine similarity
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='similar_product_rank'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} -> {self.similar_id} ({self.score:.2f})"
+
 class Order(models.Model):
     """
     Order model for completed purchases
@@ -241,6 +573,8 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=ORDER_STATUS, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set once the order is counted in the daily sales rollups (store/reports.py)
+    in_rollups = models.BooleanField(default=False)
     
     def __str__(self):
         return f"Order {self.id} - {self.full_name}"
@@ -262,4 +596,111 @@ class OrderItem(models.Model):
     @property
     def subtotal(self):
         """Calculate subtotal for this order item"""
-        return self.price * self.quantity
\ No newline at end of file
+        return self.price * self.quantity
+
+class CoPurchase(models.Model):
+    """
+    Number of orders that contained both products: one cell of the item x item
+    co-purchase matrix, stored in both directions. Added to incrementally by
+    `python manage.py update_copurchases` (store/copurchases.py).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='copurchases')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    orders = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='copurchase_product_other'),
+        ]
+        indexes = [
+            # Most bought together first
+            models.Index(fields=['product', '-orders'], name='copurchase_top_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} + {self.other_id}: {self.orders} orders"
+
+class Watermark(models.Model):
+    """
+    How far an incremental job got through an append-only table (e.g. the last order id it
+    processed), or a counter of changes other processes poll (catalog_version, store/catalog.py)
+    """
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name}: {self.position}"
+
+class DailySales(models.Model):
+    """
+    Sales totals of one day, maintained by store/reports.py so reports read
+    one row per day instead of scanning every order line
+    """
+    date = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    def __str__(self):
+        return f"Sales {self.date}: {self.revenue}"
+
+class DailyProductSales(models.Model):
+    """
+    Units and revenue of one product and size on one day.
+    Product and category names are copied so the rollup survives product changes.
+    """
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True)
+    product_name = models.CharField(max_length=255)
+    category_name = models.CharField(max_length=100)
+    size = models.CharField(max_length=10, blank=True, default='')  # '' for items without a size
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product', 'size'], name='daily_product_sales_key'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'category_name'], name='daily_sales_category_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_name} ({self.size or '-'}) {self.date}: {self.units}"
+
+class Task(models.Model):
+    """
+    Background task queued by store/tasks.py and run by `python manage.py run_tasks`.
+    Finished tasks are deleted, failed ones are kept with their last error.
+    """
+    TASK_STATUS = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('failed', 'Failed')
+    )
+    
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=list)
+    # Only one queued task per key, so repeated writes don't queue the same work twice
+    dedup_key = models.CharField(max_length=255, blank=True, null=True)
+    status = models.CharField(max_length=10, choices=TASK_STATUS, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'], condition=Q(status='queued'), name='task_queued_dedup_key'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.name}{tuple(self.args)} ({self.status})"
\ No newline at end of file
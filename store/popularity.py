@@ -0,0 +1,182 @@
+# store/popularity.py
+#
+# Product page views without a write per view: each process counts views per product in
+# memory and a background thread adds the counts to hourly totals (ProductViews) every
+# VIEWS_FLUSH_INTERVAL seconds, a few statements for all the views in between. The counter
+# holds one entry per product viewed since the last flush and is flushed early at
+# VIEWS_BUFFER_MAX entries, so its memory depends on the catalog, not on the traffic.
+#
+# From the hourly totals, `update_popularity` sets Product.popularity (views in the last
+# POPULARITY_DAYS, the "popular" sort) and drops older hours, and trending() ranks the
+# products of the last TRENDING_HOURS.
+#
+# Views are approximate: views still in memory are lost if the process dies, and a flush
+# that fails is dropped rather than kept, so a database outage can't grow the counter.
+
+import atexit
+import time
+import logging
+import threading
+from collections import Counter, defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .bulk import Flusher, add_counts
+from .catalog import catalog
+from .models import Product, ProductViews
+from .stampede import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Products per UPDATE statement
+UPDATE_BATCH = 1000
+
+
+def current_hour():
+    return timezone.now().replace(minute=0, second=0, microsecond=0)
+
+
+def add_views(counts, hour=None):
+    """Add {product_id: views} to the totals of an hour (the current one by default)"""
+    hour = hour or current_hour()
+    # Products deleted meanwhile would fail the foreign keys
+    existing = set(Product.objects.filter(id__in=list(counts)).values_list('id', flat=True))
+    # In id order, so concurrent flushes of other processes lock the rows in the same order
+    rows = [(product_id, hour, views) for product_id, views in sorted(counts.items()) if product_id in existing]
+
+    # ON CONFLICT (product_id, hour) DO UPDATE SET views = views + EXCLUDED.views
+    with transaction.atomic():
+        add_counts(ProductViews, ['product', 'hour'], 'views', rows)
+    return len(rows)
+
+
+class ViewCounter:
+    """Page views per product not written yet, with the thread that writes them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()  # product_id -> views
+        self._flusher = Flusher(self.flush, lambda: settings.VIEWS_FLUSH_INTERVAL, 'view-flusher')
+
+    def add(self, product_id):
+        """Count a view of a product's page"""
+        if not settings.VIEWS_FLUSH_INTERVAL:
+            add_views({product_id: 1})
+            return
+        with self._lock:
+            self._counts[product_id] += 1
+            full = len(self._counts) >= settings.VIEWS_BUFFER_MAX
+        self._flusher.start()
+        if full:
+            self._flusher.wake()
+
+    def __len__(self):
+        return len(self._counts)
+
+    def flush(self):
+        """Write the counted views; returns how many products got views"""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        if not counts:
+            return 0
+        try:
+            products = add_views(counts)
+        except Exception as e:
+            logger.error(f"Failed to write {sum(counts.values())} views of {len(counts)} products, dropped: {e}")
+            return 0
+        logger.info(f"Flushed {sum(counts.values())} views of {products} products")
+        return products
+
+
+counter = ViewCounter()
+
+# Write what is left when the process exits normally
+atexit.register(counter.flush)
+
+
+def update_popularity():
+    """
+    Set Product.popularity to the views of the last POPULARITY_DAYS and delete the hourly
+    totals before them; returns how many products changed
+    """
+    since = current_hour() - timedelta(days=settings.POPULARITY_DAYS)
+
+    # ORM Query: Drop the hours out of the window
+    # Equivalent SQL Query:
+    # DELETE FROM store_productviews WHERE hour < %s;
+    ProductViews.objects.filter(hour__lt=since).delete()
+
+    # ORM Query: Views per product in the window, and the popularity stored now
+    # Equivalent SQL Query:
+    # SELECT product_id, SUM(views) FROM store_productviews WHERE hour >= %s GROUP BY product_id;
+    # SELECT id, popularity FROM store_product WHERE popularity > 0;
+    totals = dict(
+        ProductViews.objects.filter(hour__gte=since).values('product_id')
+        .annotate(total=Sum('views')).values_list('product_id', 'total')
+    )
+    current = dict(Product.objects.filter(popularity__gt=0).values_list('id', 'popularity'))
+
+    by_views = defaultdict(list)
+    for product_id in totals.keys() | current.keys():
+        views = totals.get(product_id, 0)
+        if views != current.get(product_id, 0):
+            by_views[views].append(product_id)
+
+    changed = 0
+    for views, product_ids in by_views.items():
+        product_ids.sort()
+        for start in range(0, len(product_ids), UPDATE_BATCH):
+            # ORM Query: Products whose popularity becomes the same value at once
+            # Equivalent SQL Query:
+            # UPDATE store_product SET popularity = %s WHERE id IN (...);
+            changed += Product.objects.filter(id__in=product_ids[start:start + UPDATE_BATCH]).update(popularity=views)
+    if changed:
+        # update() sends no signals, and this usually runs in its own process (the command)
+        catalog.publish_change()
+    logger.info(f"Updated the popularity of {changed} products")
+    return changed
+
+
+class Trending:
+    """
+    The MAX_TRENDING most viewed products of the last TRENDING_HOURS, ranked again at most
+    every TRENDING_TTL seconds per process (once for all the requests waiting for it)
+    """
+
+    def __init__(self):
+        self._ranked = []  # (product_id, views), most views first
+        self._ranked_at = None
+        self._ranking = SingleFlight()
+
+    def _rank(self):
+        since = current_hour() - timedelta(hours=settings.TRENDING_HOURS - 1)
+        # ORM Query: Views per product in the last hours, most first
+        # Equivalent SQL Query:
+        # SELECT product_id, SUM(views) AS total FROM store_productviews WHERE hour >= %s
+        # GROUP BY product_id ORDER BY total DESC, product_id LIMIT %s;
+        self._ranked = list(
+            ProductViews.objects.filter(hour__gte=since).values('product_id')
+            .annotate(total=Sum('views')).order_by('-total', 'product_id')
+            .values_list('product_id', 'total')[:settings.MAX_TRENDING]
+        )
+        self._ranked_at = time.monotonic()
+
+    def products(self, limit):
+        """Up to `limit` (product with visuals and category, views) pairs, most views first"""
+        if self._ranked_at is None or time.monotonic() - self._ranked_at > settings.TRENDING_TTL:
+            self._ranking.do('trending', self._rank)
+        ranked = self._ranked[:limit]
+
+        # ORM Query: The ranked products
+        # Equivalent SQL Query:
+        # SELECT * FROM store_product WHERE id IN (...);
+        products = Product.objects.select_related('category').prefetch_related('visuals').in_bulk(
+            [product_id for product_id, _ in ranked]
+        )
+        # Products deleted since they were ranked are left out
+        return [(products[product_id], views) for product_id, views in ranked if product_id in products]
+
+
+trending = Trending()
@@ -0,0 +1,296 @@
+# store/product_pages.py
+
+import time
+import random
+import logging
+from django.conf import settings
+from django.db.models import Q
+from django.http import Http404
+from django.templatetags.static import static
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+from . import images
+from .models import Product, VisualContent, Review, ProductPage, EnrichmentData
+from . import enrichment
+from . import recommendations
+from . import copurchases
+from . import reviews as review_pages
+from .tasks import task, enqueue
+from .stampede import SingleFlight, Throttle, expires_early
+
+logger = logging.getLogger(__name__)
+
+# Visual fields kept in the document, enough to render the image without a query
+VISUAL_FIELDS = ('id', 'name', 'description', 'short_name', 'file_type', 'css_class', 'width', 'height', 'placeholder')
+
+
+def _visual_json(visual):
+    return {field: getattr(visual, field) for field in VISUAL_FIELDS}
+
+
+def _card_json(product):
+    """What a product card links to and shows"""
+    visual = product.get_primary_visual()
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': str(product.price),
+        'visual': _visual_json(visual) if visual else None,
+    }
+
+
+def get_suggested_products(product):
+    """
+    Pick up to 4 products to recommend on a product page: the most similar by text
+    (store/recommendations.py), then for products without computed neighbours yet
+    the heuristics below
+    """
+    suggested_products = recommendations.similar_products(product, 4)
+    if len(suggested_products) == 4:
+        return suggested_products
+
+    # ORM Query: Get all products except current
+    # Equivalent SQL Query:
+    # SELECT * FROM store_product WHERE id != %s
+    # Get all products except the current product
+    all_products = Product.objects.exclude(id=product.id).prefetch_related('visuals')
+
+    # Keep track of already suggested product IDs to avoid duplicates
+    suggested_ids = [p.id for p in suggested_products]
+
+    # Recommendation products features:
+
+    # 1. First try to find products with similar names
+    if product.name:
+        # Split the product name into words for matching
+        name_words = product.name.lower().split()
+
+        # Create a Q object for name matching
+        name_q = Q()
+
+        # Add each word from the name to our query
+        for word in name_words:
+            if len(word) > 3:  # Only match on words with more than 3 characters to avoid common words
+                name_q |= Q(name__icontains=word)
+
+        # Find products with similar names
+        name_matches = all_products.filter(name_q).exclude(id__in=suggested_ids)[:min(3, 4-len(suggested_products))]
+        suggested_products.extend(name_matches)
+
+    # Keep track of already suggested product IDs to avoid duplicates
+    suggested_ids = [p.id for p in suggested_products]
+
+    # 2. If we need more products, look for products in the same category
+    if len(suggested_products) < 4:
+        category_matches = all_products.filter(category=product.category).exclude(
+            id__in=suggested_ids
+        )[:4-len(suggested_products)]
+        suggested_products.extend(category_matches)
+        # Update our list of suggested IDs
+        suggested_ids = [p.id for p in suggested_products]
+
+    # 3. If we still need more, look for products with similar Pokemon
+    if len(suggested_products) < 4 and product.pokemon:
+        # Find products with the same Pokemon type
+        pokemon_matches = all_products.filter(
+            pokemon__icontains=product.pokemon
+        ).exclude(
+            id__in=suggested_ids
+        )[:4-len(suggested_products)]
+
+        suggested_products.extend(pokemon_matches)
+        # Update our list of suggested IDs
+        suggested_ids = [p.id for p in suggested_products]
+
+    # If we still don't have 4 products, fill with random products
+    if len(suggested_products) < 4:
+        # ORM Query: Get the ids of the remaining products only
+        # Equivalent SQL Query:
+        # SELECT id FROM store_product WHERE id != %s AND id NOT IN (%s, ...)
+        remaining_ids = list(all_products.exclude(id__in=suggested_ids).values_list('id', flat=True))
+
+        # If we have remaining products, randomly select what we need
+        if remaining_ids:
+            # Calculate how many more products we need
+            needed = 4 - len(suggested_products)
+            # Randomly sample the needed number of products
+            random_ids = random.sample(remaining_ids, min(needed, len(remaining_ids)))
+            suggested_products.extend(all_products.filter(id__in=random_ids))
+
+    #  At most 4 suggested products
+    return suggested_products[:4]
+
+
+def build_document(product):
+    """
+    Collect everything the product page and the product detail API show into one
+    JSON-serializable document: product fields, features, visuals, latest reviews,
+    recommendations and Pokemon data.
+    """
+    # ORM Query: Get visuals for a product
+    # Equivalent SQL Query:
+    # SELECT * FROM store_visualcontent WHERE product_id = %s ORDER BY id
+    visuals = list(VisualContent.objects.filter(product=product).order_by('id'))
+
+    # ORM Query: Get the latest reviews for this product
+    # Equivalent SQL Query:
+    # SELECT * FROM store_review WHERE product_id = %s ORDER BY created_at DESC, id DESC LIMIT %s
+    reviews = Review.objects.filter(product=product).order_by('-created_at', '-id')[:settings.PRODUCT_PAGE_REVIEWS]
+
+    suggestions = [_card_json(suggested) for suggested in get_suggested_products(product)]
+    also_bought = [_card_json(other) for other in copurchases.also_bought(product, 4)]
+
+    # Pokemon data never changes, so the page keeps its own copy (server-side API call)
+    pokemon = None
+    if product.pokemon:
+        try:
+            pokemon = enrichment.get(EnrichmentData.POKEMON, product.pokemon)
+        except Exception as e:
+            logger.error(f"Error fetching Pokemon data: {str(e)}")
+
+    return {
+        'product': {
+            'id': product.id,
+            'name': product.name,
+            'description': product.description,
+            'feature': product.feature,
+            'rating': float(product.rating),
+            'price': str(product.price),
+            'category': product.category.name,
+            'pokemon': product.pokemon,
+            'location': product.location,
+        },
+        'features': product.get_features_list(),
+        'visuals': [_visual_json(visual) for visual in visuals],
+        'reviews': [{
+            'id': review.id,
+            'username': review.username,
+            'rating': review.rating,
+            'comment': review.comment,
+            'created_at': review.created_at.isoformat(),
+        } for review in reviews],
+        'suggestions': suggestions,
+        'also_bought': also_bought,
+        'pokemon': pokemon,
+    }
+
+
+@task('store.rebuild_product_page')
+def rebuild(product_id):
+    """Rebuild and store the page document of a product (drops it if the product is gone)"""
+    # ORM Query: Get the product with its category
+    # Equivalent SQL Query:
+    # SELECT * FROM store_product JOIN store_category ON ... WHERE store_product.id = %s
+    product = Product.objects.select_related('category').filter(id=product_id).first()
+    if product is None:
+        ProductPage.objects.filter(product_id=product_id).delete()
+        return None
+
+    start = time.perf_counter()
+    document = build_document(product)
+    ProductPage.objects.update_or_create(
+        product=product, defaults={'document': document, 'build_seconds': time.perf_counter() - start}
+    )
+    return document
+
+
+def schedule_rebuild(product_id):
+    """Queue a rebuild of a product page (a burst of writes to one product rebuilds it once)"""
+    enqueue(rebuild, product_id, dedup_key=f'page:{product_id}')
+
+
+def on_product_change(sender, instance, **kwargs):
+    """Signal receiver: rebuild the page of the product that was written (see apps.py)"""
+    product_id = instance.id if sender is Product else instance.product_id
+    schedule_rebuild(product_id)
+
+
+# Concurrent first views of a product build its page once
+_builds = SingleFlight()
+
+
+def _build_missing(product_id):
+    """Build a product page unless a build that finished after the caller's read stored it"""
+    document = ProductPage.objects.filter(product_id=product_id).values_list('document', flat=True).first()
+    if document is not None:
+        return document
+    return rebuild(product_id)
+
+# Read-triggered rebuilds are queued at most once a minute per product and process
+_refreshes = Throttle(60)
+
+
+def get_document(product_id):
+    """
+    Get the page document of a product with a single primary key read.
+    Builds it on the spot the first time; a document nearing or past PRODUCT_PAGE_TTL
+    is still served while a fresh one is built in the background.
+    """
+    try:
+        product_id = int(product_id)
+    except (TypeError, ValueError):
+        raise Http404("Product not found")
+
+    # ORM Query: Read the page document
+    # Equivalent SQL Query:
+    # SELECT document, built_at, build_seconds FROM store_productpage WHERE product_id = %s
+    page = ProductPage.objects.filter(product_id=product_id).values_list(
+        'document', 'built_at', 'build_seconds'
+    ).first()
+    if page is None:
+        document = _builds.do(product_id, lambda: _build_missing(product_id))
+        if document is None:
+            raise Http404("Product not found")
+        return document
+
+    document, built_at, build_seconds = page
+    age = (timezone.now() - built_at).total_seconds()
+    # Refresh a little before the TTL (sooner for slow builds) so hot pages rarely go stale
+    if expires_early(age, settings.PRODUCT_PAGE_TTL, build_seconds, settings.STAMPEDE_BETA):
+        if _refreshes.allow(product_id):
+            schedule_rebuild(product_id)
+    return document
+
+
+def _image_html(visual, alt, detail=False):
+    if visual is None:
+        return format_html('<img src="{}" alt="{}" loading="lazy">', static('images/default.jpg'), alt)
+    visual = VisualContent(**visual)
+    if detail:
+        return mark_safe(visual.get_html(css_override='', alt=alt, sizes=images.DETAIL_SIZES, lazy=False))
+    return mark_safe(visual.get_html(css_override='', alt=alt, sizes=images.CARD_SIZES))
+
+
+def page_context(document):
+    """Template context for store.html from a page document"""
+    product = document['product']
+    visuals = document['visuals']
+    # The page shows the first page of reviews, the rest are loaded from the reviews API
+    reviews = [
+        dict(review, created_at=parse_datetime(review['created_at']))
+        for review in document['reviews'][:settings.REVIEWS_PER_PAGE + 1]
+    ]
+    reviews_cursor = None
+    if len(reviews) > settings.REVIEWS_PER_PAGE:
+        reviews = reviews[:settings.REVIEWS_PER_PAGE]
+        reviews_cursor = review_pages.encode_cursor(reviews[-1]['created_at'], reviews[-1]['id'])
+    return {
+        'product': product,
+        'product_image': _image_html(visuals[0] if visuals else None, product['name'], detail=True),
+        'visuals': visuals,
+        'suggested_products': [
+            dict(suggested, image_html=_image_html(suggested['visual'], suggested['name']))
+            for suggested in document['suggestions']
+        ],
+        # Documents built before co-purchases were added don't have them
+        'also_bought': [
+            dict(other, image_html=_image_html(other['visual'], other['name']))
+            for other in document.get('also_bought', [])
+        ],
+        'product_features': document['features'],
+        'pokemon_data': document['pokemon'],
+        'reviews': reviews,
+        'reviews_cursor': reviews_cursor,
+    }
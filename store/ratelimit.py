@@ -0,0 +1,138 @@
+# store/ratelimit.py
+#
+# Rate limiting and load shedding state for RateLimitMiddleware and
+# LoadSheddingMiddleware (store/middleware.py).
+
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBuckets:
+    """
+    Token buckets in this process's memory: each key holds up to `burst` tokens and
+    gets `rate` new ones per second, a request takes one. The least recently used
+    keys are dropped past max_keys (a dropped key starts again with a full bucket).
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time of last update)
+
+    def take(self, key, rate, burst):
+        """Take a token; returns 0 if there was one, else seconds until there is"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    async def atake(self, key, rate, burst):
+        """take() for async middleware, memory only so it runs right here"""
+        return self.take(key, rate, burst)
+
+
+class CacheBuckets:
+    """
+    Buckets shared by every process through a Django cache (Redis, Memcached).
+    A token bucket needs a read-modify-write, so it is approximated by a counter
+    per window of burst / rate seconds: up to `burst` requests per window, the same
+    average rate. cache.incr is atomic on those backends.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def take(self, key, rate, burst):
+        window = burst / rate
+        now = time.time()
+        index = int(now // window)
+        cache_key = f'ratelimit:{key}:{index}'
+        try:
+            self.cache.add(cache_key, 0, timeout=math.ceil(window) + 1)
+            try:
+                count = self.cache.incr(cache_key)
+            except ValueError:
+                # Expired between add and incr
+                self.cache.add(cache_key, 1, timeout=math.ceil(window) + 1)
+                count = 1
+        except Exception as e:
+            # Don't turn a cache outage into an outage of the site
+            logger.warning(f"Rate limit cache unavailable, not limiting: {e}")
+            return 0
+
+        if count <= burst:
+            return 0
+        return (index + 1) * window - now
+
+    async def atake(self, key, rate, burst):
+        """take() for async middleware, the cache round trips run in a thread"""
+        return await sync_to_async(self.take)(key, rate, burst)
+
+
+def get_buckets():
+    """Buckets for RATE_LIMIT_CACHE, or in memory when it is not set"""
+    if settings.RATE_LIMIT_CACHE:
+        return CacheBuckets(settings.RATE_LIMIT_CACHE)
+    return MemoryBuckets()
+
+
+class LoadMonitor:
+    """
+    Load of this process: requests in progress, and a moving average of the response
+    time that halves every LATENCY_HALF_LIFE seconds without new requests, so shedding
+    stops on its own when the shed requests were the only traffic.
+    """
+    LATENCY_HALF_LIFE = 5.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self._latency = 0.0
+        self._sampled_at = time.monotonic()
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self, seconds=None):
+        """End a request; seconds is its response time, None to leave it out of the average"""
+        with self._lock:
+            self.in_flight -= 1
+            if seconds is not None:
+                now = time.monotonic()
+                decayed = self._latency * 0.5 ** ((now - self._sampled_at) / self.LATENCY_HALF_LIFE)
+                # Each sample moves the average 10% of the way towards it
+                self._latency = decayed + (seconds - decayed) * 0.1
+                self._sampled_at = now
+
+    @property
+    def latency(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._sampled_at
+            return self._latency * 0.5 ** (elapsed / self.LATENCY_HALF_LIFE)
+
+    def overloaded(self):
+        """Reason to shed requests, or None"""
+        if settings.LOAD_SHED_MAX_IN_FLIGHT and self.in_flight > settings.LOAD_SHED_MAX_IN_FLIGHT:
+            return f"{self.in_flight} requests in progress"
+        latency = self.latency
+        if settings.LOAD_SHED_LATENCY_MS and latency * 1000 > settings.LOAD_SHED_LATENCY_MS:
+            return f"average response time {latency * 1000:.0f}ms"
+        return None
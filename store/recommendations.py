@@ -0,0 +1,202 @@
+# store/recommendations.py
+#
+# Content-based recommendations. Each product's text (name, description, features) becomes
+# a TF-IDF vector, one row of a sparse matrix with unit-length rows, so the dot product of
+# two rows is their cosine similarity. Multiplying a batch of rows by the whole matrix
+# scores the batch against every product at once; the best SIMILAR_PRODUCTS of each row
+# are stored in SimilarProduct and product pages read them from there.
+
+import re
+import logging
+from array import array
+import numpy as np
+from scipy import sparse
+from django.db import transaction
+from .models import Product, SimilarProduct
+
+logger = logging.getLogger(__name__)
+
+TOKEN = re.compile(r'[a-z0-9]+')
+
+# Words too common in product text to say anything about similarity
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it', 'its',
+    'of', 'on', 'or', 'our', 'that', 'the', 'this', 'to', 'with', 'you', 'your',
+))
+
+# A word in the name counts as this many occurrences in the text
+NAME_WEIGHT = 3
+
+# Words in more than this share of the products are dropped like stop words
+MAX_DOCUMENT_SHARE = 0.5
+
+# Scores held in memory at once while finding neighbours (4 bytes each)
+SCORES_PER_BATCH = 50_000_000
+
+# Rows per block when looking for the top scores, see _top()
+BLOCK = 64
+
+
+def tokens(text):
+    return [token for token in TOKEN.findall(text.lower()) if len(token) > 1 and token not in STOP_WORDS]
+
+
+def product_terms(name, description, feature):
+    """Term counts of a product's text"""
+    counts = {}
+    for token in tokens(name or ''):
+        counts[token] = counts.get(token, 0) + NAME_WEIGHT
+    for token in tokens(f"{description or ''} {feature or ''}"):
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+def vectorize(texts):
+    """
+    TF-IDF matrix (CSR, float32, one L2-normalized row per text) of an iterable of
+    (name, description, feature). Words found in a single product can't make it similar
+    to another and are left out, like words in most products.
+    """
+    vocabulary = {}
+    rows, columns, counts = array('i'), array('i'), array('f')
+    n = 0
+    for n, text in enumerate(texts, 1):
+        for term, count in product_terms(*text).items():
+            rows.append(n - 1)
+            columns.append(vocabulary.setdefault(term, len(vocabulary)))
+            counts.append(count)
+
+    rows = np.frombuffer(rows, dtype=np.int32)
+    columns = np.frombuffer(columns, dtype=np.int32)
+    counts = np.frombuffer(counts, dtype=np.float32)
+
+    frequencies = np.bincount(columns, minlength=len(vocabulary))
+    kept = (frequencies > 1) & (frequencies <= max(1, MAX_DOCUMENT_SHARE * n))
+    entries = kept[columns]
+    # Renumber the kept words 0..k-1
+    renumbered = np.cumsum(kept) - 1
+    columns = renumbered[columns[entries]]
+
+    # Sublinear term frequency, smoothed inverse document frequency
+    idf = (np.log((1 + n) / (1 + frequencies[kept])) + 1).astype(np.float32)
+    values = (1 + np.log(counts[entries])) * idf[columns]
+    matrix = sparse.csr_matrix((values, (rows[entries], columns)), shape=(n, int(kept.sum())), dtype=np.float32)
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (sparse.diags((1 / norms).astype(np.float32)) @ matrix).tocsr()
+
+
+def _top(scores, k):
+    """
+    Row indices and values of the k largest scores of each column, best first (k x columns).
+    The top k of a column can only be in the k row blocks with the highest maxima, so
+    those are selected first instead of partitioning every score.
+    """
+    n = scores.shape[0]
+    if n <= k * BLOCK:
+        rows = np.argpartition(scores, -k, axis=0)[-k:]
+    else:
+        # Rows of whole blocks as (blocks, BLOCK, columns), then the short last block
+        whole = n // BLOCK * BLOCK
+        maxima = scores[:whole].reshape(-1, BLOCK, scores.shape[1]).max(axis=1)
+        if whole < n:
+            maxima = np.vstack((maxima, scores[whole:].max(axis=0)))
+        blocks = np.argpartition(maxima, -k, axis=0)[-k:]
+        candidates = (blocks[:, None, :] * BLOCK + np.arange(BLOCK)[None, :, None]).reshape(k * BLOCK, -1)
+        # The last block may be short
+        outside = candidates >= n
+        candidates[outside] = n - 1
+        values = np.take_along_axis(scores, candidates, axis=0)
+        values[outside] = -np.inf
+        rows = np.take_along_axis(candidates, np.argpartition(values, -k, axis=0)[-k:], axis=0)
+
+    values = np.take_along_axis(scores, rows, axis=0)
+    order = np.argsort(-values, axis=0, kind='stable')
+    return np.take_along_axis(rows, order, axis=0), np.take_along_axis(values, order, axis=0)
+
+
+def neighbours(matrix, k, batch_size=None):
+    """
+    Top k rows by cosine similarity for every row of a normalized matrix, best first.
+    Yields (first row, indices, scores) per batch of rows, both arrays batch x k;
+    rows with fewer than k similar rows are padded with score 0. A batch holds
+    batch_size x rows scores, by default about SCORES_PER_BATCH.
+    """
+    n = matrix.shape[0]
+    k = min(k, n - 1)
+    if k <= 0:
+        return
+    batch_size = batch_size or min(1000, max(1, SCORES_PER_BATCH // n))
+    by_term = matrix.tocsc()
+    for start in range(0, n, batch_size):
+        stop = min(start + batch_size, n)
+        batch = matrix[start:stop]
+        # Only the terms of the batch contribute; the product is dense anyway, so a
+        # sparse x dense product avoids building it as a sparse matrix (rows x batch)
+        terms = np.unique(batch.indices)
+        scores = by_term[:, terms] @ batch[:, terms].T.toarray()
+        # Not similar to itself
+        scores[np.arange(start, stop), np.arange(stop - start)] = -1
+
+        rows, values = _top(scores, k)
+        yield start, rows.T, np.maximum(values.T, 0)
+
+
+def compute(k, batch_size=None):
+    """Recompute the SimilarProduct rows of every product; returns how many were stored"""
+    # ORM Query: Text of every product
+    # Equivalent SQL Query:
+    # SELECT id, name, description, feature FROM store_product ORDER BY id;
+    rows = Product.objects.order_by('id').values_list('id', 'name', 'description', 'feature')
+    ids = array('q')
+
+    def texts():
+        for product_id, *text in rows.iterator(chunk_size=2000):
+            ids.append(product_id)
+            yield text
+
+    matrix = vectorize(texts())
+    ids = np.frombuffer(ids, dtype=np.int64)
+    logger.info(f"Vectorized {len(ids)} products into {matrix.shape[1]} terms")
+
+    stored = 0
+    for start, indices, scores in neighbours(matrix, k, batch_size):
+        product_ids = ids[start:start + len(indices)].tolist()
+        similar = []
+        for product_id, row_indices, row_scores in zip(product_ids, indices.tolist(), scores.tolist()):
+            rank = 0
+            for index, score in zip(row_indices, row_scores):
+                # Nothing in common
+                if score <= 0:
+                    break
+                similar.append(SimilarProduct(product_id=product_id, similar_id=int(ids[index]), rank=rank, score=score))
+                rank += 1
+
+        # One transaction per batch, pages read either the old or new neighbours of a product
+        with transaction.atomic():
+            # ORM Query: Replace the neighbours of the batch
+            # Equivalent SQL Query:
+            # DELETE FROM store_similarproduct WHERE product_id IN (...);
+            # INSERT INTO store_similarproduct (product_id, similar_id, rank, score) VALUES ...;
+            SimilarProduct.objects.filter(product_id__in=product_ids).delete()
+            # Products deleted since they were read would fail the foreign keys
+            referenced = {row.product_id for row in similar} | {row.similar_id for row in similar}
+            existing = set(Product.objects.filter(id__in=referenced).values_list('id', flat=True))
+            similar = [row for row in similar if row.product_id in existing and row.similar_id in existing]
+            SimilarProduct.objects.bulk_create(similar, batch_size=1000)
+        stored += len(similar)
+    return stored
+
+
+def similar_products(product, limit):
+    """The `limit` most similar products to a product (with visuals), best first"""
+    # ORM Query: Stored neighbours with their products
+    # Equivalent SQL Query:
+    # SELECT store_product.* FROM store_similarproduct JOIN store_product ON store_product.id = similar_id
+    # WHERE product_id = %s ORDER BY rank LIMIT %s;
+    rows = (
+        SimilarProduct.objects.filter(product=product).order_by('rank')
+        .select_related('similar').prefetch_related('similar__visuals')[:limit]
+    )
+    return [row.similar for row in rows]
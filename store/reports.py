@@ -0,0 +1,198 @@
+# store/reports.py
+
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum, Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .models import Order, OrderItem, DailySales, DailyProductSales
+from .tasks import task
+
+logger = logging.getLogger(__name__)
+
+# Report groupings -> DailyProductSales columns
+GROUPINGS = {
+    'product': ('product_id', 'product_name'),
+    'category': ('category_name',),
+    'size': ('size',),
+}
+
+
+def _increment(model, keys, defaults, **amounts):
+    """Add amounts to the rollup row with these keys, creating it if needed"""
+    increments = {field: F(field) + value for field, value in amounts.items()}
+
+    # ORM Query: Add to the existing row
+    # Equivalent SQL Query:
+    # UPDATE store_dailyproductsales SET units = units + %s, revenue = revenue + %s
+    # WHERE date = %s AND product_id = %s AND size = %s;
+    if model.objects.filter(**keys).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**{**defaults, **keys, **amounts})
+    except IntegrityError:
+        # Another checkout created the row first
+        model.objects.filter(**keys).update(**increments)
+
+
+def _line_key(day, product_id, product_name, size):
+    keys = {'date': day, 'product_id': product_id, 'size': size or ''}
+    if product_id is None:
+        # Lines of deleted products are told apart by name
+        keys['product_name'] = product_name
+    return keys
+
+
+@task('store.record_order_sales')
+def record_order(order_id):
+    """Add an order to the daily rollups (queued by checkout)"""
+    with transaction.atomic():
+        # ORM Query: Lock the order unless it is already counted
+        # Equivalent SQL Query:
+        # SELECT * FROM store_order WHERE id = %s AND in_rollups = false FOR UPDATE;
+        order = Order.objects.select_for_update().filter(id=order_id, in_rollups=False).first()
+        if order is None:
+            return
+
+        day = timezone.localdate(order.created_at)
+        lines = defaultdict(lambda: {'units': 0, 'revenue': Decimal('0')})
+        names = {}
+        for item in order.items.select_related('product__category'):
+            key = (item.product_id, item.product_name, item.size or '')
+            lines[key]['units'] += item.quantity
+            lines[key]['revenue'] += item.subtotal
+            names[key] = item.product.category.name if item.product else ''
+
+        for (product_id, product_name, size), amounts in lines.items():
+            _increment(
+                DailyProductSales, _line_key(day, product_id, product_name, size),
+                {'product_name': product_name, 'category_name': names[(product_id, product_name, size)]},
+                **amounts
+            )
+
+        _increment(
+            DailySales, {'date': day}, {},
+            orders=1,
+            units=sum(amounts['units'] for amounts in lines.values()),
+            revenue=sum((amounts['revenue'] for amounts in lines.values()), Decimal('0')),
+        )
+
+        order.in_rollups = True
+        order.save(update_fields=['in_rollups'])
+
+
+def _day_start(day):
+    """Start of a local day as an aware datetime"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def rebuild(start, end):
+    """
+    Recompute the rollups of the days start..end (inclusive) from the orders,
+    e.g. to backfill or after orders were edited. Returns the number of orders counted.
+    """
+    with transaction.atomic():
+        # ORM Query: Lock the orders of the period
+        # Equivalent SQL Query:
+        # SELECT id FROM store_order WHERE created_at >= %s AND created_at < %s FOR UPDATE;
+        order_ids = list(
+            Order.objects.select_for_update()
+            .filter(created_at__gte=_day_start(start), created_at__lt=_day_start(end + timedelta(days=1)))
+            .values_list('id', flat=True)
+        )
+
+        DailySales.objects.filter(date__range=(start, end)).delete()
+        DailyProductSales.objects.filter(date__range=(start, end)).delete()
+
+        # ORM Query: Order line totals per day, product and size
+        # Equivalent SQL Query:
+        # SELECT o.created_at::date AS day, i.product_id, i.product_name, c.name, i.size,
+        #        SUM(i.quantity), SUM(i.price * i.quantity)
+        # FROM store_orderitem i JOIN store_order o ON i.order_id = o.id
+        # LEFT JOIN store_product p ON i.product_id = p.id LEFT JOIN store_category c ON p.category_id = c.id
+        # WHERE o.id IN (%s, ...) GROUP BY 1, 2, 3, 4, 5;
+        lines = (
+            OrderItem.objects.filter(order_id__in=order_ids)
+            .annotate(day=TruncDate('order__created_at'))
+            .values('day', 'product_id', 'product_name', 'product__category__name', 'size')
+            .annotate(units=Sum('quantity'), revenue=Sum(F('price') * F('quantity')))
+        )
+
+        merged = {}
+        days = defaultdict(lambda: {'orders': 0, 'units': 0, 'revenue': Decimal('0')})
+        for line in lines:
+            keys = _line_key(line['day'], line['product_id'], line['product_name'], line['size'])
+            key = tuple(sorted(keys.items()))
+            # '' and NULL sizes end up in the same row
+            row = merged.setdefault(key, DailyProductSales(**{
+                'product_name': line['product_name'],
+                'category_name': line['product__category__name'] or '',
+                **keys,
+            }))
+            row.units += line['units']
+            row.revenue += line['revenue']
+            days[line['day']]['units'] += line['units']
+            days[line['day']]['revenue'] += line['revenue']
+
+        for day, count in (
+            Order.objects.filter(id__in=order_ids).annotate(day=TruncDate('created_at'))
+            .values('day').annotate(count=Count('id')).values_list('day', 'count')
+        ):
+            days[day]['orders'] = count
+
+        DailyProductSales.objects.bulk_create(merged.values(), batch_size=1000)
+        DailySales.objects.bulk_create(
+            [DailySales(date=day, **totals) for day, totals in days.items()], batch_size=1000
+        )
+        Order.objects.filter(id__in=order_ids, in_rollups=False).update(in_rollups=True)
+
+    return len(order_ids)
+
+
+def parse_period(start=None, end=None, days=30):
+    """
+    Report period from YYYY-MM-DD strings; missing or invalid dates default to
+    the last `days` days. Returns (start, end) dates.
+    """
+    end = _parse_day(end) or timezone.localdate()
+    start = _parse_day(start) or end - timedelta(days=days - 1)
+    return min(start, end), end
+
+
+def _parse_day(value):
+    try:
+        return parse_date(value or '')
+    except ValueError:
+        # Well formed but impossible dates, e.g. 2024-02-30
+        return None
+
+
+def sales_by_day(start, end):
+    """Totals per day, oldest first"""
+    # ORM Query: One row per day
+    # Equivalent SQL Query:
+    # SELECT date, orders, units, revenue FROM store_dailysales WHERE date BETWEEN %s AND %s ORDER BY date;
+    return list(
+        DailySales.objects.filter(date__range=(start, end)).order_by('date')
+        .values('date', 'orders', 'units', 'revenue')
+    )
+
+
+def sales_by(grouping, start, end, limit=None):
+    """Units and revenue per product, category or size over the period, best selling first"""
+    # ORM Query: Sum the daily rows of the period
+    # Equivalent SQL Query:
+    # SELECT category_name, SUM(units), SUM(revenue) FROM store_dailyproductsales
+    # WHERE date BETWEEN %s AND %s GROUP BY category_name ORDER BY SUM(revenue) DESC;
+    rows = (
+        DailyProductSales.objects.filter(date__range=(start, end))
+        .values(*GROUPINGS[grouping])
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('-revenue')
+    )
+    return list(rows[:limit] if limit else rows)
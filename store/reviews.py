@@ -0,0 +1,88 @@
+# store/reviews.py
+#
+# Review listing for the product reviews API: pages are read with keyset pagination on
+# (created_at, id), which review_product_latest_idx serves directly at any depth (an OFFSET
+# would read and skip every earlier review), and the summary is one primary key read.
+
+import base64
+import binascii
+from django.db.models import Q, Count, Avg
+from django.utils.dateparse import parse_datetime
+from .models import Product, Review, ReviewSummary
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, review_id):
+    """Opaque cursor for the reviews after this one"""
+    key = f"{created_at.isoformat()}|{review_id}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(created_at, id) of a cursor, raises InvalidCursor"""
+    try:
+        key = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, review_id = key.rsplit('|', 1)
+        created_at = parse_datetime(created_at)
+        review_id = int(review_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+    if created_at is None:
+        raise InvalidCursor("Invalid cursor")
+    return created_at, review_id
+
+
+def get_page(product_id, limit, cursor=None):
+    """
+    Up to `limit` reviews of a product, newest first, after the review of `cursor`
+    (from the start without). Returns (reviews, cursor of the next page or None).
+    """
+    reviews = Review.objects.filter(product_id=product_id)
+    if cursor:
+        created_at, review_id = decode_cursor(cursor)
+        reviews = reviews.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=review_id))
+
+    # ORM Query: One page of reviews, plus one to know whether there are more
+    # Equivalent SQL Query:
+    # SELECT * FROM store_review WHERE product_id = %s
+    # AND (created_at < %s OR (created_at = %s AND id < %s))
+    # ORDER BY created_at DESC, id DESC LIMIT %s;
+    page = list(reviews.order_by('-created_at', '-id')[:limit + 1])
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1].created_at, page[limit - 1].id)
+    return page, None
+
+
+def summarize(product_id):
+    """Recompute and store the review summary of a product"""
+    # ORM Query: Count, average and histogram in one pass over the product's reviews
+    # Equivalent SQL Query:
+    # SELECT COUNT(id), AVG(rating), COUNT(id) FILTER (WHERE rating = 1), ... FILTER (WHERE rating = 5)
+    # FROM store_review WHERE product_id = %s;
+    totals = Review.objects.filter(product_id=product_id).aggregate(
+        count=Count('id'),
+        average=Avg('rating'),
+        **{f'stars_{star}': Count('id', filter=Q(rating=star)) for star in range(1, 6)}
+    )
+    summary, _ = ReviewSummary.objects.update_or_create(product_id=product_id, defaults={
+        'count': totals['count'],
+        'average': totals['average'] or 0,
+        'stars': [totals[f'stars_{star}'] for star in range(1, 6)],
+    })
+    return summary
+
+
+def get_summary(product_id):
+    """The stored review summary of a product (computed the first time), None if there is no such product"""
+    # ORM Query: Read the summary
+    # Equivalent SQL Query:
+    # SELECT * FROM store_reviewsummary WHERE product_id = %s;
+    summary = ReviewSummary.objects.filter(product_id=product_id).first()
+    if summary is None:
+        if not Product.objects.filter(id=product_id).exists():
+            return None
+        summary = summarize(product_id)
+    return summary
@@ -0,0 +1,111 @@
+# store/routers.py
+
+import time
+import random
+import logging
+import threading
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Models whose reads can go to a replica: the catalog, which changes rarely and is read
+# on every page. Carts, orders, sessions and tasks always use the primary.
+CATALOG_MODELS = {'category', 'product', 'visualcontent', 'review', 'productpage', 'enrichmentdata'}
+
+# Writes that pin the session to the primary. Page documents and enrichment data are
+# caches filled on reads, writing them shouldn't take the visitor off the replicas.
+PINNING_MODELS = {'category', 'product', 'visualcontent', 'review'}
+
+# Routing state of the current request, set by ReplicaPinMiddleware:
+# {'pinned': read from the primary, 'wrote': the request wrote catalog data}
+# Outside of requests (management commands, the task worker) it is None and everything
+# uses the primary, since those usually read data they just wrote.
+_request_state = ContextVar('db_routing_state', default=None)
+
+
+def start_request(pinned):
+    """Begin routing for a request; returns a token for end_request"""
+    return _request_state.set({'pinned': pinned, 'wrote': False})
+
+
+def end_request(token):
+    """End routing for a request; returns True if it wrote catalog data"""
+    state = _request_state.get()
+    _request_state.reset(token)
+    return bool(state and state['wrote'])
+
+
+def _is_catalog(model, names=CATALOG_MODELS):
+    return model._meta.app_label == 'store' and model._meta.model_name in names
+
+
+class ReplicaHealth:
+    """Replicas that failed to connect are skipped for REPLICA_RETRY_SECONDS"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._down_until = {}
+
+    def is_up(self, alias):
+        with self._lock:
+            down_until = self._down_until.get(alias)
+        if down_until is not None and time.monotonic() < down_until:
+            return False
+
+        try:
+            # No-op when the connection is already open
+            connections[alias].ensure_connection()
+        except Exception as e:
+            logger.warning(f"Replica {alias} unavailable, reading from the primary: {e}")
+            with self._lock:
+                self._down_until[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+            return False
+        return True
+
+
+health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+    """
+    Send catalog reads to a read replica (DATABASE_REPLICAS) and everything else
+    to the primary ('default'). Reads stay on the primary when:
+      - the request is pinned, because this session wrote catalog data in the last
+        REPLICA_PIN_SECONDS (read-your-writes, see ReplicaPinMiddleware), or it is
+        itself a write (POST/PUT/DELETE)
+      - a transaction is open on the primary
+      - no replica is reachable
+    """
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or not _is_catalog(model):
+            return 'default'
+
+        state = _request_state.get()
+        if state is None or state['pinned'] or connections['default'].in_atomic_block:
+            return 'default'
+
+        replicas = list(settings.DATABASE_REPLICAS)
+        random.shuffle(replicas)
+        for alias in replicas:
+            if health.is_up(alias):
+                return alias
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None and _is_catalog(model, PINNING_MODELS):
+            # The rest of this request, and the session's next requests, read what was written
+            state['pinned'] = True
+            state['wrote'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db == 'default'
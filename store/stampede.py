@@ -0,0 +1,80 @@
+# store/stampede.py
+
+import math
+import time
+import random
+import threading
+
+
+class SingleFlight:
+    """
+    Run a computation once per key for all concurrent callers in this process:
+    the first caller computes, the others wait for it and get the same result
+    (or exception) instead of computing it again.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class Throttle:
+    """Let an action through at most once per `seconds` for each key (per process)"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._lock = threading.Lock()
+        self._last = {}
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.seconds:
+                return False
+            self._last[key] = now
+            # Keep the dict from growing without bound
+            if len(self._last) > 10000:
+                self._last = {k: t for k, t in self._last.items() if now - t < self.seconds}
+            return True
+
+
+def expires_early(age, ttl, delta, beta=1.0):
+    """
+    Probabilistic early expiration ("XFetch"): each caller treats an entry as
+    expired with a probability that grows as it ages towards ttl, sooner for
+    entries that take longer (delta seconds) to recompute. One request then
+    refreshes it shortly before it really expires instead of all at once after.
+    """
+    # 1 - random() is in (0, 1], so the log is defined and <= 0
+    return age - delta * beta * math.log(1.0 - random.random()) >= ttl
@@ -0,0 +1,178 @@
+# store/suggest.py
+
+import time
+import logging
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Fields the index is built from (products, categories, visuals). Saves that only write
+# other fields, like update_rating(), leave it as it is.
+INDEXED_FIELDS = frozenset(('name', 'pokemon', 'category', 'product', 'short_name', 'file_type'))
+
+
+class SuggestIndex:
+    """
+    In-memory prefix index for search-as-you-type.
+
+    Every product is indexed under each word suffix of its name
+    ("arizona wildcats cap" -> "arizona wildcats cap", "wildcats cap", "cap"),
+    its category and its pokemon. The keys live in one sorted list, so a prefix
+    lookup is a binary search followed by a short forward scan.
+
+    The first lookup builds the index. After a product change (see mark_stale,
+    connected to model signals in apps.py), or once it is older than
+    SUGGEST_INDEX_TTL, which keeps other worker processes eventually fresh, it is
+    rebuilt once in a background thread while lookups keep using the old one.
+    Responses are cached per (prefix, limit) until the next rebuild.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        self._keys = []          # sorted lowercase keys
+        self._key_products = []  # product id for each key, same order as _keys
+        self._products = {}      # product id -> {'id', 'name', 'image'}
+        self._built_at = None
+        self._stale = True
+        self._responses = OrderedDict()
+
+    def mark_stale(self, update_fields=None, **kwargs):
+        """Signal receiver: rebuild the index in the background before long"""
+        if update_fields is not None and not INDEXED_FIELDS.intersection(update_fields):
+            return
+        self._stale = True
+
+    def _needs_rebuild(self):
+        return (
+            self._stale
+            or self._built_at is None
+            or time.monotonic() - self._built_at > settings.SUGGEST_INDEX_TTL
+        )
+
+    def _refresh_in_background(self):
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _refresh(self):
+        try:
+            with self._build_lock:
+                self.rebuild()
+        except Exception as e:
+            logger.error(f"Suggest index rebuild failed: {e}")
+        finally:
+            self._refreshing = False
+            connections.close_all()
+
+    def ensure_built(self):
+        """Build the index if it never was (once for all concurrent callers)"""
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    self.rebuild()
+
+    def rebuild(self):
+        """Load products from the database and rebuild the sorted key list"""
+        from .models import Product, VisualContent
+
+        self._stale = False
+        start = time.perf_counter()
+
+        # ORM Query: Only the columns the suggestions need
+        # Equivalent SQL Query:
+        # SELECT p.id, p.name, p.pokemon, c.name FROM store_product p
+        # JOIN store_category c ON p.category_id = c.id;
+        rows = Product.objects.values_list('id', 'name', 'pokemon', 'category__name')
+
+        # ORM Query: First visual of every product
+        # Equivalent SQL Query:
+        # SELECT product_id, short_name, file_type FROM store_visualcontent ORDER BY product_id, id;
+        images = {}
+        for product_id, short_name, file_type in VisualContent.objects.order_by(
+            'product_id', 'id'
+        ).values_list('product_id', 'short_name', 'file_type'):
+            images.setdefault(product_id, f"{short_name}.{file_type}")
+
+        self.build(rows, images)
+        logger.info(
+            f"Built suggest index: {len(self._products)} products, {len(self._keys)} keys "
+            f"in {(time.perf_counter() - start) * 1000:.0f}ms"
+        )
+
+    def build(self, rows, images):
+        """Replace the index with (id, name, pokemon, category name) rows and {product id: image}"""
+        entries = []
+        products = {}
+        for product_id, name, pokemon, category in rows:
+            products[product_id] = {
+                'id': product_id,
+                'name': name,
+                'image': images.get(product_id, 'default.jpg'),
+            }
+            words = name.lower().split()
+            for i in range(len(words)):
+                entries.append((' '.join(words[i:]), product_id))
+            if category:
+                entries.append((category.lower(), product_id))
+            if pokemon:
+                entries.append((pokemon.lower(), product_id))
+
+        entries.sort()
+
+        # Swap everything in at once so concurrent lookups see either the old or the new index
+        with self._lock:
+            self._keys = [key for key, _ in entries]
+            self._key_products = [product_id for _, product_id in entries]
+            self._products = products
+            self._responses = OrderedDict()
+            self._built_at = time.monotonic()
+
+    def suggest(self, prefix, limit=8):
+        """Return up to `limit` products with a name word, category or pokemon starting with prefix"""
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+
+        if self._built_at is None:
+            self.ensure_built()
+        elif self._needs_rebuild():
+            self._refresh_in_background()
+
+        cache_key = (prefix, limit)
+        with self._lock:
+            cached = self._responses.get(cache_key)
+            if cached is not None:
+                self._responses.move_to_end(cache_key)
+                return cached
+            keys, key_products, products = self._keys, self._key_products, self._products
+
+        results = []
+        seen = set()
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix) and len(results) < limit:
+            product_id = key_products[i]
+            if product_id not in seen:
+                seen.add(product_id)
+                results.append(products[product_id])
+            i += 1
+
+        with self._lock:
+            # Don't cache a result computed from an index that was replaced meanwhile
+            if self._keys is not keys:
+                return results
+            self._responses[cache_key] = results
+            if len(self._responses) > settings.SUGGEST_CACHE_SIZE:
+                self._responses.popitem(last=False)
+        return results
+
+
+suggest_index = SuggestIndex()
@@ -0,0 +1,158 @@
+# store/tasks.py
+
+import random
+import logging
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Task, Product
+from . import reviews
+
+logger = logging.getLogger(__name__)
+
+# Task name -> function, filled by the @task decorator
+_registry = {}
+
+
+def task(name, max_attempts=None):
+    """
+    Register a function as a background task under a stable name, e.g.
+
+        @task('store.recompute_rating')
+        def recompute_rating(product_id): ...
+
+    Arguments must be JSON serializable, they are stored in the task row.
+    """
+    def decorator(func):
+        func.task_name = name
+        func.max_attempts = max_attempts or settings.TASK_MAX_ATTEMPTS
+        _registry[name] = func
+        return func
+    return decorator
+
+
+def enqueue(func, *args, dedup_key=None, delay=0):
+    """
+    Queue func(*args) for the worker (`python manage.py run_tasks`).
+
+    The task row is written in the caller's transaction, so it only becomes
+    visible to the worker if the write that caused it commits. When another task
+    with the same dedup_key is still queued, nothing is added.
+    With TASKS_EAGER the task runs in-process right after the commit instead.
+    """
+    if settings.TASKS_EAGER:
+        transaction.on_commit(lambda: _run_eager(func, args))
+        return
+
+    try:
+        # Savepoint, so a duplicate doesn't break the caller's transaction
+        with transaction.atomic():
+            # ORM Query: Queue the task
+            # Equivalent SQL Query:
+            # INSERT INTO store_task (name, args, dedup_key, status, attempts, max_attempts, run_at, ...)
+            # VALUES (%s, %s, %s, 'queued', 0, %s, NOW() + %s, ...);
+            Task.objects.create(
+                name=func.task_name,
+                args=list(args),
+                dedup_key=dedup_key,
+                max_attempts=func.max_attempts,
+                run_at=timezone.now() + timedelta(seconds=delay),
+            )
+    except IntegrityError:
+        logger.debug(f"Task {dedup_key} already queued")
+
+
+def _run_eager(func, args):
+    try:
+        func(*args)
+    except Exception as e:
+        logger.error(f"Task {func.task_name}{args} failed: {e}")
+
+
+def claim_tasks(batch_size):
+    """
+    Mark up to batch_size due tasks as running and return them.
+    Tasks left running by a worker that died are picked up again after TASK_LOCK_TIMEOUT.
+    """
+    now = timezone.now()
+    abandoned = now - timedelta(seconds=settings.TASK_LOCK_TIMEOUT)
+
+    with transaction.atomic():
+        # ORM Query: Lock the next due tasks, skipping the ones other workers hold
+        # Equivalent SQL Query:
+        # SELECT id FROM store_task
+        # WHERE (status = 'queued' AND run_at <= NOW()) OR (status = 'running' AND locked_at < %s)
+        # ORDER BY run_at LIMIT %s FOR UPDATE SKIP LOCKED;
+        ids = list(
+            Task.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='queued', run_at__lte=now) | Q(status='running', locked_at__lt=abandoned))
+            .order_by('run_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        Task.objects.filter(id__in=ids).update(status='running', locked_at=now, attempts=F('attempts') + 1)
+
+    return list(Task.objects.filter(id__in=ids).order_by('run_at'))
+
+
+def run_task(task_row):
+    """Run one claimed task; returns True if it succeeded"""
+    func = _registry.get(task_row.name)
+    try:
+        if func is None:
+            raise LookupError(f"Unknown task {task_row.name}")
+        func(*task_row.args)
+    except Exception as e:
+        logger.error(f"Task {task_row.name}{tuple(task_row.args)} failed (attempt {task_row.attempts}): {e}")
+        _retry_or_fail(task_row, traceback.format_exc(), retry=func is not None)
+        return False
+
+    task_row.delete()
+    return True
+
+
+def _retry_or_fail(task_row, error, retry=True):
+    if not retry or task_row.attempts >= task_row.max_attempts:
+        Task.objects.filter(id=task_row.id).update(status='failed', locked_at=None, last_error=error)
+        return
+
+    # Exponential backoff with jitter: ~base, 2*base, 4*base ... capped
+    delay = min(settings.TASK_RETRY_MAX_DELAY, settings.TASK_RETRY_DELAY * 2 ** (task_row.attempts - 1))
+    delay *= random.uniform(0.5, 1.0)
+    try:
+        with transaction.atomic():
+            Task.objects.filter(id=task_row.id).update(
+                status='queued', locked_at=None, last_error=error,
+                run_at=timezone.now() + timedelta(seconds=delay)
+            )
+    except IntegrityError:
+        # The same work was queued again meanwhile, that task covers this one
+        task_row.delete()
+
+
+def run_pending(batch_size):
+    """Claim and run one batch of due tasks; returns (succeeded, failed)"""
+    succeeded = failed = 0
+    for task_row in claim_tasks(batch_size):
+        if run_task(task_row):
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
+
+
+# Store tasks
+
+@task('store.recompute_rating')
+def recompute_rating(product_id):
+    """Recompute a product's average rating and review summary after its reviews changed"""
+    product = Product.objects.filter(id=product_id).first()
+    if product is not None:
+        product.update_rating()
+        reviews.summarize(product_id)
+
+
+def schedule_rating_update(product_id):
+    enqueue(recompute_rating, product_id, dedup_key=f'rating:{product_id}')
@@ -1,7 +1,40 @@
 from django import template
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+from store import images
 
 register = template.Library()
 
 @register.filter
-def get_html(visual):
-    return visual.get_html()
\ No newline at end of file
+def get_html(visual, css_override=None):
+    return mark_safe(visual.get_html(css_override))
+
+@register.filter
+def product_image(product, size='card'):
+    """
+    Render a product's primary image as a responsive <picture>.
+    Pass "detail" for the large image on the product page.
+    """
+    visual = product.get_primary_visual()
+    if visual is None:
+        return format_html('<img src="{}" alt="{}" loading="lazy">', static('images/default.jpg'), product.name)
+    if size == 'detail':
+        # The product page image is above the fold, so load it right away
+        return mark_safe(visual.get_html(css_override='', alt=product.name, sizes=images.DETAIL_SIZES, lazy=False))
+    return mark_safe(visual.get_html(css_override='', alt=product.name, sizes=images.CARD_SIZES))
+
+@register.simple_tag
+def bundle(name):
+    """
+    Render the <script>/<link> tags for a bundle from settings.STATIC_BUNDLES.
+    Uses the single minified bundle built by collectstatic when bundling is
+    enabled, otherwise the individual source files (for development).
+    """
+    is_css = name.endswith('.css')
+    tag = '<link rel="stylesheet" href="{}">' if is_css else '<script src="{}"></script>'
+
+    if settings.STATIC_BUNDLES_ENABLED:
+        return format_html(tag, static(name))
+    return format_html_join('\n', tag, ((static(source),) for source in settings.STATIC_BUNDLES[name]))
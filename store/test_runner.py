@@ -0,0 +1,24 @@
+# store/test_runner.py
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class StoreTestRunner(DiscoverRunner):
+    """
+    Runs the tests with plain static files storage. Tests run with DEBUG=False, where
+    the manifest storage of settings.STORAGES raises for every {% static %} file that
+    collectstatic hasn't hashed yet, so pages would only render after a collectstatic.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._storages = override_settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        self._storages.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._storages.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,28 +1,1565 @@
-from models import Product, VisualContent
-
-# Test to fetch all the products
-print("Fetching all products...")
-products = Product.get_all()
-for product in products:
-    print(product.__dict__)
-
-# Test to fetch a single product by ID
-test_product_id = "1"
-product = Product.get_by_id(test_product_id)
-if product:
-    print(f"\nProduct with ID {test_product_id}:")
-    print(product.__dict__)
-    print(f"Image Name: {product.get_image_name()}")
-else:
-    print(f"\nProduct with ID {test_product_id} is not found.")
-
-# Test to fetch visuals for the product
-print(f"\nFetching visuals for Product {test_product_id}...")
-visuals = VisualContent.get_for_product(test_product_id)
-for visual in visuals:
-    print(visual.__dict__)
-
-# Test to generate HTML for the first visual
-if visuals:
-    print("\nGenerated HTML for the first visual:")
-    print(visuals[0].get_html())
\ No newline at end of file
+# store/tests.py
+
+import io
+import os
+import base64
+import json
+import time
+import random
+import shutil
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from asgiref.sync import AsyncToSync
+from django.contrib import admin
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.db.models import Count
+from django.forms.models import model_to_dict
+from django.test import AsyncClient, Client, RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+from .models import Category, Product, ProductPage, ProductViews, EnrichmentData, Review, Cart, CartItem, Order, OrderItem, DailySales, DailyProductSales, ProductLike, ProductStats, CoPurchase, Stock, Task, Watermark
+from . import copurchases, enrichment, inventory, likes, middleware, popularity, product_pages, ratelimit, reports, reviews, routers, tasks
+from .catalog import ColumnarCatalog, catalog
+from .management import periodic
+from .stampede import Throttle
+from .suggest import SuggestIndex
+
+
+@override_settings(TASKS_EAGER=False)
+class StampedeTests(TransactionTestCase):
+    """
+    Concurrent requests for a missing product page or enrichment entry compute it once
+    (store/stampede.py). Real threads with their own database connections, hence
+    TransactionTestCase.
+    """
+
+    THREADS = 200
+
+    def setUp(self):
+        category = Category.objects.create(name="Apparel")
+        self.product = Product.objects.create(
+            name="Wildcat Hoodie", description="Warm hoodie", price=40, category=category, location="Manhattan"
+        )
+        # No page document yet (saving the product may have queued one)
+        ProductPage.objects.filter(product=self.product).delete()
+        EnrichmentData.objects.all().delete()
+        enrichment.memory.clear()
+
+    def run_concurrently(self, func):
+        """Call func from THREADS threads released at the same moment; returns results and errors"""
+        barrier = threading.Barrier(self.THREADS)
+        results, errors = [], []
+
+        def worker():
+            try:
+                barrier.wait()
+                results.append(func())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_missing_page_is_built_once(self):
+        build_document = product_pages.build_document
+
+        def slow_build(product):
+            # Long enough for every thread to miss the page
+            time.sleep(0.2)
+            return build_document(product)
+
+        with mock.patch.object(product_pages, 'build_document', side_effect=slow_build) as build:
+            results, errors = self.run_concurrently(lambda: product_pages.get_document(self.product.id))
+
+        self.assertEqual(errors, [])
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(len(results), self.THREADS)
+        self.assertTrue(all(document['product']['id'] == self.product.id for document in results))
+        self.assertEqual(ProductPage.objects.filter(product=self.product).count(), 1)
+
+    def test_missing_weather_is_fetched_once(self):
+        def slow_fetch(city):
+            time.sleep(0.2)
+            return {'success': True, 'city': city, 'temperature_celsius': 20}
+
+        fetcher = mock.Mock(side_effect=slow_fetch)
+        with mock.patch.dict(enrichment.FETCHERS, {EnrichmentData.WEATHER: fetcher}):
+            results, errors = self.run_concurrently(
+                lambda: enrichment.get(EnrichmentData.WEATHER, self.product.location)
+            )
+
+        self.assertEqual(errors, [])
+        self.assertEqual(fetcher.call_count, 1)
+        self.assertEqual(len(results), self.THREADS)
+        self.assertTrue(all(data['temperature_celsius'] == 20 for data in results))
+
+
+class FakeClock:
+    """Stands in for the time module in store/ratelimit.py"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+# Checkout: 5 requests at once, then one every 5 seconds
+@override_settings(RATE_LIMITS={'checkout': (0.2, 5)}, RATE_LIMIT_CACHE=None)
+class RateLimitTests(TestCase):
+    """Bursts against RateLimitMiddleware (store/middleware.py)"""
+
+    def setUp(self):
+        # Starts at a window boundary, for CacheBuckets
+        self.clock = FakeClock(now=25.0 * 1000)
+        patcher = mock.patch.object(ratelimit, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # The shared load monitor mustn't keep fake times
+        patcher = mock.patch.object(middleware, 'load', ratelimit.LoadMonitor())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = self.new_client()
+
+    def new_client(self):
+        """A client with a session (from the cart API); a new client loads the middleware, with empty buckets"""
+        client = Client()
+        client.get('/api/cart/')
+        return client
+
+    def checkout(self, ip):
+        return self.client.post('/api/checkout/', '{}', content_type='application/json', REMOTE_ADDR=ip)
+
+    def assertBurstLimited(self, ip):
+        for _ in range(5):
+            # Served, the cart is empty
+            self.assertEqual(self.checkout(ip).status_code, 400)
+        response = self.checkout(ip)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertFalse(response.json()['success'])
+        return response
+
+    def test_burst_over_limit_gets_429(self):
+        response = self.assertBurstLimited('10.0.0.1')
+        self.assertEqual(response['Retry-After'], '5')
+
+    def test_other_ip_is_not_limited(self):
+        self.assertBurstLimited('10.0.0.1')
+        self.assertEqual(self.checkout('10.0.0.2').status_code, 400)
+        self.assertEqual(self.checkout('10.0.0.1').status_code, 429)
+
+    def test_bucket_refills(self):
+        self.assertBurstLimited('10.0.0.1')
+        self.clock.now += 4
+        self.assertEqual(self.checkout('10.0.0.1').status_code, 429)
+        # One token every 5 seconds
+        self.clock.now += 1
+        self.assertEqual(self.checkout('10.0.0.1').status_code, 400)
+        self.assertEqual(self.checkout('10.0.0.1').status_code, 429)
+        # Never more than the burst
+        self.clock.now += 3600
+        self.assertBurstLimited('10.0.0.1')
+
+    @override_settings(
+        CACHES={'ratelimit': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'ratelimit-tests'}},
+        RATE_LIMIT_CACHE='ratelimit',
+    )
+    def test_cache_buckets(self):
+        self.client = self.new_client()
+        self.assertIsInstance(ratelimit.get_buckets(), ratelimit.CacheBuckets)
+        self.assertBurstLimited('10.0.0.1')
+        self.assertEqual(self.checkout('10.0.0.2').status_code, 400)
+        # A new window of burst / rate = 25 seconds
+        self.clock.now += 25
+        self.assertBurstLimited('10.0.0.1')
+
+
+@override_settings(RATE_LIMITS={}, LOAD_SHED_MAX_IN_FLIGHT=10, LOAD_SHED_LATENCY_MS=2000)
+class LoadSheddingTests(TestCase):
+    """LoadSheddingMiddleware turns away search while carts and checkout are served"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(ratelimit, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(middleware, 'load', ratelimit.LoadMonitor())
+        self.load = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertServesCartAndCheckout(self):
+        self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+        # Served, the cart is empty
+        self.assertEqual(self.client.post('/api/checkout/', '{}', content_type='application/json').status_code, 400)
+
+    def test_not_overloaded(self):
+        self.assertIsNone(self.load.overloaded())
+        self.assertEqual(self.client.get('/search/').status_code, 200)
+
+    def test_too_many_requests_in_progress(self):
+        for _ in range(11):
+            self.load.start()
+        self.assertIsNotNone(self.load.overloaded())
+
+        response = self.client.get('/search/', {'query': 'shirt'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertEqual(self.client.get('/api/search/', {'query': 'shirt'}).status_code, 503)
+        self.assertServesCartAndCheckout()
+
+        for _ in range(11):
+            self.load.finish()
+        self.assertEqual(self.client.get('/search/').status_code, 200)
+
+    def test_slow_responses(self):
+        for _ in range(50):
+            self.load.start()
+            self.load.finish(5.0)
+        self.assertIsNotNone(self.load.overloaded())
+        self.assertEqual(self.client.get('/search/', {'query': 'shirt'}).status_code, 503)
+        self.assertServesCartAndCheckout()
+
+        # The average decays without new requests, shedding stops on its own
+        self.clock.now += 60
+        self.assertIsNone(self.load.overloaded())
+        self.assertEqual(self.client.get('/search/', {'query': 'shirt'}).status_code, 200)
+
+
+@override_settings(RATE_LIMITS={'get_cart': (0.2, 2)}, RATE_LIMIT_CACHE=None, LOAD_SHED_MAX_IN_FLIGHT=10)
+class AsyncMiddlewareTests(TestCase):
+    """
+    The middleware stack in async mode (AsyncClient, as under ASGI): requests to the async
+    views aren't handed to a thread that waits for them, and the limits still apply
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(middleware, 'load', ratelimit.LoadMonitor())
+        self.load = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_cart_request_holds_no_thread(self):
+        waits = []
+        async_to_sync_call = AsyncToSync.__call__
+
+        def counting(adapter, *args, **kwargs):
+            waits.append(adapter.awaitable)
+            return async_to_sync_call(adapter, *args, **kwargs)
+
+        with mock.patch.object(AsyncToSync, '__call__', counting):
+            response = await AsyncClient().get('/api/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(waits, [])
+
+    async def test_rate_limit(self):
+        client = AsyncClient()
+        for _ in range(2):
+            self.assertEqual((await client.get('/api/cart/')).status_code, 200)
+        response = await client.get('/api/cart/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '5')
+
+    async def test_load_shedding(self):
+        client = AsyncClient()
+        for _ in range(11):
+            self.load.start()
+        self.assertEqual((await client.get('/api/search/', {'query': 'shirt'})).status_code, 503)
+        self.assertEqual((await client.get('/api/cart/')).status_code, 200)
+        # Requests are counted while awaited and let go when done
+        self.assertEqual(self.load.in_flight, 11)
+
+
+class ReplicaTests(TransactionTestCase):
+    """
+    PrimaryReplicaRouter and ReplicaPinMiddleware with two local databases: the test
+    database as the primary and a SQLite file as the replica. The replica's product has
+    another name, so responses show which database they were read from. Not a TestCase:
+    its transaction would keep every read on the primary.
+    """
+
+    REPLICA = 'replica_tests'
+    DOWN = 'replica_tests_down'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        # Added after the test case set up its database checks, which would block them
+        for alias, name in ((cls.REPLICA, os.path.join(cls.directory, 'replica.sqlite3')),
+                            (cls.DOWN, os.path.join(cls.directory, 'missing', 'replica.sqlite3'))):
+            connections.settings[alias] = connections.configure_settings({
+                'default': dict(connections.settings['default']),
+                alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name},
+            })[alias]
+        # Replicas get their schema from the primary, the router doesn't migrate them
+        with override_settings(DATABASE_ROUTERS=[]):
+            call_command('migrate', database=cls.REPLICA, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in (cls.REPLICA, cls.DOWN):
+            connections[alias].close()
+            del connections.settings[alias]
+        shutil.rmtree(cls.directory)
+        super().tearDownClass()
+
+    def setUp(self):
+        for database, name in (('default', "Primary Hoodie"), (self.REPLICA, "Replica Hoodie")):
+            Product.objects.using(database).all().delete()
+            Category.objects.using(database).all().delete()
+            category = Category.objects.using(database).create(id=1, name="Apparel")
+            Product.objects.using(database).create(
+                id=1, name=name, description="Warm hoodie", price=40, category=category
+            )
+        patcher = mock.patch.object(routers, 'health', routers.ReplicaHealth())
+        self.health = patcher.start()
+        self.addCleanup(patcher.stop)
+        overrides = override_settings(DATABASE_REPLICAS=[self.REPLICA], RATE_LIMITS={}, TASKS_EAGER=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def product_names(self):
+        """Names of the products on the home page"""
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        return [name for name in ("Primary Hoodie", "Replica Hoodie") if name in content]
+
+    def test_catalog_get_reads_replica(self):
+        self.assertEqual(self.product_names(), ["Replica Hoodie"])
+        self.assertNotIn(middleware.REPLICA_PIN_COOKIE, self.client.cookies)
+
+        token = routers.start_request(pinned=False)
+        try:
+            self.assertEqual(Product.objects.get(id=1).name, "Replica Hoodie")
+            # Carts are not catalog data
+            self.assertEqual(routers.PrimaryReplicaRouter().db_for_read(Cart), 'default')
+        finally:
+            routers.end_request(token)
+
+    def test_outside_requests_reads_primary(self):
+        self.assertEqual(Product.objects.get(id=1).name, "Primary Hoodie")
+
+    def test_write_goes_to_primary_and_pins(self):
+        response = self.client.post('/api/reviews/add/', json.dumps({
+            'product_id': 1, 'username': 'willie', 'rating': 5, 'comment': 'Great',
+        }), content_type='application/json')
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(Review.objects.using('default').count(), 1)
+        self.assertEqual(Review.objects.using(self.REPLICA).count(), 0)
+
+        cookie = response.cookies[middleware.REPLICA_PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], 5)
+        # The session reads its write from the primary while pinned
+        self.assertEqual(self.product_names(), ["Primary Hoodie"])
+        del self.client.cookies[middleware.REPLICA_PIN_COOKIE]
+        self.assertEqual(self.product_names(), ["Replica Hoodie"])
+
+    async def test_async_write_pins(self):
+        response = await AsyncClient().post('/api/reviews/add/', json.dumps({
+            'product_id': 1, 'username': 'willie', 'rating': 5, 'comment': 'Great',
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(middleware.REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_write_pins_rest_of_request(self):
+        token = routers.start_request(pinned=False)
+        try:
+            self.assertEqual(Product.objects.get(id=1).name, "Replica Hoodie")
+            Product.objects.filter(id=1).update(price=45)
+            self.assertEqual(Product.objects.get(id=1).name, "Primary Hoodie")
+        finally:
+            self.assertTrue(routers.end_request(token))
+
+    def test_cache_writes_dont_pin(self):
+        token = routers.start_request(pinned=False)
+        try:
+            EnrichmentData.objects.create(
+                source=EnrichmentData.WEATHER, key='manhattan', data={}, fetched_at=timezone.now(), used_at=timezone.now()
+            )
+        finally:
+            self.assertFalse(routers.end_request(token))
+
+    def test_pinned_session_reads_primary(self):
+        self.client.cookies[middleware.REPLICA_PIN_COOKIE] = '1'
+        self.assertEqual(self.product_names(), ["Primary Hoodie"])
+
+    def test_atomic_block_reads_primary(self):
+        token = routers.start_request(pinned=False)
+        try:
+            with transaction.atomic():
+                self.assertEqual(Product.objects.get(id=1).name, "Primary Hoodie")
+            self.assertEqual(Product.objects.get(id=1).name, "Replica Hoodie")
+        finally:
+            routers.end_request(token)
+
+    def test_unreachable_replica_falls_back(self):
+        clock = FakeClock()
+        ensure_connection = connections[self.DOWN].ensure_connection
+        with override_settings(DATABASE_REPLICAS=[self.DOWN], REPLICA_RETRY_SECONDS=30), \
+                mock.patch.object(routers, 'time', clock), \
+                mock.patch.object(connections[self.DOWN], 'ensure_connection', side_effect=ensure_connection) as connect:
+            self.assertEqual(self.product_names(), ["Primary Hoodie"])
+            self.assertEqual(connect.call_count, 1)
+
+            # Skipped without trying while it is marked down
+            clock.now += 29
+            self.assertEqual(self.product_names(), ["Primary Hoodie"])
+            self.assertEqual(connect.call_count, 1)
+
+            clock.now += 1
+            self.assertEqual(self.product_names(), ["Primary Hoodie"])
+            self.assertEqual(connect.call_count, 2)
+
+        # A reachable replica next to it is still used
+        with override_settings(DATABASE_REPLICAS=[self.DOWN, self.REPLICA]):
+            for _ in range(5):
+                self.assertEqual(self.product_names(), ["Replica Hoodie"])
+
+
+class SuggestIndexTests(TestCase):
+    """A stale suggest index keeps answering while it is rebuilt once in the background"""
+
+    ROWS = [(1, "Wildcat Hoodie", None, "Apparel"), (2, "Wilbur Cap", "pikachu", "Accessories")]
+
+    def setUp(self):
+        self.index = SuggestIndex()
+        self.index.build(self.ROWS, {})
+        self.index._stale = False
+
+    def test_stale_index_is_served_and_rebuilt_once(self):
+        release = threading.Event()
+        builds = []
+
+        def slow_rebuild():
+            builds.append(1)
+            release.wait(5)
+            self.index.build(self.ROWS + [(3, "Wilma Mug", None, "Gifts")], {})
+            self.index._stale = False
+
+        self.index.rebuild = slow_rebuild
+        self.index.mark_stale()
+        results, errors = [], []
+
+        def lookup():
+            try:
+                results.append([product['id'] for product in self.index.suggest('wil')])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=lookup) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Answered from the old index while the rebuild is still running
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [[2, 1]] * 50)
+
+        release.set()
+        for _ in range(500):
+            if not self.index._refreshing:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(builds), 1)
+        self.assertEqual([product['id'] for product in self.index.suggest('wil')], [2, 1, 3])
+
+    def test_saves_of_other_fields_keep_the_index(self):
+        self.index.mark_stale(sender=Product, update_fields=frozenset(('rating', 'updated_at')))
+        self.assertFalse(self.index._stale)
+        self.index.mark_stale(sender=Product, update_fields=frozenset(('name',)))
+        self.assertTrue(self.index._stale)
+
+    def test_review_doesnt_mark_the_index_stale(self):
+        from .suggest import suggest_index
+        category = Category.objects.create(name="Apparel")
+        product = Product.objects.create(name="Wildcat Hoodie", description="Warm", price=40, category=category)
+        suggest_index._stale = False
+        Review.objects.create(product=product, username="willie", rating=5, comment="Great")
+        product.update_rating()
+        self.assertFalse(suggest_index._stale)
+        product.name = "Wildcat Zip Hoodie"
+        product.save()
+        self.assertTrue(suggest_index._stale)
+
+
+class CatalogTests(TestCase):
+    """Product writes swap in a new catalog snapshot instead of changing the one searches use"""
+
+    def setUp(self):
+        state = dict(catalog.__dict__)
+        self.addCleanup(catalog.__dict__.update, state)
+        self.category = Category.objects.create(name="Apparel")
+        self.hoodie = Product.objects.create(name="Wildcat Hoodie", description="Warm", price=40, category=self.category)
+        self.cap = Product.objects.create(name="Wilbur Cap", description="Red", price=20, category=self.category)
+        catalog.rebuild()
+
+    def search(self, **filters):
+        return [product.id for product in catalog.search(sort='price-asc', **filters)[:10]]
+
+    def test_price_change_swaps_snapshot(self):
+        before = catalog.columns()
+        row = before.row(self.cap.id)
+        self.cap.price = 60
+        self.cap.save()
+
+        self.assertIsNot(catalog.columns(), before)
+        self.assertEqual(before.prices[row], 20)
+        self.assertEqual(self.search(), [self.hoodie.id, self.cap.id])
+        self.assertFalse(catalog._stale)
+
+    def test_rating_update_is_searchable(self):
+        Review.objects.create(product=self.cap, username="wilma", rating=5, comment="Great")
+        self.cap.update_rating()
+        self.assertEqual(self.search(min_rating=4), [self.cap.id])
+
+    def test_description_edit_drops_text_matches(self):
+        self.assertEqual(self.search(query="fleece"), [])
+        self.hoodie.description = "Warm fleece"
+        self.hoodie.save(update_fields=['description'])
+        self.assertEqual(self.search(query="fleece"), [self.hoodie.id])
+
+    def test_delete_swaps_snapshot(self):
+        before = catalog.columns()
+        self.cap.delete()
+        self.assertTrue(before.live.all())
+        self.assertEqual(self.search(), [self.hoodie.id])
+
+    def test_search_before_first_build_uses_database(self):
+        catalog._columns = None
+        with mock.patch.object(catalog, '_refresh_in_background') as refresh:
+            self.assertEqual(self.search(max_price=30), [self.cap.id])
+            self.assertEqual(catalog.facets()['categories'], [{'name': "Apparel", 'count': 2}])
+        refresh.assert_called()
+
+    @override_settings(CATALOG_VERSION_CHECK=0)
+    def test_update_popularity_reaches_other_processes(self):
+        # The catalog of a web process; update_popularity runs in the command's process
+        web = ColumnarCatalog()
+        web.rebuild()
+        ProductViews.objects.create(product=self.cap, hour=popularity.current_hour(), views=3)
+        self.assertEqual(popularity.update_popularity(), 1)
+
+        with mock.patch.object(web, '_refresh_in_background') as refresh:
+            web.columns()
+        self.assertTrue(web._stale)
+        refresh.assert_called_once()
+
+    def test_version_check_is_throttled(self):
+        web = ColumnarCatalog()
+        web.rebuild()
+        catalog.publish_change()
+        # Built less than CATALOG_VERSION_CHECK seconds ago
+        with self.assertNumQueries(0):
+            web.columns()
+        self.assertFalse(web._stale)
+
+
+class ProductAdminTests(TestCase):
+    """Bulk actions invalidate once they are committed, stock only changes through inventory.py"""
+
+    def setUp(self):
+        state = dict(catalog.__dict__)
+        self.addCleanup(catalog.__dict__.update, state)
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(user)
+        category = Category.objects.create(name="Apparel")
+        self.product = Product.objects.create(name="Wildcat Hoodie", description="Warm", price=40, category=category)
+        ProductPage.objects.create(product=self.product, document={})
+        self.url = reverse('admin:store_product_changelist')
+
+    def action(self, action, **data):
+        return self.client.post(self.url, {
+            'action': action, ACTION_CHECKBOX_NAME: [self.product.id], 'apply': 'yes', **data,
+        })
+
+    def test_change_price_invalidates_after_commit(self):
+        catalog._stale = False
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.action('change_price', mode='set', value='25').status_code, 302)
+            # Nothing dropped until the UPDATE is committed
+            self.assertTrue(ProductPage.objects.filter(product=self.product).exists())
+            self.assertFalse(catalog._stale)
+        self.assertEqual(len(callbacks), 1)
+
+        callbacks[0]()
+        self.assertFalse(ProductPage.objects.filter(product=self.product).exists())
+        self.assertTrue(catalog._stale)
+        self.assertEqual(Watermark.objects.get(name='catalog_version').position, 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.price, 25)
+
+    def test_stock_is_set_through_inventory(self):
+        self.assertEqual(self.action('set_stock', size='M', quantity=10, shards=3).status_code, 302)
+        self.assertEqual(inventory.available(self.product.id, 'M'), 10)
+        self.assertEqual(Stock.objects.filter(product=self.product, size='M').count(), 3)
+
+        # The change page shows the stock without inputs for it
+        response = self.client.get(reverse('admin:store_product_change', args=[self.product.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'name="stock-0-quantity"')
+
+
+# Calls of the test tasks below, as (name, args)
+task_calls = []
+
+
+@tasks.task('tests.record', max_attempts=3)
+def record_task(*args):
+    task_calls.append(('record', args))
+
+
+@tasks.task('tests.fail', max_attempts=3)
+def failing_task(*args):
+    task_calls.append(('fail', args))
+    raise RuntimeError("Task failed")
+
+
+@override_settings(TASKS_EAGER=False, TASK_RETRY_DELAY=10, TASK_RETRY_MAX_DELAY=60, TASK_LOCK_TIMEOUT=600)
+class TaskQueueTests(TestCase):
+    """enqueue, claim_tasks and retries of the database task queue (store/tasks.py)"""
+
+    def setUp(self):
+        task_calls.clear()
+        Task.objects.all().delete()
+
+    def test_duplicate_is_not_queued(self):
+        with transaction.atomic():
+            tasks.enqueue(record_task, 1, dedup_key='record:1')
+            tasks.enqueue(record_task, 1, dedup_key='record:1')
+            # The IntegrityError stayed in enqueue's savepoint, the transaction goes on
+            tasks.enqueue(record_task, 2, dedup_key='record:2')
+        self.assertEqual(sorted(Task.objects.values_list('dedup_key', flat=True)), ['record:1', 'record:2'])
+
+    def test_duplicate_of_a_failed_task_is_queued(self):
+        tasks.enqueue(record_task, 1, dedup_key='record:1')
+        Task.objects.update(status='failed')
+        tasks.enqueue(record_task, 1, dedup_key='record:1')
+        self.assertEqual(Task.objects.filter(status='queued').count(), 1)
+
+    def test_claims_due_tasks_once(self):
+        tasks.enqueue(record_task, 1)
+        tasks.enqueue(record_task, 2, delay=60)
+        claimed = tasks.claim_tasks(10)
+        self.assertEqual([task_row.args for task_row in claimed], [[1]])
+        self.assertEqual((claimed[0].status, claimed[0].attempts), ('running', 1))
+        # Running tasks aren't claimed again, the delayed one isn't due
+        self.assertEqual(tasks.claim_tasks(10), [])
+
+    def test_claims_abandoned_tasks(self):
+        tasks.enqueue(record_task, 1)
+        tasks.claim_tasks(10)
+        # The worker died 11 minutes ago
+        Task.objects.update(locked_at=timezone.now() - timedelta(seconds=660))
+        claimed = tasks.claim_tasks(10)
+        self.assertEqual([task_row.attempts for task_row in claimed], [2])
+
+    def test_claims_up_to_batch_size_oldest_first(self):
+        for i in range(5):
+            tasks.enqueue(record_task, i)
+            Task.objects.filter(args=[i]).update(run_at=timezone.now() - timedelta(seconds=10 - i))
+        self.assertEqual([task_row.args for task_row in tasks.claim_tasks(3)], [[0], [1], [2]])
+
+    def test_success_deletes_the_task(self):
+        tasks.enqueue(record_task, 1)
+        self.assertEqual(tasks.run_pending(10), (1, 0))
+        self.assertEqual(task_calls, [('record', (1,))])
+        self.assertFalse(Task.objects.exists())
+
+    def test_retries_with_exponential_backoff(self):
+        tasks.enqueue(failing_task, 1)
+        delays = []
+        # Without jitter: 10s, 20s, then failed after max_attempts=3
+        with self.assertLogs('store.tasks', 'ERROR'), mock.patch.object(tasks.random, 'uniform', return_value=1.0):
+            for _ in range(2):
+                self.assertEqual(tasks.run_pending(10), (0, 1))
+                task_row = Task.objects.get()
+                self.assertEqual(task_row.status, 'queued')
+                delays.append(round((task_row.run_at - timezone.now()).total_seconds()))
+                self.assertIn("Task failed", task_row.last_error)
+                Task.objects.update(run_at=timezone.now())
+            self.assertEqual(tasks.run_pending(10), (0, 1))
+        self.assertEqual(delays, [10, 20])
+        task_row = Task.objects.get()
+        self.assertEqual((task_row.status, task_row.attempts, task_row.locked_at), ('failed', 3, None))
+        self.assertEqual(len(task_calls), 3)
+        # Failed tasks are kept, not run again
+        self.assertEqual(tasks.run_pending(10), (0, 0))
+
+    def test_backoff_is_capped(self):
+        tasks.enqueue(failing_task, 1)
+        task_row = tasks.claim_tasks(10)[0]
+        task_row.attempts = 2
+        task_row.max_attempts = 10
+        with override_settings(TASK_RETRY_MAX_DELAY=15), \
+                mock.patch.object(tasks.random, 'uniform', return_value=1.0):
+            tasks._retry_or_fail(task_row, "error")
+        delay = (Task.objects.get().run_at - timezone.now()).total_seconds()
+        self.assertAlmostEqual(delay, 15, delta=1)
+
+    def test_unknown_task_fails_at_once(self):
+        tasks.enqueue(record_task, 1)
+        Task.objects.update(name='tests.removed')
+        with self.assertLogs('store.tasks', 'ERROR'):
+            self.assertEqual(tasks.run_pending(10), (0, 1))
+        task_row = Task.objects.get()
+        self.assertEqual((task_row.status, task_row.attempts), ('failed', 1))
+        self.assertIn("Unknown task tests.removed", task_row.last_error)
+
+    def test_retry_gives_way_to_a_queued_duplicate(self):
+        tasks.enqueue(failing_task, 1, dedup_key='fail:1')
+        tasks.claim_tasks(10)
+        # Queued again while the first one ran
+        tasks.enqueue(failing_task, 1, dedup_key='fail:1')
+        task_row = Task.objects.get(status='running')
+        with self.assertLogs('store.tasks', 'ERROR'):
+            tasks.run_task(task_row)
+        self.assertEqual(list(Task.objects.values_list('status', 'attempts')), [('queued', 0)])
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager_tasks_run_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.enqueue(record_task, 1, dedup_key='record:1')
+            self.assertEqual(task_calls, [])
+        self.assertEqual(task_calls, [('record', (1,))])
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager_tasks_dont_run_after_rollback(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    tasks.enqueue(record_task, 1)
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        self.assertEqual((callbacks, task_calls), ([], []))
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager_failure_is_logged(self):
+        with self.assertLogs('store.tasks', 'ERROR') as logs, self.captureOnCommitCallbacks(execute=True):
+            tasks.enqueue(failing_task, 1)
+        self.assertIn("Task tests.fail(1,) failed: Task failed", logs.output[0])
+        self.assertFalse(Task.objects.exists())
+
+
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+@override_settings(TASKS_EAGER=False)
+class TaskLockingTests(TransactionTestCase):
+    """Workers skip the tasks another worker has locked (FOR UPDATE SKIP LOCKED)"""
+
+    def test_locked_task_is_skipped(self):
+        for i in range(3):
+            tasks.enqueue(record_task, i)
+        first = Task.objects.order_by('run_at').first()
+        locked, release = threading.Event(), threading.Event()
+
+        def other_worker():
+            try:
+                with transaction.atomic():
+                    Task.objects.select_for_update().get(id=first.id)
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=other_worker)
+        thread.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            claimed = tasks.claim_tasks(10)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(sorted(task_row.args for task_row in claimed), [[1], [2]])
+
+
+@override_settings(RATE_LIMITS={}, TASKS_EAGER=False, CART_RESERVATION_MINUTES=15)
+class InventoryTests(TestCase):
+    """Reservations and stock through the cart API, checkout and the maintenance commands (store/inventory.py)"""
+
+    def setUp(self):
+        category = Category.objects.create(name="Apparel")
+        self.product = Product.objects.create(
+            name="Wildcat Hoodie", description="Warm hoodie", price=40, category=category, location="Manhattan"
+        )
+        inventory.set_stock(self.product.id, 'M', 5)
+        # A session for the cart
+        self.client.get('/api/cart/')
+
+    def add(self, quantity):
+        return self.client.post(
+            '/api/cart/add/', json.dumps({'product_id': self.product.id, 'quantity': quantity, 'size': 'M'}),
+            content_type='application/json'
+        )
+
+    def checkout(self):
+        order = {'full_name': "Ann Lee", 'email': 'ann@example.com', 'shipping_address': "1 Main St"}
+        return self.client.post('/api/checkout/', json.dumps(order), content_type='application/json')
+
+    def test_adding_reserves_units(self):
+        self.assertEqual(self.add(2).status_code, 200)
+        self.assertEqual(self.add(1).status_code, 200)
+        item = CartItem.objects.get()
+        self.assertEqual((item.quantity, item.reserved_quantity), (3, 3))
+        self.assertEqual(inventory.available(self.product.id, 'M'), 2)
+
+    def test_out_of_stock_leaves_the_item_unchanged(self):
+        item_id = self.add(2).json()['item_id']
+        response = self.client.put(
+            f'/api/cart/update/{item_id}/', json.dumps({'quantity': 6}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 409)
+        # The 2 units it holds and the 3 left
+        self.assertEqual(response.json()['available'], 5)
+        item = CartItem.objects.get()
+        self.assertEqual((item.quantity, item.reserved_quantity), (2, 2))
+        self.assertEqual(inventory.available(self.product.id, 'M'), 3)
+
+        # Adding more than is left doesn't change it either
+        self.assertEqual(self.add(4).status_code, 409)
+        item.refresh_from_db()
+        self.assertEqual((item.quantity, item.reserved_quantity), (2, 2))
+        self.assertEqual(inventory.available(self.product.id, 'M'), 3)
+
+    def test_out_of_stock_new_item_isnt_added(self):
+        response = self.add(6)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['error'], "Only 5 left in stock")
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(inventory.available(self.product.id, 'M'), 5)
+
+    def test_removing_puts_units_back(self):
+        item_id = self.add(2).json()['item_id']
+        self.client.put(f'/api/cart/update/{item_id}/', json.dumps({'quantity': 1}), content_type='application/json')
+        self.assertEqual(inventory.available(self.product.id, 'M'), 4)
+        self.client.delete(f'/api/cart/remove/{item_id}/')
+        self.assertEqual(inventory.available(self.product.id, 'M'), 5)
+
+    def expire_reservations(self):
+        CartItem.objects.update(reserved_until=timezone.now() - timedelta(minutes=1))
+        out = io.StringIO()
+        call_command('release_reservations', stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Released 1 expired reservations")
+
+    def test_expired_reservation_is_taken_again_at_checkout(self):
+        self.add(2)
+        self.expire_reservations()
+        item = CartItem.objects.get()
+        self.assertEqual((item.quantity, item.reserved_quantity, item.reserved_until), (2, 0, None))
+        self.assertEqual(inventory.available(self.product.id, 'M'), 5)
+
+        response = self.checkout()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get().items.get().quantity, 2)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(inventory.available(self.product.id, 'M'), 3)
+
+    def test_checkout_fails_when_released_units_sold_out(self):
+        self.add(2)
+        self.expire_reservations()
+        # Another shopper bought them meanwhile
+        self.assertTrue(inventory.take(self.product.id, 'M', 4))
+
+        response = self.checkout()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['available'], 1)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.get().quantity, 2)
+        self.assertEqual(inventory.available(self.product.id, 'M'), 1)
+
+    def test_unexpired_reservation_is_kept(self):
+        self.add(2)
+        self.assertEqual(inventory.release_expired(100), 0)
+        self.assertEqual(CartItem.objects.get().reserved_quantity, 2)
+        self.assertEqual(inventory.available(self.product.id, 'M'), 3)
+
+    def test_purging_stale_carts_puts_units_back(self):
+        self.add(2)
+        Cart.objects.update(updated_at=timezone.now() - timedelta(days=31))
+        call_command('purge_stale_carts', days=30, skip_sessions=True, stdout=io.StringIO())
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(inventory.available(self.product.id, 'M'), 5)
+
+    def test_take_across_shards(self):
+        inventory.set_stock(self.product.id, 'M', 4, shards=4)
+        self.assertEqual(list(Stock.objects.values_list('quantity', flat=True)), [1, 1, 1, 1])
+        # No shard holds 3 on its own
+        self.assertTrue(inventory.take(self.product.id, 'M', 3))
+        self.assertFalse(inventory.take(self.product.id, 'M', 2))
+        self.assertEqual(inventory.available(self.product.id, 'M'), 1)
+
+    def test_untracked_products_sell_without_limit(self):
+        Stock.objects.all().delete()
+        self.assertEqual(self.add(100).status_code, 200)
+        self.assertEqual(CartItem.objects.get().reserved_quantity, 0)
+        self.assertEqual(self.checkout().status_code, 200)
+
+
+class StockConcurrencyTests(TransactionTestCase):
+    """Concurrent checkouts never take more units than the shards hold"""
+
+    THREADS = 60
+
+    def test_no_overselling_across_shards(self):
+        category = Category.objects.create(name="Apparel")
+        product = Product.objects.create(
+            name="Wildcat Hoodie", description="Warm hoodie", price=40, category=category, location="Manhattan"
+        )
+        inventory.set_stock(product.id, 'M', 25, shards=4)
+        barrier = threading.Barrier(self.THREADS)
+        results, errors = [], []
+
+        def worker():
+            try:
+                barrier.wait()
+                results.append(inventory.take(product.id, 'M', 1))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results.count(True), 25)
+        self.assertEqual(results.count(False), self.THREADS - 25)
+        self.assertEqual(list(Stock.objects.values_list('quantity', flat=True)), [0, 0, 0, 0])
+
+
+@override_settings(RATE_LIMITS={}, TASKS_EAGER=False, MAX_REVIEWS_PER_PAGE=4)
+class ReviewPaginationTests(TestCase):
+    """Keyset pages of the reviews API (store/reviews.py) and the summary on the first page"""
+
+    def setUp(self):
+        category = Category.objects.create(name="Apparel")
+        self.product = Product.objects.create(
+            name="Wildcat Hoodie", description="Warm hoodie", price=40, category=category, location="Manhattan"
+        )
+        for i, rating in enumerate([5, 4, 4, 3, 5, 1, 2]):
+            Review.objects.create(product=self.product, username=f"user{i}", rating=rating, comment="Nice")
+        # Five reviews posted in the same instant, pages have to split them by id
+        now = timezone.now()
+        ids = list(Review.objects.order_by('id').values_list('id', flat=True))
+        Review.objects.filter(id__in=ids[:5]).update(created_at=now - timedelta(hours=1))
+        Review.objects.filter(id__in=ids[5:]).update(created_at=now)
+        self.newest_first = ids[:4:-1] + ids[4::-1]
+
+    def get(self, product_id=None, **params):
+        return self.client.get(f'/api/products/{product_id or self.product.id}/reviews/', params)
+
+    def test_pages_split_ties_without_gaps_or_repeats(self):
+        seen, cursor, pages = [], None, 0
+        while True:
+            params = {'limit': 2, 'cursor': cursor} if cursor else {'limit': 2}
+            data = self.get(**params).json()
+            # Only the first page has the summary
+            self.assertEqual('summary' in data, not cursor)
+            seen += [review['id'] for review in data['reviews']]
+            pages += 1
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, self.newest_first)
+        self.assertEqual(pages, 4)
+
+    def test_last_full_page_has_no_cursor(self):
+        self.assertIsNone(reviews.get_page(self.product.id, 7)[1])
+        page, cursor = reviews.get_page(self.product.id, 6)
+        self.assertEqual(reviews.decode_cursor(cursor), (page[-1].created_at, page[-1].id))
+
+    def test_bad_cursor_is_400(self):
+        bad = [
+            'not base64!',
+            base64.urlsafe_b64encode(b'no separator').decode(),
+            base64.urlsafe_b64encode(b'yesterday|12').decode(),
+            base64.urlsafe_b64encode(b'2024-01-01T00:00:00+00:00|twelve').decode(),
+            base64.urlsafe_b64encode(b'\xff\xfe|1').decode(),
+        ]
+        for cursor in bad:
+            with self.subTest(cursor=cursor):
+                response = self.get(cursor=cursor)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['error'], "Invalid cursor")
+
+    def test_unknown_product_is_404(self):
+        response = self.get(product_id=self.product.id + 1000)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.json()['success'])
+
+    def test_limit_is_clamped(self):
+        self.assertEqual(len(self.get(limit=0).json()['reviews']), 1)
+        self.assertEqual(len(self.get(limit=-5).json()['reviews']), 1)
+        self.assertEqual(len(self.get(limit=1000).json()['reviews']), 4)
+        self.assertEqual(self.get(limit='ten').status_code, 400)
+
+    @override_settings(TASKS_EAGER=True)
+    def test_summary_is_refreshed_by_recompute_rating(self):
+        summary = self.get().json()['summary']
+        self.assertEqual(summary, {
+            'count': 7, 'average': 3.43, 'stars': {'1': 1, '2': 1, '3': 1, '4': 2, '5': 2}
+        })
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/reviews/add/', json.dumps({
+                'product_id': self.product.id, 'username': "user7", 'rating': 1, 'comment': "Too small"
+            }), content_type='application/json')
+        self.assertTrue(response.json()['success'])
+        data = self.get(limit=1).json()
+        self.assertEqual(data['summary'], {
+            'count': 8, 'average': 3.12, 'stars': {'1': 2, '2': 1, '3': 1, '4': 2, '5': 2}
+        })
+        self.assertEqual(data['reviews'][0]['username'], "user7")
+        self.product.refresh_from_db()
+        self.assertAlmostEqual(float(self.product.rating), 3.12, places=1)
+
+
+@override_settings(LIKES_BUFFER_MAX=100)
+class LikeBufferTests(TestCase):
+    """Write-behind likes (store/likes.py): what a flush writes and what it keeps"""
+
+    def setUp(self):
+        category = Category.objects.create(name="Apparel")
+        self.products = [
+            Product.objects.create(
+                name=f"Wildcat Shirt {i}", description="Soft shirt", price=20, category=category, location="Manhattan"
+            )
+            for i in range(3)
+        ]
+        # Flushes run here, in the test's transaction, not in the buffer's thread
+        patcher = mock.patch.object(likes.Flusher, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = likes.LikeBuffer(flush_interval=60)
+
+    def counters(self):
+        return dict(ProductStats.objects.values_list('product_id', 'likes'))
+
+    def test_toggles_collapse_between_flushes(self):
+        product_id = self.products[0].id
+        for liked in (True, False, True, False, True):
+            self.assertTrue(self.buffer.set(product_id, 'ann', liked))
+        self.assertEqual(len(self.buffer), 1)
+        self.assertEqual(self.buffer.flush(), (1, 0))
+        self.assertEqual(self.counters(), {product_id: 1})
+
+        # Unliking and liking again writes nothing
+        self.buffer.set(product_id, 'ann', False)
+        self.buffer.set(product_id, 'ann', True)
+        self.assertEqual(self.buffer.flush(), (0, 0))
+        self.assertEqual(ProductLike.objects.count(), 1)
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_counters_match_like_rows(self):
+        rng = random.Random(1)
+        for _ in range(3):
+            for _ in range(60):
+                self.buffer.set(rng.choice(self.products).id, f"visitor{rng.randrange(20)}", rng.random() < 0.7)
+            self.buffer.flush()
+            rows = dict(ProductLike.objects.values('product_id').annotate(count=Count('id')).values_list('product_id', 'count'))
+            self.assertEqual({k: v for k, v in self.counters().items() if v}, rows)
+        # Nothing for recount to correct
+        counters = self.counters()
+        likes.recount()
+        self.assertEqual(self.counters(), counters)
+
+    def test_state_includes_unwritten_choices(self):
+        product_id = self.products[0].id
+        self.buffer.set(product_id, 'ann', True)
+        self.buffer.set(product_id, 'bob', True)
+        self.buffer.flush()
+        self.buffer.set(product_id, 'ann', False)
+        self.buffer.set(product_id, 'cid', True)
+        with mock.patch.object(likes, 'buffer', self.buffer):
+            self.assertEqual(likes.get_state(product_id, 'ann'), (False, 2))
+            self.assertEqual(likes.get_state(product_id, 'cid'), (True, 2))
+            self.assertEqual(likes.get_state(product_id, 'dan'), (False, 2))
+
+    def test_failed_flush_keeps_newer_choices(self):
+        product_id = self.products[0].id
+        self.buffer.set(product_id, 'ann', True)
+        self.buffer.set(product_id, 'bob', True)
+
+        def failing_apply(choices):
+            # Ann changes her mind while the flush runs
+            self.buffer.set(product_id, 'ann', False)
+            raise DatabaseError("Database is down")
+
+        with mock.patch.object(likes, 'apply', failing_apply), self.assertLogs('store.likes', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), (0, 0))
+        self.assertEqual(self.buffer.pending_for(product_id), {'ann': False, 'bob': True})
+        self.assertEqual(len(self.buffer), 2)
+        self.assertFalse(ProductLike.objects.exists())
+
+        # Written by the next flush
+        self.assertEqual(self.buffer.flush(), (1, 0))
+        self.assertEqual(list(ProductLike.objects.values_list('session_id', flat=True)), ['bob'])
+
+    @override_settings(LIKES_BUFFER_MAX=4)
+    def test_full_buffer_refuses_new_choices(self):
+        product_id = self.products[0].id
+        for session_id in ('ann', 'bob', 'cid', 'dan'):
+            self.assertTrue(self.buffer.set(product_id, session_id, True))
+        self.assertFalse(self.buffer.set(product_id, 'eve', True))
+        self.assertFalse(self.buffer.set(self.products[1].id, 'ann', True))
+        # Changing a waiting choice takes no room
+        self.assertTrue(self.buffer.set(product_id, 'ann', False))
+        self.assertEqual(len(self.buffer), 4)
+
+        self.buffer.flush()
+        self.assertTrue(self.buffer.set(product_id, 'eve', True))
+
+    @override_settings(LIKES_BUFFER_MAX=3)
+    def test_failed_flush_drops_what_doesnt_fit(self):
+        product_id = self.products[0].id
+        for session_id in ('ann', 'bob', 'cid'):
+            self.buffer.set(product_id, session_id, True)
+
+        def failing_apply(choices):
+            # Newer choices fill the buffer meanwhile
+            self.buffer.set(product_id, 'dan', True)
+            self.buffer.set(product_id, 'eve', True)
+            raise DatabaseError("Database is down")
+
+        with mock.patch.object(likes, 'apply', failing_apply), self.assertLogs('store.likes', 'ERROR') as logs:
+            self.buffer.flush()
+        self.assertEqual(len(self.buffer), 3)
+        self.assertEqual(set(self.buffer.pending_for(product_id)), {'ann', 'dan', 'eve'})
+        self.assertIn("Dropped 2 of those likes", logs.output[-1])
+
+    def test_without_interval_likes_are_written_at_once(self):
+        buffer = likes.LikeBuffer(flush_interval=0)
+        self.assertTrue(buffer.set(self.products[0].id, 'ann', True))
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.counters(), {self.products[0].id: 1})
+
+
+@override_settings(RATE_LIMITS={}, TASKS_EAGER=False, ENRICHMENT_NOT_FOUND_TTL=600)
+class EnrichmentTests(TestCase):
+    """Stored third-party data (store/enrichment.py): memory and table tiers, expiry, misses and warm_enrichment"""
+
+    def setUp(self):
+        enrichment.memory.clear()
+        self.addCleanup(enrichment.memory.clear)
+
+    def fetchers(self, pokemon=None, weather=None):
+        return mock.patch.dict(enrichment.FETCHERS, {
+            EnrichmentData.POKEMON: mock.Mock(side_effect=pokemon),
+            EnrichmentData.WEATHER: mock.Mock(side_effect=weather),
+        })
+
+    def pokemon(self, name):
+        if name == 'missingno':
+            raise enrichment.NotFound(f"Pokemon '{name}' not found")
+        return {'success': True, 'name': name.capitalize()}
+
+    def test_not_found_is_stored(self):
+        with self.fetchers(pokemon=self.pokemon):
+            for _ in range(3):
+                response = self.client.get('/api/pokemon/MissingNo/')
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json()['error'], "Pokemon 'missingno' not found")
+            # Answered from memory, then from the table
+            enrichment.memory.clear()
+            with self.assertRaises(enrichment.NotFound):
+                enrichment.get(EnrichmentData.POKEMON, 'missingno')
+            self.assertEqual(enrichment.FETCHERS[EnrichmentData.POKEMON].call_count, 1)
+        self.assertEqual(
+            EnrichmentData.objects.get(key='missingno').data, {'success': False, 'error': "Pokemon 'missingno' not found"}
+        )
+
+    def test_not_found_is_asked_again_after_its_ttl(self):
+        with self.fetchers(pokemon=self.pokemon):
+            with self.assertRaises(enrichment.NotFound):
+                enrichment.get(EnrichmentData.POKEMON, 'missingno')
+        # Past ENRICHMENT_NOT_FOUND_TTL and the stale period, and the API knows it now
+        EnrichmentData.objects.update(fetched_at=timezone.now() - timedelta(seconds=600 + 3600 + 1))
+        enrichment.memory.clear()
+        with self.fetchers(pokemon=lambda name: {'success': True, 'name': "Missingno"}):
+            self.assertEqual(enrichment.get(EnrichmentData.POKEMON, 'missingno')['name'], "Missingno")
+        self.assertTrue(EnrichmentData.objects.get(key='missingno').data['success'])
+
+    def test_other_errors_arent_stored(self):
+        with self.fetchers(weather=RuntimeError("API down")), self.assertLogs('store.api_views', 'ERROR'):
+            self.assertEqual(self.client.get('/api/weather/Boston/').status_code, 500)
+        self.assertFalse(EnrichmentData.objects.exists())
+
+    def test_warm_command(self):
+        category = Category.objects.create(name="Apparel")
+        for pokemon, location in (('Pikachu', 'Boston'), ('MissingNo', 'Boston'), ('pikachu ', 'Atlantis')):
+            Product.objects.create(
+                name=f"{pokemon} Shirt", description="Soft shirt", price=20, category=category,
+                pokemon=pokemon, location=location
+            )
+
+        def weather(city):
+            if city == 'atlantis':
+                raise RuntimeError("API down")
+            return {'success': True, 'city': city.capitalize(), 'temperature_celsius': 20}
+
+        out = io.StringIO()
+        with self.fetchers(pokemon=self.pokemon, weather=weather) as fetchers, self.assertLogs('store.enrichment', 'ERROR'):
+            pokemon_fetcher, weather_fetcher = fetchers[EnrichmentData.POKEMON], fetchers[EnrichmentData.WEATHER]
+            call_command('warm_enrichment', concurrency=2, stdout=out)
+            self.assertEqual(out.getvalue().strip(), "Fetched 2 entries (1 not found, 1 failed)")
+            self.assertEqual(
+                sorted(EnrichmentData.objects.values_list('source', 'key')),
+                [('pokemon', 'missingno'), ('pokemon', 'pikachu'), ('weather', 'boston')]
+            )
+
+            # Only what is missing or expired is fetched again
+            call_command('warm_enrichment', concurrency=2, stdout=out)
+            self.assertEqual(out.getvalue().strip().splitlines()[-1], "Fetched 0 entries (0 not found, 1 failed)")
+            call_command('warm_enrichment', source='pokemon', force=True, stdout=out)
+            self.assertEqual(out.getvalue().strip().splitlines()[-1], "Fetched 1 entries (1 not found, 0 failed)")
+        self.assertEqual((pokemon_fetcher.call_count, weather_fetcher.call_count), (4, 3))
+
+        # Pages are served from the table
+        with self.fetchers() as fetchers:
+            self.assertEqual(enrichment.get(EnrichmentData.WEATHER, 'Boston')['temperature_celsius'], 20)
+            self.assertFalse(fetchers[EnrichmentData.WEATHER].called)
+
+    def test_warm_command_validates_concurrency(self):
+        with self.assertRaises(CommandError):
+            call_command('warm_enrichment', concurrency=0)
+
+    def entry(self, key, data=None, age=0, used=0, source=EnrichmentData.WEATHER):
+        """A stored entry fetched `age` and last read `used` seconds ago"""
+        now = timezone.now()
+        return EnrichmentData.objects.create(
+            source=source, key=key, data=data or {'success': True, 'city': key},
+            fetched_at=now - timedelta(seconds=age), used_at=now - timedelta(seconds=used)
+        )
+
+    @override_settings(ENRICHMENT_MEMORY_SIZE=2)
+    def test_memory_hit_is_kept_longest(self):
+        tier = enrichment.MemoryTier()
+        now = timezone.now()
+        tier.put('weather', 'boston', {'city': "Boston"}, now)
+        tier.put('weather', 'denver', {'city': "Denver"}, now)
+        self.assertEqual(tier.get('weather', 'boston'), ({'city': "Boston"}, now))
+        # Over capacity, the least recently read goes
+        tier.put('weather', 'austin', {'city': "Austin"}, now)
+        self.assertIsNone(tier.get('weather', 'denver'))
+        self.assertIsNotNone(tier.get('weather', 'boston'))
+        self.assertIsNotNone(tier.get('weather', 'austin'))
+
+    @override_settings(ENRICHMENT_MEMORY_SIZE=2)
+    def test_memory_preloads_most_recently_used(self):
+        self.entry('boston', used=10)
+        self.entry('denver', used=3000)
+        self.entry('austin', used=20)
+        tier = enrichment.MemoryTier()
+        tier.preload()
+        self.assertIsNotNone(tier.get('weather', 'boston'))
+        self.assertIsNotNone(tier.get('weather', 'austin'))
+        self.assertIsNone(tier.get('weather', 'denver'))
+
+    @override_settings(ENRICHMENT_MAX_ENTRIES=3)
+    def test_table_evicts_least_used(self):
+        for i, key in enumerate(['a', 'b', 'c', 'd']):
+            self.entry(key, used=100 - i)
+        with self.fetchers(weather=lambda city: {'success': True, 'city': city}):
+            enrichment.get(EnrichmentData.WEATHER, 'e')
+        self.assertEqual(sorted(EnrichmentData.objects.values_list('key', flat=True)), ['c', 'd', 'e'])
+
+    @override_settings(ENRICHMENT_MAX_ENTRIES=2, ENRICHMENT_TOUCH_INTERVAL=3600)
+    def test_reads_keep_entries_from_eviction(self):
+        self.entry('boston', used=7200)
+        self.entry('denver', used=60)
+        # Read from the table, its used_at was older than ENRICHMENT_TOUCH_INTERVAL
+        self.assertEqual(enrichment.get(EnrichmentData.WEATHER, 'boston')['city'], 'boston')
+        self.entry('austin', used=30)
+        enrichment.evict_least_used()
+        self.assertEqual(sorted(EnrichmentData.objects.values_list('key', flat=True)), ['austin', 'boston'])
+
+    @override_settings(ENRICHMENT_TTL={'pokemon': None, 'weather': 1800}, ENRICHMENT_STALE_SECONDS=3600)
+    def test_stale_entry_is_served_while_refreshed(self):
+        self.entry('boston', {'success': True, 'city': "Boston", 'temperature_celsius': 10}, age=2000)
+        with mock.patch.object(enrichment, '_refreshes', Throttle(60)), \
+                self.fetchers(weather=lambda city: {'success': True, 'city': "Boston", 'temperature_celsius': 25}) as fetchers:
+            for _ in range(3):
+                self.assertEqual(enrichment.get(EnrichmentData.WEATHER, 'Boston')['temperature_celsius'], 10)
+            self.assertFalse(fetchers[EnrichmentData.WEATHER].called)
+            # One refresh queued for all of them
+            self.assertEqual(list(Task.objects.values_list('name', 'args')), [('store.refresh_enrichment', ['weather', 'boston'])])
+
+            self.assertEqual(tasks.run_pending(10), (1, 0))
+            self.assertEqual(enrichment.get(EnrichmentData.WEATHER, 'Boston')['temperature_celsius'], 25)
+            self.assertEqual(fetchers[EnrichmentData.WEATHER].call_count, 1)
+
+    @override_settings(ENRICHMENT_TTL={'pokemon': None, 'weather': 1800}, ENRICHMENT_STALE_SECONDS=3600)
+    def test_too_stale_entry_is_fetched_or_served_on_error(self):
+        self.entry('boston', {'success': True, 'city': "Boston", 'temperature_celsius': 10}, age=6000)
+        with self.fetchers(weather=RuntimeError("API down")), self.assertLogs('store.enrichment', 'WARNING'):
+            self.assertEqual(enrichment.get(EnrichmentData.WEATHER, 'Boston')['temperature_celsius'], 10)
+        with self.fetchers(weather=lambda city: {'success': True, 'city': "Boston", 'temperature_celsius': 25}):
+            self.assertEqual(enrichment.get(EnrichmentData.WEATHER, 'Boston')['temperature_celsius'], 25)
+        self.assertFalse(Task.objects.exists())
+
+
+@override_settings(TASKS_EAGER=False)
+class SalesRollupTests(TestCase):
+    """Daily sales rollups (store/reports.py) against the orders they count"""
+
+    def setUp(self):
+        apparel = Category.objects.create(name="Apparel")
+        gear = Category.objects.create(name="Gear")
+        self.hoodie = Product.objects.create(
+            name="Wildcat Hoodie", description="Warm hoodie", price=40, category=apparel, location="Manhattan"
+        )
+        self.mug = Product.objects.create(
+            name="Wildcat Mug", description="Big mug", price=12, category=gear, location="Manhattan"
+        )
+        self.orders = [
+            self.order(2, [(self.hoodie, 'M', 2), (self.mug, None, 1)]),
+            self.order(2, [(self.hoodie, 'L', 1), (self.mug, '', 3)]),
+            self.order(1, [(self.hoodie, 'M', 1)]),
+            self.order(0, [(self.mug, None, 2), (self.hoodie, 'M', 4)]),
+        ]
+
+    def order(self, days_ago, lines):
+        order = Order.objects.create(
+            full_name="Ann Lee", email='ann@example.com', shipping_address="1 Main St",
+            total_amount=sum(product.price * quantity for product, _, quantity in lines)
+        )
+        for product, size, quantity in lines:
+            OrderItem.objects.create(
+                order=order, product=product, product_name=product.name, price=product.price, quantity=quantity, size=size
+            )
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return order
+
+    def expected(self):
+        """Rollup rows computed straight from the orders"""
+        days = defaultdict(lambda: [0, 0, Decimal('0')])
+        lines = defaultdict(lambda: [0, Decimal('0')])
+        for order in Order.objects.prefetch_related('items__product__category'):
+            day = timezone.localdate(order.created_at)
+            days[day][0] += 1
+            for item in order.items.all():
+                days[day][1] += item.quantity
+                days[day][2] += item.subtotal
+                category = item.product.category.name if item.product else ''
+                line = lines[(day, item.product_id, item.product_name, category, item.size or '')]
+                line[0] += item.quantity
+                line[1] += item.subtotal
+        return (
+            sorted((day, *totals) for day, totals in days.items()),
+            sorted(((*key, *totals) for key, totals in lines.items()), key=str),
+        )
+
+    def rollups(self):
+        return (
+            sorted(DailySales.objects.values_list('date', 'orders', 'units', 'revenue')),
+            sorted(DailyProductSales.objects.values_list(
+                'date', 'product_id', 'product_name', 'category_name', 'size', 'units', 'revenue'
+            ), key=str),
+        )
+
+    def test_rollups_match_orders(self):
+        for order in self.orders:
+            reports.record_order(order.id)
+        self.assertEqual(self.rollups(), self.expected())
+        self.assertFalse(Order.objects.filter(in_rollups=False).exists())
+
+        today = timezone.localdate()
+        by_category = reports.sales_by('category', today - timedelta(days=2), today)
+        self.assertEqual(
+            [(row['category_name'], row['units'], row['revenue']) for row in by_category],
+            [("Apparel", 8, Decimal('320')), ("Gear", 6, Decimal('72'))]
+        )
+
+    def test_replayed_task_doesnt_double_count(self):
+        for order in self.orders:
+            reports.record_order(order.id)
+        snapshot = self.rollups()
+        # A worker that died after the commit but before deleting its task runs it again
+        Task.objects.all().delete()
+        for order in self.orders:
+            tasks.enqueue(reports.record_order, order.id)
+        self.assertEqual(tasks.run_pending(10), (4, 0))
+        self.assertEqual(self.rollups(), snapshot)
+
+    def test_deleted_products_keep_their_rows(self):
+        reports.record_order(self.orders[0].id)
+        self.mug.delete()
+        for order in self.orders[1:]:
+            reports.record_order(order.id)
+        days, lines = self.rollups()
+        self.assertEqual(days, self.expected()[0])
+        # Told apart by name now, the category is only known to the rows counted before
+        day = timezone.localdate() - timedelta(days=2)
+        self.assertEqual(
+            [line for line in lines if line[2] == "Wildcat Mug"],
+            [(day, None, "Wildcat Mug", "Gear", '', 4, Decimal('48')),
+             (timezone.localdate(), None, "Wildcat Mug", '', '', 2, Decimal('24'))]
+        )
+
+    def test_rebuild_is_idempotent(self):
+        reports.record_order(self.orders[0].id)
+        # Edited after it was counted, and a row that shouldn't be there
+        OrderItem.objects.filter(order=self.orders[0], size='M').update(quantity=5)
+        DailySales.objects.create(date=timezone.localdate() - timedelta(days=1), orders=9, units=9, revenue=9)
+
+        out = io.StringIO()
+        call_command('rebuild_sales_rollups', days=3, stdout=out)
+        self.assertIn("from 4 orders", out.getvalue())
+        snapshot = self.rollups()
+        self.assertEqual(snapshot, self.expected())
+        self.assertFalse(Order.objects.filter(in_rollups=False).exists())
+
+        call_command('rebuild_sales_rollups', days=3, stdout=out)
+        self.assertEqual(self.rollups(), snapshot)
+        # Tasks of orders the rebuild already counted add nothing
+        for order in self.orders:
+            reports.record_order(order.id)
+        self.assertEqual(self.rollups(), snapshot)
+
+    def test_rebuild_leaves_other_days_alone(self):
+        for order in self.orders:
+            reports.record_order(order.id)
+        snapshot = self.rollups()
+        yesterday = timezone.localdate() - timedelta(days=1)
+        self.assertEqual(reports.rebuild(yesterday, yesterday), 1)
+        self.assertEqual(self.rollups(), snapshot)
+
+
+class CoPurchaseTests(TestCase):
+    """Co-purchase counts (store/copurchases.py) against the orders they count"""
+
+    def setUp(self):
+        category = Category.objects.create(name="Apparel")
+        self.hoodie, self.mug, self.cap = [
+            Product.objects.create(name=name, description=name, price=10, category=category, location="Manhattan")
+            for name in ("Wildcat Hoodie", "Wildcat Mug", "Wildcat Cap")
+        ]
+        self.first = self.order([self.hoodie, self.mug, self.cap])
+        self.second = self.order([self.hoodie, self.mug])
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+
+    def order(self, products, status='pending'):
+        order = Order.objects.create(
+            full_name="Ann Lee", email='ann@example.com', shipping_address="1 Main St", total_amount=10, status=status
+        )
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, product_name=product.name, price=10, quantity=1)
+        # Past the settle time
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(hours=1))
+        return order
+
+    def counts(self):
+        return {(row.product_id, row.other_id): row.orders for row in CoPurchase.objects.all()}
+
+    def set_status(self, order, status):
+        """Change the status through the order admin, as staff would"""
+        model_admin = admin.site._registry[Order]
+        request = RequestFactory().post('/')
+        request.user = self.user
+        order = Order.objects.get(id=order.id)
+        form = model_admin.get_form(request, order, change=True)(
+            data={**model_to_dict(order), 'status': status}, instance=order
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        model_admin.save_model(request, form.save(commit=False), form, True)
+
+    def rebuilt(self):
+        """Counts from scratch, the ones the maintained counts should match"""
+        with transaction.atomic():
+            sid = transaction.savepoint()
+            copurchases.reset()
+            copurchases.update(100)
+            counts = self.counts()
+            transaction.savepoint_rollback(sid)
+        return counts
+
+    def test_update_counts_pairs_of_orders_not_cancelled(self):
+        self.order([self.mug, self.cap], status='cancelled')
+        self.assertEqual(copurchases.update(100), 3)
+        counts = self.counts()
+        self.assertEqual(counts[(self.hoodie.id, self.mug.id)], 2)
+        self.assertEqual(counts[(self.mug.id, self.hoodie.id)], 2)
+        self.assertEqual(counts[(self.mug.id, self.cap.id)], 1)
+        self.assertEqual(len(counts), 6)
+
+    def test_cancelling_a_counted_order_removes_its_pairs(self):
+        copurchases.update(100)
+        self.set_status(self.first, 'cancelled')
+        self.assertEqual(self.counts(), {(self.hoodie.id, self.mug.id): 1, (self.mug.id, self.hoodie.id): 1})
+        self.assertEqual(self.counts(), self.rebuilt())
+
+        self.set_status(self.first, 'processing')
+        self.assertEqual(len(self.counts()), 6)
+        self.assertEqual(self.counts(), self.rebuilt())
+
+    def test_order_cancelled_before_it_is_counted_is_left_to_update(self):
+        copurchases.update(100)
+        later = self.order([self.mug, self.cap])
+        self.set_status(later, 'cancelled')
+        self.assertEqual(self.counts()[(self.mug.id, self.cap.id)], 1)
+        self.assertEqual(copurchases.update(100), 1)
+        self.assertEqual(self.counts()[(self.mug.id, self.cap.id)], 1)
+
+    def test_other_status_changes_leave_the_counts(self):
+        copurchases.update(100)
+        counts = self.counts()
+        with mock.patch.object(copurchases, 'set_cancelled') as set_cancelled:
+            self.set_status(self.first, 'shipped')
+        set_cancelled.assert_not_called()
+        self.assertEqual(self.counts(), counts)
+
+
+class PeriodicCommandTests(TestCase):
+    """--interval of the maintenance commands (store/management/periodic.py)"""
+
+    COMMANDS = [
+        'update_popularity', 'update_copurchases', 'compute_recommendations',
+        'release_reservations', 'purge_stale_carts', 'warm_enrichment',
+    ]
+
+    def test_negative_interval_is_refused(self):
+        for name in self.COMMANDS:
+            with self.subTest(command=name), self.assertRaisesMessage(CommandError, "--interval can't be negative"):
+                call_command(name, interval=-1)
+
+    def test_runs_until_interrupted(self):
+        out = io.StringIO()
+        # Ctrl+C during the second wait
+        with mock.patch.object(periodic.time, 'sleep', side_effect=[None, KeyboardInterrupt]) as sleep, \
+                mock.patch.object(periodic, 'close_old_connections') as close_old_connections:
+            call_command('release_reservations', interval=60, stdout=out)
+        self.assertEqual(out.getvalue().count("Released 0 expired reservations"), 2)
+        sleep.assert_called_with(60)
+        self.assertEqual(close_old_connections.call_count, 1)
+
+class BenchmarkCartsTests(TestCase):
+    """benchmark_carts changes the live store_cart table, so it has to be asked for"""
+
+    def test_refused_without_i_know(self):
+        cart = Cart.objects.create(session_id='shopper')
+        Cart.objects.update(updated_at=timezone.now() - timedelta(days=365))
+        with mock.patch.object(connection, 'schema_editor') as schema_editor, \
+                self.assertRaisesMessage(CommandError, "--i-know"):
+            call_command('benchmark_carts', carts=10, lookups=1, stdout=io.StringIO())
+        schema_editor.assert_not_called()
+        self.assertEqual(list(Cart.objects.all()), [cart])
@@ -2,12 +2,15 @@
 from django.urls import path
 from .views import (
     home, product_detail, search, add_product_form,
-    add_product_api, update_product_api, delete_product_api, 
-    add_review_api, update_review_api, delete_review_api,
-    get_cart, add_to_cart, update_cart_item, remove_from_cart, checkout
+    add_product_api, update_product_api, delete_product_api, checkout, sales_report
+)
+from .async_views import (
+    add_review_api, update_review_api, delete_review_api, product_like_api,
+    get_cart, add_to_cart, update_cart_item, remove_from_cart,
 )
 from .api_views import (
-    api_products, api_product_detail, api_pokemon_data, api_weather_data,
+    api_products, api_product_detail, api_product_reviews, api_trending_products, api_pokemon_data, api_weather_data,
+    search_api, search_suggest_api, sales_report_api,
 )
 
 urlpatterns = [
@@ -27,14 +30,25 @@ urlpatterns = [
     
     # Product details API endpoints
     path('api/products/', api_products, name='api_products'),
+    path('api/products/trending/', api_trending_products, name='api_trending_products'),
     path('api/products/<str:product_id>/', api_product_detail, name='api_product_detail'),
+    path('api/products/<int:product_id>/reviews/', api_product_reviews, name='api_product_reviews'),
+    path('api/products/<int:product_id>/like/', product_like_api, name='product_like_api'),
     path('api/pokemon/<str:pokemon_name>/', api_pokemon_data, name='api_pokemon_data'),
     path('api/weather/<str:city_name>/', api_weather_data, name='api_weather_data'),
 
+    # Search API endpoints
+    path('api/search/', search_api, name='search_api'),
+    path('api/search/suggest/', search_suggest_api, name='search_suggest_api'),
+
     # CRUD API endpoints - Cart
     path('api/cart/', get_cart, name='get_cart'),
     path('api/cart/add/', add_to_cart, name='add_to_cart'),
     path('api/cart/update/<int:item_id>/', update_cart_item, name='update_cart_item'),
     path('api/cart/remove/<int:item_id>/', remove_from_cart, name='remove_from_cart'),
     path('api/checkout/', checkout, name='checkout'),
+
+    # Sales reports (staff only)
+    path('reports/sales/', sales_report, name='sales_report'),
+    path('api/reports/sales/', sales_report_api, name='sales_report_api'),
 ]
\ No newline at end of file
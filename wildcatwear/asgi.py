@@ -13,4 +13,11 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wildcatwear.settings')
 
+# Persistent connections are not safe under ASGI (see DB_CONN_MAX_AGE in settings)
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+
 application = get_asgi_application()
+
+# Build the in-memory search catalog now instead of on the first searches
+from store.catalog import catalog  # noqa: E402
+catalog.warm()
@@ -30,9 +30,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-kc!dt%1xo3&))rv(3186n0y(^v(#&t(j-d0&*ichjfqql9b*0p'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DEBUG', 'True') == 'True'
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
 
 
 # Application definition
@@ -49,7 +49,17 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Serves collected static files with far-future immutable cache headers (WhiteNoise).
+    # Every middleware here works in async mode too, a sync-only one would make ASGI requests
+    # hold a thread until they are done
+    'store.middleware.StaticFilesMiddleware',
+    # Turn away search and catalog API requests while this process is overloaded, then limit
+    # each client's request rate; both before sessions so a rejected request costs nothing
+    'store.middleware.LoadSheddingMiddleware',
+    'store.middleware.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # Keeps a session's reads on the primary database right after it writes (read replicas)
+    'store.middleware.ReplicaPinMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -81,6 +91,24 @@ WSGI_APPLICATION = 'wildcatwear.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Connection reuse
+# DB_CONN_MAX_AGE: seconds a connection stays open and is reused by later requests
+# (0 = new connection for every request, "none" = keep it forever)
+#   - WSGI (runserver, gunicorn, uWSGI): 60 is safe, each worker thread holds at most one connection
+#   - ASGI (uvicorn, daphne): use 0, async requests don't reuse threads so persistent
+#     connections would pile up; wildcatwear/asgi.py defaults to 0 for that reason.
+#     Put PgBouncer in front of Postgres instead to pool connections.
+# DB_CONN_HEALTH_CHECKS: ping a reused connection before each request so a connection
+# dropped by the server (restart, idle timeout) is replaced instead of failing the request
+# DB_POOL_MODE: set to "pgbouncer" when DB_HOST points at PgBouncer in transaction pooling mode
+
+DB_CONN_MAX_AGE = os.environ.get('DB_CONN_MAX_AGE', '60')
+DB_CONN_MAX_AGE = None if DB_CONN_MAX_AGE.lower() == 'none' else int(DB_CONN_MAX_AGE)
+
+DB_CONN_HEALTH_CHECKS = os.environ.get('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'direct')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -89,9 +117,85 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASSWORD', 'judy2003'),
         'HOST': os.environ.get('DB_HOST', 'localhost'),
         'PORT': os.environ.get('DB_PORT', '5432'),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS,
+        # PgBouncer in transaction pooling mode can't keep server-side cursors open
+        'DISABLE_SERVER_SIDE_CURSORS': DB_POOL_MODE == 'pgbouncer',
     }
 }
 
+# Read replicas
+# DB_REPLICA_HOSTS: comma-separated replica hosts ("host" or "host:port") of the primary above.
+# Catalog reads (products, categories, reviews, ...) go to a random reachable replica, everything
+# else to the primary (store/routers.py). After a session writes catalog data its reads stay on
+# the primary for REPLICA_PIN_SECONDS; a replica that can't be reached is skipped for
+# REPLICA_RETRY_SECONDS.
+
+DATABASE_REPLICAS = []
+for index, replica_host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    host, _, port = replica_host.strip().partition(':')
+    alias = f'replica_{index}'
+    DATABASES[alias] = dict(
+        DATABASES['default'],
+        HOST=host,
+        PORT=port or DATABASES['default']['PORT'],
+        OPTIONS={'connect_timeout': 2},
+        TEST={'MIRROR': 'default'},
+    )
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['store.routers.PrimaryReplicaRouter']
+
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+
+REPLICA_RETRY_SECONDS = 30
+
+# Rate limiting (store/middleware.py RateLimitMiddleware)
+# Requests to the views in RATE_LIMITS (URL names) are limited per client IP and view with a
+# token bucket: (requests per second, burst). Clients over the limit get 429 with Retry-After.
+# Buckets are kept in each process's memory; set RATE_LIMIT_CACHE to a CACHES alias (Redis,
+# Memcached) to share them between processes and servers.
+# RATE_LIMIT_PROXIES: number of reverse proxies in front of the app adding to X-Forwarded-For
+# (0 uses the connection's address)
+
+RATE_LIMITS = {
+    'search_api': (5, 20),
+    'search_suggest_api': (10, 30),
+    'api_products': (5, 20),
+    'api_product_reviews': (5, 20),
+    'product_like_api': (2, 20),
+    'api_trending_products': (5, 20),
+    'add_review_api': (0.1, 5),
+    'update_review_api': (0.2, 10),
+    'delete_review_api': (0.2, 10),
+    'add_to_cart': (2, 20),
+    'update_cart_item': (2, 20),
+    'remove_from_cart': (2, 20),
+    'checkout': (0.2, 5),
+}
+
+RATE_LIMIT_CACHE = os.environ.get('RATE_LIMIT_CACHE') or None
+
+RATE_LIMIT_PROXIES = int(os.environ.get('RATE_LIMIT_PROXIES', 0))
+
+# Load shedding (store/middleware.py LoadSheddingMiddleware)
+# While a server process has more than LOAD_SHED_MAX_IN_FLIGHT requests in progress (each holds
+# a database connection, so this caps its share of the connections) or its recent average
+# response time is over LOAD_SHED_LATENCY_MS, requests to the views in LOAD_SHED_ROUTES get 503
+# with Retry-After LOAD_SHED_RETRY_AFTER seconds, leaving the database to carts and checkout.
+# 0 turns a check off.
+
+LOAD_SHED_ROUTES = {
+    'search', 'search_api', 'search_suggest_api', 'api_products',
+    'api_pokemon_data', 'api_weather_data', 'add_review_api', 'update_review_api',
+}
+
+LOAD_SHED_MAX_IN_FLIGHT = int(os.environ.get('LOAD_SHED_MAX_IN_FLIGHT', 50))
+
+LOAD_SHED_LATENCY_MS = int(os.environ.get('LOAD_SHED_LATENCY_MS', 2000))
+
+LOAD_SHED_RETRY_AFTER = 5
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -135,7 +239,217 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles') # Where collectstatic will save the files
 
+# collectstatic bundles, minifies, content-hashes and gzip/brotli compresses the files
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'store.storage.BundledStaticFilesStorage',
+    },
+}
+
+# With DEBUG=False pages only render once collectstatic has written the manifest,
+# the test runner swaps in plain storage (store/test_runner.py)
+TEST_RUNNER = 'store.test_runner.StoreTestRunner'
+
+# Per-page bundles built by collectstatic: bundle name -> source files in load order
+STATIC_BUNDLES = {
+    'css/home.bundle.css': [
+        'css/utility-styles.css',
+        'css/style.css',
+    ],
+    'css/store.bundle.css': [
+        'css/utility-styles.css',
+        'css/style.css',
+        'css/store.css',
+    ],
+    'js/home.bundle.js': [
+        'js/product-data.js',
+        'js/search.js',
+        'js/sorting.js',
+        'js/product-api.js',
+        'js/product-navigation.js',
+        'js/api-service.js',
+        'js/cart-manager.js',
+        'js/admin-tools.js',
+    ],
+    'js/search.bundle.js': [
+        'js/search.js',
+        'js/sorting.js',
+        'js/product-api.js',
+        'js/product-navigation.js',
+        'js/api-service.js',
+        'js/cart-manager.js',
+        'js/admin-tools.js',
+    ],
+    'js/store.bundle.js': [
+        'js/product-data.js',
+        'js/search.js',
+        'js/product-api.js',
+        'js/review-system.js',
+        'js/like-system.js',
+        'js/product-navigation.js',
+        'js/api-service.js',
+        'js/cart-manager.js',
+        'js/admin-tools.js',
+    ],
+}
+
+# Load the built bundles instead of the individual files (needs collectstatic)
+STATIC_BUNDLES_ENABLED = os.environ.get('STATIC_BUNDLES_ENABLED', str(not DEBUG)) == 'True'
+
+# Responsive product image derivatives (`python manage.py build_images`)
+# Resized copies of static/images are written to static/images/derived so collectstatic picks them up
+
+IMAGE_SOURCE_DIR = os.path.join(BASE_DIR, 'static', 'images')
+
+IMAGE_DERIVATIVES_DIR = os.path.join(BASE_DIR, 'static', 'images', 'derived')
+
+IMAGE_DERIVATIVES_URL = STATIC_URL + 'images/derived/'
+
+IMAGE_DERIVATIVE_WIDTHS = [320, 640, 960]
+
+IMAGE_DERIVATIVE_FORMATS = ['avif', 'webp', 'jpg']
+
+IMAGE_DERIVATIVE_QUALITY = 75
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Products shown per page on the home and search pages
+
+PRODUCTS_PER_PAGE = 24
+
+# Search suggestions (/api/search/suggest/)
+# The in-memory prefix index is rebuilt after product changes, and at least every SUGGEST_INDEX_TTL
+# seconds so each worker process picks up changes made by the others
+
+SUGGEST_INDEX_TTL = 300
+
+SUGGEST_CACHE_SIZE = 1000  # Cached prefix responses per process
+
+# Search catalog (store/catalog.py)
+# Searches filter and sort an in-memory copy of the product columns. Each process rebuilds it
+# in the background after catalog changes, and every CATALOG_TTL seconds to pick up changes
+# made by the other processes. Bulk changes (admin actions, update_popularity) bump a version
+# in the database that each process compares at most every CATALOG_VERSION_CHECK seconds.
+
+CATALOG_TTL = int(os.environ.get('CATALOG_TTL', 300))
+
+CATALOG_VERSION_CHECK = int(os.environ.get('CATALOG_VERSION_CHECK', 5))
+
+# Recommendations (store/recommendations.py)
+# Product pages recommend the products whose text is most similar, computed offline by
+# `python manage.py compute_recommendations`. New products get theirs on the next run.
+
+SIMILAR_PRODUCTS = int(os.environ.get('SIMILAR_PRODUCTS', 8))  # Neighbours stored per product
+
+# Product page documents (store.ProductPage)
+# Each product page is precomputed into one JSON document, rebuilt in the background when the
+# product, its visuals or reviews change. Documents older than PRODUCT_PAGE_TTL seconds are
+# still served but refreshed, which keeps the recommendations (other products) eventually fresh.
+
+PRODUCT_PAGE_TTL = int(os.environ.get('PRODUCT_PAGE_TTL', 3600))
+
+PRODUCT_PAGE_REVIEWS = 50  # Latest reviews kept in the document
+
+# Product reviews API (/api/products/<id>/reviews/), the product page loads more reviews from it
+
+REVIEWS_PER_PAGE = 10
+MAX_REVIEWS_PER_PAGE = 50
+
+# Product likes (store/likes.py)
+# Likes and unlikes are buffered in each process and written in batches every
+# LIKES_FLUSH_INTERVAL seconds, or once half of LIKES_BUFFER_MAX are waiting. Buffered likes are
+# lost if the process is killed. 0 writes every like right away. A buffer holds at most
+# LIKES_BUFFER_MAX likes; while the database is down, likes past that get 503.
+
+LIKES_FLUSH_INTERVAL = float(os.environ.get('LIKES_FLUSH_INTERVAL', 2))
+LIKES_BUFFER_MAX = 10000
+
+# Product popularity (store/popularity.py)
+# Product page views are counted in each process and added to hourly totals every
+# VIEWS_FLUSH_INTERVAL seconds, or once VIEWS_BUFFER_MAX products have views waiting (0 writes
+# every view right away). `python manage.py update_popularity` sets the "Most Popular" sort from
+# the views of the last POPULARITY_DAYS; /api/products/trending/ ranks the last TRENDING_HOURS,
+# again every TRENDING_TTL seconds.
+
+VIEWS_FLUSH_INTERVAL = float(os.environ.get('VIEWS_FLUSH_INTERVAL', 10))
+VIEWS_BUFFER_MAX = 10000
+
+POPULARITY_DAYS = int(os.environ.get('POPULARITY_DAYS', 7))
+
+TRENDING_HOURS = int(os.environ.get('TRENDING_HOURS', 24))
+TRENDING_TTL = 60
+TRENDING_PER_PAGE = 10
+MAX_TRENDING = 50
+
+# Background tasks (store/tasks.py)
+# Slow side effects (rating updates, product page rebuilds) are queued in the store_task table
+# and run by `python manage.py run_tasks`. With TASKS_EAGER (default in development) they run
+# in-process right after the request's transaction commits, so no worker is needed.
+
+TASKS_EAGER = os.environ.get('TASKS_EAGER', str(DEBUG)) == 'True'
+
+TASK_MAX_ATTEMPTS = 5
+
+TASK_RETRY_DELAY = 10  # Seconds before the first retry, doubled on every attempt
+
+TASK_RETRY_MAX_DELAY = 3600
+
+TASK_LOCK_TIMEOUT = 600  # A running task not finished after this many seconds is run again
+
+TASK_BATCH_SIZE = 20
+
+TASK_POLL_INTERVAL = 1.0
+
+# Third-party enrichment data (store/enrichment.py)
+# Pokemon and weather responses are stored in store_enrichmentdata, filled ahead of time by
+# `python manage.py warm_enrichment` (run it with --interval to keep the weather current).
+# ENRICHMENT_TTL is seconds per source, None never expires.
+
+POKEAPI_URL = os.environ.get('POKEAPI_URL', 'https://pokeapi.co/api/v2')
+
+OPENWEATHER_URL = os.environ.get('OPENWEATHER_URL', 'https://api.openweathermap.org/data/2.5')
+
+ENRICHMENT_TTL = {
+    'pokemon': None,
+    'weather': int(os.environ.get('WEATHER_TTL', 1800)),
+}
+
+ENRICHMENT_CONCURRENCY = 8  # Requests in flight while warming
+
+ENRICHMENT_MAX_ENTRIES = 10000  # Rows kept in the table, least recently used are evicted
+
+ENRICHMENT_MEMORY_SIZE = 1000  # Entries kept in memory per process
+
+ENRICHMENT_TOUCH_INTERVAL = 3600  # Seconds between used_at updates of a row
+
+ENRICHMENT_STALE_SECONDS = 3600  # How long past its TTL an entry is served while being refreshed
+
+ENRICHMENT_NOT_FOUND_TTL = 600  # Seconds a Pokemon or city the API doesn't know is answered with 404 before asking again
+
+# Cache stampede protection (store/stampede.py)
+# Product pages and enrichment entries are refreshed in the background slightly before they
+# expire, at random so only one request triggers it. Higher STAMPEDE_BETA refreshes earlier.
+
+STAMPEDE_BETA = 1.0
+
+# Stale cart cleanup
+# Carts untouched for CART_RETENTION_DAYS are removed by `python manage.py purge_stale_carts`,
+# CART_PURGE_BATCH_SIZE rows per transaction so the purge never holds long locks
+
+CART_RETENTION_DAYS = int(os.environ.get('CART_RETENTION_DAYS', 30))
+
+CART_PURGE_BATCH_SIZE = int(os.environ.get('CART_PURGE_BATCH_SIZE', 1000))
+
+# Stock reservations (store/inventory.py)
+# Items added to a cart hold their units for CART_RESERVATION_MINUTES; expired reservations
+# are put back by `python manage.py release_reservations`, RESERVATION_RELEASE_BATCH_SIZE per transaction
+
+CART_RESERVATION_MINUTES = int(os.environ.get('CART_RESERVATION_MINUTES', 15))
+
+RESERVATION_RELEASE_BATCH_SIZE = int(os.environ.get('RESERVATION_RELEASE_BATCH_SIZE', 500))
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wildcatwear.settings')
 
 application = get_wsgi_application()
+
+# Build the in-memory search catalog now instead of on the first searches
+from store.catalog import catalog  # noqa: E402
+catalog.warm()